@@ -0,0 +1,41 @@
+import logging
+import threading
+
+from django.db import close_old_connections
+
+
+logger = logging.getLogger(__name__)
+
+
+class PeriodicTask(threading.Thread):
+    """
+    Run `func` every `interval` seconds on a daemon thread.
+
+    Meant for light in-process housekeeping (pruning, releasing holds) when
+    no external scheduler is available. Errors are logged and the loop keeps
+    going; the thread's DB connection is recycled after every run.
+    """
+
+    def __init__(self, func, interval, name=None):
+        super().__init__(name=name or f'periodic-{func.__name__}', daemon=True)
+        self.func = func
+        self.interval = interval
+        self._stopped = threading.Event()
+
+    def run(self):
+        while not self._stopped.wait(self.interval):
+            try:
+                self.func()
+            except Exception:
+                logger.exception("Periodic task %s failed", self.name)
+            finally:
+                close_old_connections()
+
+    def stop(self):
+        self._stopped.set()
+
+
+def start_periodic_task(func, interval, name=None):
+    task = PeriodicTask(func, interval, name=name)
+    task.start()
+    return task
@@ -0,0 +1,233 @@
+"""
+Tag-versioned caching shared by the apps.
+
+Every tag ("catalog", "blog", ...) has a version counter in the cache.
+Cached data is keyed on the versions of the tags it depends on, so bumping a
+tag invalidates all of it at once, in every process sharing the cache,
+without having to find and delete individual keys.
+"""
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import Count, Max
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.http import Http404, HttpResponse, HttpResponseNotModified
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, parse_etags
+
+
+DEFAULTS = {
+    # Cache used for tag versions and cached responses; locmem unless
+    # CACHES says otherwise.
+    'CACHE_ALIAS': 'default',
+    # Seconds a cached response lives. Tags take care of invalidation, so
+    # this only bounds how long unreachable entries linger.
+    'TIMEOUT': 60 * 60,
+}
+
+
+def response_cache_options():
+    return {**DEFAULTS, **getattr(settings, 'RESPONSE_CACHE', {})}
+
+
+def get_cache():
+    return caches[response_cache_options()['CACHE_ALIAS']]
+
+
+def _tag_key(tag):
+    return f'cache-tag:{tag}'
+
+
+def _initial_version():
+    # Start from the clock rather than 1, so a flushed cache can't hand out
+    # a version some process has already built data for.
+    return time.time_ns() // 1000
+
+
+def get_tag_versions(*tags):
+    cache = get_cache()
+    keys = [_tag_key(tag) for tag in tags]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            cache.add(key, _initial_version(), timeout=None)
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+
+def get_tag_version(tag):
+    return get_tag_versions(tag)[0]
+
+
+def bump_tags(*tags):
+    cache = get_cache()
+    for tag in tags:
+        try:
+            cache.incr(_tag_key(tag))
+        except ValueError:
+            cache.add(_tag_key(tag), _initial_version(), timeout=None)
+
+
+def schedule_tag_bump(*tags):
+    """
+    Bump `tags` after the current transaction commits: a reader that
+    rebuilds from the old rows in the meantime would otherwise store stale
+    data under the new version. Inside a transaction the tags are also bumped
+    right away, so the transaction doesn't read its own stale entries.
+    """
+    if transaction.get_connection().in_atomic_block:
+        bump_tags(*tags)
+    transaction.on_commit(lambda: bump_tags(*tags))
+
+
+def invalidate_tag_on_change(tag, *models):
+    """
+    Bump `tag` whenever an instance of one of `models` is saved or deleted,
+    or one of their many-to-many relations changes.
+    """
+    def bump(sender, **kwargs):
+        if kwargs.get('action', 'post_').startswith('post_'):
+            schedule_tag_bump(tag)
+
+    for model in models:
+        label = model._meta.label_lower
+        post_save.connect(bump, sender=model, weak=False,
+                          dispatch_uid=f'cache-tag-{tag}-save-{label}')
+        post_delete.connect(bump, sender=model, weak=False,
+                            dispatch_uid=f'cache-tag-{tag}-delete-{label}')
+        for field in model._meta.local_many_to_many:
+            m2m_changed.connect(bump, sender=field.remote_field.through, weak=False,
+                                dispatch_uid=f'cache-tag-{tag}-m2m-{label}-{field.name}')
+    return bump
+
+
+class CachedResponseMixin:
+    """
+    Serve anonymous GET requests for `cache_actions` from the cache.
+
+    Responses are keyed on the URL (path and query string, where URL and
+    query-parameter API versions live), the host (serializers build absolute
+    URLs) and the Accept header (renderer and header versioning), plus the
+    versions of `cache_tags`. A hit returns the stored bytes before
+    authentication, the queryset or the serializer are touched.
+    """
+    cache_tags = ()
+    cache_actions = ('list', 'retrieve')
+
+    def dispatch(self, request, *args, **kwargs):
+        if not self._response_cacheable(request):
+            return super().dispatch(request, *args, **kwargs)
+        cache = get_cache()
+        key = self._response_cache_key(request)
+        cached = cache.get(key)
+        if cached is not None:
+            content, headers = cached
+            # Validators stored with the response are as fresh as the entry.
+            etag = headers.get('ETag')
+            if etag and etag in parse_etags(request.headers.get('If-None-Match', '')):
+                return HttpResponseNotModified(headers={'ETag': etag})
+            return HttpResponse(content, headers=headers)
+
+        response = super().dispatch(request, *args, **kwargs)
+        if response.status_code == 200 and not response.streaming:
+            response.render()
+            cache.set(key, (response.content, dict(response.items())),
+                      timeout=response_cache_options()['TIMEOUT'])
+        return response
+
+    def _response_cacheable(self, request):
+        # `self.action` is only set once DRF initializes the request.
+        action = getattr(self, 'action_map', {}).get(request.method.lower())
+        return (
+            request.method == 'GET'
+            and action in self.cache_actions
+            and 'HTTP_AUTHORIZATION' not in request.META
+        )
+
+    def _response_cache_key(self, request):
+        query = sorted(request.GET.lists())
+        parts = [
+            request.scheme,
+            request.get_host(),
+            request.path,
+            repr(query),
+            request.META.get('HTTP_ACCEPT', ''),
+            repr(get_tag_versions(*self.cache_tags)),
+        ]
+        digest = hashlib.md5('\n'.join(parts).encode(), usedforsecurity=False).hexdigest()
+        return f'response:{digest}'
+
+
+class ConditionalGetMixin:
+    """
+    ETag/Last-Modified support for `list` and `retrieve`.
+
+    Validators come from one aggregate query over the (filtered) queryset,
+    `MAX(<validator_field>)` and `COUNT(*)`, so a 304 is answered without
+    loading or serializing any object. Models without a modification
+    timestamp set `validator_field = None` and are validated against the
+    versions of `cache_tags` instead.
+
+    Lists only get an ETag, which counts the rows: deleting a row doesn't
+    move MAX(updated_at), so Last-Modified would miss it.
+    """
+    validator_field = 'updated_at'
+    cache_tags = ()
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        return self._conditional(request, queryset, super().list, args, kwargs,
+                                 use_last_modified=False)
+
+    def retrieve(self, request, *args, **kwargs):
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        try:
+            queryset = self.filter_queryset(self.get_queryset()).filter(
+                **{self.lookup_field: kwargs[lookup_url_kwarg]})
+        except (TypeError, ValueError, ValidationError):
+            # E.g. a non-numeric pk; what get_object_or_404 would answer.
+            raise Http404
+        return self._conditional(request, queryset, super().retrieve, args, kwargs)
+
+    def _conditional(self, request, queryset, handler, args, kwargs, use_last_modified=True):
+        etag, last_modified = self.get_validators(request, queryset)
+        if not use_last_modified:
+            last_modified = None
+        if etag is None:
+            return handler(request, *args, **kwargs)
+        not_modified = get_conditional_response(
+            request, etag=etag, last_modified=last_modified)
+        if not_modified is not None:
+            return not_modified
+        response = handler(request, *args, **kwargs)
+        if response.status_code == 200:
+            response['ETag'] = etag
+            if last_modified is not None:
+                response['Last-Modified'] = http_date(last_modified)
+        return response
+
+    def get_validators(self, request, queryset):
+        """Return `(etag, last_modified timestamp or None)`."""
+        renderer = getattr(request, 'accepted_renderer', None)
+        # Per-user listings (orders) must not share validators.
+        user_id = getattr(getattr(request, 'user', None), 'pk', None)
+        parts = [request.get_full_path(), getattr(renderer, 'format', ''), user_id]
+        last_modified = None
+        if self.validator_field:
+            # Drop ordering and prefetches; only the aggregate is needed.
+            stats = queryset.order_by().aggregate(
+                last=Max(self.validator_field), count=Count('pk'))
+            if not stats['count']:
+                # Let the handler answer (empty list or 404).
+                return None, None
+            last_modified = int(stats['last'].timestamp())
+            parts += [stats['count'], stats['last'].isoformat()]
+        else:
+            parts.append(get_tag_versions(*self.cache_tags))
+        digest = hashlib.md5(
+            repr(parts).encode(), usedforsecurity=False).hexdigest()
+        return f'"{digest}"', last_modified
@@ -0,0 +1,344 @@
+"""
+Resized, re-encoded copies ("derivatives") of uploaded images.
+
+Every width in WIDTHS that is narrower than the original is rendered in
+every format of FORMATS that Pillow can write. The copies are stored under
+names derived from the original, so the same upload always maps to the
+same files:
+
+    products/ring.jpg -> derivatives/products/ring/320w.webp
+
+`register(model, 'image')` generates them whenever a row gets a new file,
+once the transaction commits, on a small thread pool. What was generated
+is recorded in the model's `<field>_derivatives` JSON field (the
+manifest). SrcsetField turns the manifest into `{format: srcset}` for
+clients. Rows are saved with `update_fields`, so the usual signals
+invalidate caches and ETags. `manage.py generate_image_derivatives`
+backfills existing files on a process pool.
+
+When a row's file is replaced or cleared, or the row is deleted, the
+files of its old manifest are deleted after commit, unless another row
+still uses the same source.
+"""
+import io
+import logging
+import posixpath
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import django
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, connections, transaction
+from django.db.models.signals import post_delete, post_save
+from PIL import Image, ImageOps, UnidentifiedImageError
+from rest_framework import serializers
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'WIDTHS': (160, 320, 640, 1280),
+    # Most preferred first; formats this Pillow build can't write are skipped.
+    'FORMATS': ('avif', 'webp', 'jpeg'),
+    'QUALITY': 80,
+    # Directory under the storage root that holds the derivatives.
+    'ROOT': 'derivatives',
+    # Render on a background thread pool after upload. False renders
+    # during the request, which is what tests usually want.
+    'ASYNC': True,
+    'WORKERS': 2,
+}
+
+PIL_FORMATS = {'avif': 'AVIF', 'webp': 'WEBP', 'jpeg': 'JPEG', 'png': 'PNG'}
+EXTENSIONS = {'jpeg': 'jpg'}
+
+# {model: [(image field name, manifest field name)]}
+registry = {}
+
+_executor = None
+
+
+def image_options():
+    return {**DEFAULTS, **getattr(settings, 'IMAGE_DERIVATIVES', {})}
+
+
+def supported_formats():
+    Image.init()
+    return [fmt for fmt in image_options()['FORMATS']
+            if PIL_FORMATS.get(fmt) in Image.SAVE]
+
+
+def derivative_name(source_name, width, fmt):
+    stem = posixpath.splitext(source_name)[0]
+    extension = EXTENSIONS.get(fmt, fmt)
+    return f"{image_options()['ROOT']}/{stem}/{width}w.{extension}"
+
+
+def render_derivatives(source_name, storage=None):
+    """
+    Render and store the derivatives of `source_name` and return the
+    manifest: `{'source': name, 'width': w, 'height': h,
+    'variants': {format: {width: name}}}`.
+    """
+    storage = storage or default_storage
+    options = image_options()
+    with storage.open(source_name) as source:
+        with Image.open(source) as original:
+            image = ImageOps.exif_transpose(original)
+            image.load()
+    width, height = image.size
+    has_alpha = image.mode in ('RGBA', 'LA', 'PA') or 'transparency' in image.info
+
+    # Never upscale; a small original gets a single copy at its own width.
+    widths = [w for w in options['WIDTHS'] if w < width] or [width]
+    variants = {}
+    for target_width in widths:
+        resized = image.resize(
+            (target_width, max(1, round(height * target_width / width))),
+            Image.Resampling.LANCZOS)
+        for fmt in supported_formats():
+            copy = resized
+            if fmt == 'jpeg' or not has_alpha:
+                copy = resized.convert('RGB')
+            elif copy.mode != 'RGBA':
+                copy = copy.convert('RGBA')
+            buffer = io.BytesIO()
+            copy.save(buffer, PIL_FORMATS[fmt], quality=options['QUALITY'])
+            name = derivative_name(source_name, target_width, fmt)
+            # Overwrite in place so the name stays deterministic.
+            if storage.exists(name):
+                storage.delete(name)
+            # A concurrent render of the same file may have taken the name;
+            # record wherever the storage actually put this copy.
+            saved = storage.save(name, ContentFile(buffer.getvalue()))
+            variants.setdefault(fmt, {})[str(target_width)] = saved
+    return {'source': source_name, 'width': width, 'height': height,
+            'variants': variants}
+
+
+def is_current(manifest, source_name):
+    return bool(manifest) and manifest.get('source') == source_name
+
+
+def manifest_files(manifest):
+    return {name for widths in (manifest or {}).get('variants', {}).values()
+            for name in widths.values()}
+
+
+def discard_derivatives(model, pk, field_name, manifest, keep=()):
+    """
+    Delete the files of `manifest`, except the names in `keep`, once the
+    transaction commits. Nothing is deleted while another row of `model`
+    still uses the same source, since the names derive from it.
+    """
+    names = manifest_files(manifest) - set(keep)
+    if not names:
+        return
+    storage = model._meta.get_field(field_name).storage
+
+    def delete():
+        if model._default_manager.filter(
+                **{field_name: manifest.get('source')}).exclude(pk=pk).exists():
+            return
+        for name in names:
+            storage.delete(name)
+
+    transaction.on_commit(delete, robust=True)
+
+
+def srcsets(manifest, source_name, storage=None, request=None):
+    """`{format: "url 160w, url 320w"}`, most preferred format first."""
+    if not is_current(manifest, source_name):
+        return {}
+    storage = storage or default_storage
+    preference = list(image_options()['FORMATS'])
+    result = {}
+    for fmt in sorted(manifest['variants'], key=lambda fmt: (
+            preference.index(fmt) if fmt in preference else len(preference))):
+        widths = manifest['variants'][fmt]
+        entries = []
+        for width, name in sorted(widths.items(), key=lambda item: int(item[0])):
+            url = storage.url(name)
+            if request is not None:
+                url = request.build_absolute_uri(url)
+            entries.append(f'{url} {width}w')
+        result[fmt] = ', '.join(entries)
+    return result
+
+
+class SrcsetField(serializers.Field):
+    """
+    Read-only `{format: srcset}` for an image field, built from its
+    manifest; `{}` until the derivatives have been generated.
+    """
+
+    def __init__(self, image_field='image', **kwargs):
+        self.image_field = image_field
+        kwargs['source'] = '*'
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, instance):
+        image = getattr(instance, self.image_field)
+        manifest = getattr(instance, f'{self.image_field}_derivatives')
+        return srcsets(manifest, image.name if image else '',
+                       storage=image.storage, request=self.context.get('request'))
+
+
+def register(model, field_name):
+    """Generate derivatives whenever `model.<field_name>` gets a new file."""
+    manifest_field = f'{field_name}_derivatives'
+    registry.setdefault(model, []).append((field_name, manifest_field))
+
+    def on_save(sender, instance, update_fields=None, **kwargs):
+        if update_fields is not None and set(update_fields) <= {manifest_field}:
+            return
+        image = getattr(instance, field_name)
+        manifest = getattr(instance, manifest_field)
+        if manifest and not is_current(manifest, image.name if image else ''):
+            # Replaced or cleared: the old copies will never be served again.
+            discard_derivatives(sender, instance.pk, field_name, manifest)
+            setattr(instance, manifest_field, {})
+            sender._default_manager.filter(pk=instance.pk).update(**{manifest_field: {}})
+        schedule([instance], field_name)
+
+    def on_delete(sender, instance, **kwargs):
+        discard_derivatives(sender, instance.pk, field_name, getattr(instance, manifest_field))
+
+    uid = f'image-derivatives:{model._meta.label}.{field_name}'
+    post_save.connect(on_save, sender=model, weak=False, dispatch_uid=uid)
+    post_delete.connect(on_delete, sender=model, weak=False, dispatch_uid=uid)
+
+
+def schedule(instances, field_name):
+    """
+    Generate the derivatives of `instances` once the transaction commits.
+    For rows written without post_save, e.g. by bulk_create.
+    """
+    jobs = []
+    for instance in instances:
+        image = getattr(instance, field_name)
+        if image and not is_current(getattr(instance, f'{field_name}_derivatives'), image.name):
+            jobs.append((type(instance), instance.pk, field_name, image.name))
+    if jobs:
+        transaction.on_commit(lambda: [_submit(*job) for job in jobs], robust=True)
+
+
+def generate(model, pk, field_name, source_name=None):
+    """Render the derivatives of one row and save its manifest."""
+    instance = model._default_manager.filter(pk=pk).first()
+    if instance is None:
+        return None
+    image = getattr(instance, field_name)
+    if not image or (source_name and image.name != source_name):
+        # Deleted or replaced meanwhile; the replacement has its own job.
+        return None
+    try:
+        manifest = render_derivatives(image.name, storage=image.storage)
+    except (OSError, UnidentifiedImageError, Image.DecompressionBombError):
+        logger.warning("Could not render derivatives of %s", image.name, exc_info=True)
+        return None
+    save_manifest(instance, field_name, manifest)
+    return manifest
+
+
+def save_manifest(instance, field_name, manifest):
+    manifest_field = f'{field_name}_derivatives'
+    previous = getattr(instance, manifest_field)
+    setattr(instance, manifest_field, manifest)
+    instance.save(update_fields=[manifest_field])
+    # E.g. copies a concurrent render stored under suffixed names.
+    discard_derivatives(type(instance), instance.pk, field_name, previous,
+                        keep=manifest_files(manifest))
+
+
+def _submit(model, pk, field_name, source_name):
+    global _executor
+    if not model._meta.get_field(field_name).storage.exists(source_name):
+        # E.g. imported rows referencing files that haven't been copied yet;
+        # the backfill command picks them up later.
+        return
+    options = image_options()
+    if not options['ASYNC']:
+        generate(model, pk, field_name, source_name)
+        return
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=options['WORKERS'], thread_name_prefix='image-derivatives')
+    _executor.submit(_run_job, model, pk, field_name, source_name)
+
+
+def _run_job(*args):
+    try:
+        generate(*args)
+    except Exception:
+        logger.exception("Generating image derivatives failed")
+    finally:
+        close_old_connections()
+
+
+def backfill(models=None, processes=None, batch_size=200, force=False):
+    """
+    Generate missing or outdated derivatives of the registered fields, e.g.
+    for files uploaded before the pipeline existed. Rendering is CPU bound,
+    so files are spread over a process pool; manifests are saved from this
+    process, `batch_size` rows per transaction. Returns the number of rows
+    updated.
+    """
+    # {source name: [(model, pk, field name)]}; one render per file even if
+    # several rows point at it.
+    pending = {}
+    for model, fields in registry.items():
+        if models is not None and model not in models:
+            continue
+        for field_name, manifest_field in fields:
+            rows = model._default_manager.exclude(**{field_name: ''}).exclude(
+                **{f'{field_name}__isnull': True}).values_list('pk', field_name, manifest_field)
+            for pk, name, manifest in rows.iterator():
+                if force or not is_current(manifest, name):
+                    pending.setdefault(name, []).append((model, pk, field_name))
+    if not pending:
+        return 0
+
+    # Forked workers must not share the parent's DB connections.
+    connections.close_all()
+    updated = 0
+    with ProcessPoolExecutor(max_workers=processes, initializer=_init_worker) as pool:
+        results = pool.map(_render_in_worker, sorted(pending), chunksize=4)
+        batch = []
+        for name, manifest in results:
+            if manifest is None:
+                continue
+            batch.extend((target, manifest) for target in pending[name])
+            if len(batch) >= batch_size:
+                updated += _save_manifests(batch)
+                batch = []
+        updated += _save_manifests(batch)
+    return updated
+
+
+def _save_manifests(batch):
+    updated = 0
+    with transaction.atomic():
+        for (model, pk, field_name), manifest in batch:
+            instance = model._default_manager.filter(
+                pk=pk, **{field_name: manifest['source']}).first()
+            if instance is not None:
+                save_manifest(instance, field_name, manifest)
+                updated += 1
+    return updated
+
+
+def _init_worker():
+    # A no-op when forked; sets Django up in spawned workers.
+    django.setup()
+
+
+def _render_in_worker(source_name):
+    try:
+        return source_name, render_derivatives(source_name)
+    except (OSError, UnidentifiedImageError, Image.DecompressionBombError):
+        logger.warning("Could not render derivatives of %s", source_name, exc_info=True)
+        return source_name, None
@@ -0,0 +1,207 @@
+"""
+Serving of uploaded files under MEDIA_URL.
+
+Unlike `django.views.static.serve`, this honours single byte ranges, so
+video players can seek without re-downloading from the start. It also
+answers conditional requests from the file's stat: a strong ETag plus
+Last-Modified. Files are streamed by FileResponse. An open-ended range
+("bytes=N-", what players send) hands the WSGI server the real file,
+positioned at the start, so servers with `wsgi.file_wrapper` (gunicorn,
+uWSGI) can use sendfile.
+
+With MEDIA_SERVING['ACCEL_REDIRECT_PREFIX'] set, the view only checks the
+path and answers with X-Accel-Redirect. nginx (or another proxy that
+understands it) then serves the bytes, ranges included.
+
+Uploads come from clients and share an origin with the admin, so only
+images, video and audio are shown inline. Anything else (HTML, SVG, ...)
+is sent as an application/octet-stream attachment, and every response is
+sandboxed by its Content-Security-Policy.
+"""
+import mimetypes
+import os
+import stat
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response
+from django.utils.http import content_disposition_header, http_date, parse_http_date_safe
+from django.views.decorators.http import require_safe
+
+from .images import image_options
+
+
+DEFAULTS = {
+    # e.g. '/protected-media/'; None streams files from Django.
+    'ACCEL_REDIRECT_PREFIX': None,
+    # Uploads get unique names, so they can be cached for a while; ETags
+    # cover the rest.
+    'CACHE_CONTROL': 'public, max-age=86400',
+    # Generated files that are rewritten under the same name (image
+    # derivatives, highlight posters and renditions): always revalidated,
+    # which the ETag makes a cheap 304.
+    'MUTABLE_PATHS': ('highlight_posters/', 'highlight_renditions/'),
+    'MUTABLE_CACHE_CONTROL': 'public, no-cache',
+    # Bytes read per iteration when the server can't use sendfile.
+    'BLOCK_SIZE': 64 * 1024,
+}
+
+# Top-level types that are safe to render inline; SVG can carry scripts.
+INLINE_TYPES = ('image/', 'video/', 'audio/')
+UNSAFE_TYPES = {'image/svg+xml'}
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def media_options():
+    return {**DEFAULTS, **getattr(settings, 'MEDIA_SERVING', {})}
+
+
+def parse_range(header, size):
+    """
+    `(start, end)` (inclusive) of a single `bytes=` range, or None to send
+    the whole file. Multiple ranges are answered with the whole file, which
+    RFC 9110 allows.
+    """
+    if not header or not header.startswith('bytes='):
+        return None
+    spec = header[len('bytes='):].strip()
+    if ',' in spec or '-' not in spec:
+        return None
+    first, last = (part.strip() for part in spec.split('-', 1))
+    try:
+        if not first:
+            # The final `last` bytes.
+            length = int(last)
+            if length <= 0 or size == 0:
+                raise RangeNotSatisfiable
+            return max(size - length, 0), size - 1
+        start = int(first)
+        end = int(last) if last else size - 1
+    except ValueError:
+        return None
+    if start >= size:
+        raise RangeNotSatisfiable
+    if start > end:
+        return None
+    return start, min(end, size - 1)
+
+
+class FileRange:
+    """Read-only view of `length` bytes of a file from its current position."""
+
+    def __init__(self, file, length):
+        self.file = file
+        self.remaining = length
+
+    def read(self, size=-1):
+        if self.remaining <= 0:
+            return b''
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.file.close()
+
+
+@require_safe
+def serve_media(request, path):
+    options = media_options()
+    if any(part.startswith('.') for part in path.split('/')):
+        raise Http404
+    try:
+        fullpath = safe_join(settings.MEDIA_ROOT, path)
+        st = os.stat(fullpath)
+    except (SuspiciousFileOperation, OSError, ValueError):
+        raise Http404
+    if not stat.S_ISREG(st.st_mode):
+        raise Http404
+
+    # Strong validator: the same size and modification time in ns means
+    # the same bytes for files that are written once.
+    etag = f'"{st.st_mtime_ns:x}-{st.st_size:x}"'
+    last_modified = int(st.st_mtime)
+    response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if response is None:
+        content_type, encoding = mimetypes.guess_type(fullpath)
+        inline = (content_type is not None and content_type.startswith(INLINE_TYPES)
+                  and content_type not in UNSAFE_TYPES)
+        if not inline:
+            content_type, encoding = 'application/octet-stream', None
+        if options['ACCEL_REDIRECT_PREFIX']:
+            response = _accel_redirect(options['ACCEL_REDIRECT_PREFIX'], path, content_type)
+        else:
+            response = _file_response(request, fullpath, st.st_size, content_type,
+                                      etag, last_modified, options['BLOCK_SIZE'])
+            if encoding:
+                response.headers['Content-Encoding'] = encoding
+        if not inline:
+            response.headers['Content-Disposition'] = content_disposition_header(
+                True, os.path.basename(fullpath))
+    response.headers['Content-Security-Policy'] = 'sandbox'
+    response.headers['X-Content-Type-Options'] = 'nosniff'
+    response.headers['ETag'] = etag
+    response.headers['Last-Modified'] = http_date(st.st_mtime)
+    response.headers['Cache-Control'] = (
+        options['MUTABLE_CACHE_CONTROL'] if _is_mutable(path, options) else options['CACHE_CONTROL'])
+    return response
+
+
+def _is_mutable(path, options):
+    derivatives = image_options()['ROOT'].strip('/') + '/'
+    return path.startswith((derivatives, *options['MUTABLE_PATHS']))
+
+
+def _accel_redirect(prefix, path, content_type):
+    response = HttpResponse(content_type=content_type)
+    response.headers['X-Accel-Redirect'] = prefix.rstrip('/') + '/' + quote(path)
+    return response
+
+
+def _file_response(request, fullpath, size, content_type, etag, last_modified, block_size):
+    byte_range = None
+    if _if_range_matches(request, etag, last_modified):
+        try:
+            byte_range = parse_range(request.headers.get('Range'), size)
+        except RangeNotSatisfiable:
+            response = HttpResponse(status=416)
+            response.headers['Content-Range'] = f'bytes */{size}'
+            response.headers['Accept-Ranges'] = 'bytes'
+            return response
+
+    file = open(fullpath, 'rb')
+    if byte_range is None:
+        response = FileResponse(file, content_type=content_type)
+    else:
+        start, end = byte_range
+        file.seek(start)
+        if end == size - 1:
+            # Runs to the end of the file: pass the file itself, so the
+            # server can sendfile() from the current position.
+            body = file
+        else:
+            body = FileRange(file, end - start + 1)
+        response = FileResponse(body, content_type=content_type, status=206)
+        response.headers['Content-Length'] = str(end - start + 1)
+        response.headers['Content-Range'] = f'bytes {start}-{end}/{size}'
+    response.block_size = block_size
+    response.headers['Accept-Ranges'] = 'bytes'
+    return response
+
+
+def _if_range_matches(request, etag, last_modified):
+    """A Range only applies if If-Range, when sent, still matches the file."""
+    if_range = request.headers.get('If-Range')
+    if not if_range:
+        return True
+    if if_range.startswith('"'):
+        return if_range == etag
+    return parse_http_date_safe(if_range) == last_modified
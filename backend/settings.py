@@ -132,6 +132,17 @@ STATIC_URL = 'static/'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Serving of MEDIA_ROOT (see backend/media.py).
+MEDIA_SERVING = {
+    # Set to an internal nginx location (e.g. '/protected-media/') to let the
+    # proxy send the files via X-Accel-Redirect.
+    'ACCEL_REDIRECT_PREFIX': None,
+    'CACHE_CONTROL': 'public, max-age=86400',
+    # Image derivatives and highlight posters/renditions are rewritten in
+    # place, so clients revalidate them every time.
+    'MUTABLE_CACHE_CONTROL': 'public, no-cache',
+}
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.1/ref/settings/#default-auto-field
 
@@ -147,10 +158,127 @@ SIMPLE_JWT = {
     'BLACKLIST_AFTER_ROTATION': True,
 }
 
+# Access-token revocation checks (see users/revocation.py).
+JWT_REVOCATION = {
+    # Cache shared by all workers; point it at Redis/Memcached in production.
+    'CACHE_ALIAS': 'default',
+    # Seconds between incremental syncs from BlacklistedAccessToken.
+    'REFRESH_INTERVAL': 10,
+}
+
+# Seconds between in-process sweeps of expired OTPs and blacklisted tokens.
+# None disables the sweeper; run `manage.py prune_auth_tables` instead.
+AUTH_TABLES_SWEEP_INTERVAL = None
+
+# Active OTP codes (see users/otp_store.py).
+OTP_STORE = {
+    # Cache mirroring active codes; None checks codes against the DB only.
+    'CACHE_ALIAS': 'default',
+    'TTL': 2 * 60,
+    'MAX_ATTEMPTS': 5,
+}
+
+# Outbound OTP text messages (see users/otp_delivery.py).
+OTP_DELIVERY = {
+    # Dotted path of the SMS backend; see users/sms.py.
+    'BACKEND': 'users.sms.ConsoleSMSBackend',
+    # Send from a background thread instead of during the request.
+    'ASYNC': True,
+    'BATCH_SIZE': 50,
+    'MAX_ATTEMPTS': 5,
+    # Seconds before the first retry; doubles after every failure.
+    'RETRY_DELAY': 2,
+    'MAX_RETRY_DELAY': 60,
+}
+
+# Token-bucket limits on OTP requests (see users/throttling.py).
+OTP_THROTTLES = {
+    'CACHE_ALIAS': 'default',
+    'PHONE_RATE': '5/hour',
+    'IP_RATE': '30/hour',
+}
+
+# Score leaderboard (see users/leaderboard.py).
+LEADERBOARD = {
+    'REFRESH_INTERVAL': 300,
+    'WINDOW_TTL': 60,
+    # Weeks start on Saturday.
+    'WEEK_START': 5,
+}
+
+# Stock holds for carts (see store/reservations.py).
+STOCK_RESERVATIONS = {
+    'TTL': 15 * 60,
+    # Seconds between in-process sweeps of expired holds; None disables the
+    # sweeper, run `manage.py release_expired_reservations` instead.
+    'SWEEP_INTERVAL': None,
+    'BATCH_SIZE': 500,
+}
+
+# Resized WebP/AVIF/JPEG copies of uploaded images (see backend/images.py).
+IMAGE_DERIVATIVES = {
+    'WIDTHS': (160, 320, 640, 1280),
+    # Most preferred first; AVIF is skipped unless Pillow can write it.
+    'FORMATS': ('avif', 'webp', 'jpeg'),
+    'QUALITY': 80,
+    # Threads rendering new uploads in the background.
+    'WORKERS': 2,
+}
+
+# Multi-image product uploads (see store/uploads.py).
+IMAGE_UPLOADS = {
+    # Threads writing files to storage per request.
+    'WORKERS': 4,
+    'FORMATS': ('JPEG', 'PNG', 'WEBP', 'GIF'),
+    'MAX_PIXELS': 50_000_000,
+}
+
+# Resumable highlight video uploads (see highlights/uploads.py).
+HIGHLIGHT_UPLOADS = {
+    # Partial files; keep them on the same volume as MEDIA_ROOT so finished
+    # uploads are moved, not copied. None uses the system temp dir.
+    'DIR': None,
+    'MAX_SIZE': 1024 * 1024 * 1024,
+    # Seconds an idle upload is kept.
+    'TTL': 24 * 60 * 60,
+    # Seconds between in-process sweeps of abandoned uploads; None disables
+    # the sweeper, run `manage.py prune_highlight_uploads` instead.
+    'SWEEP_INTERVAL': None,
+}
+
+# Posters and lighter renditions of highlight media (see highlights/processing.py).
+HIGHLIGHT_PROCESSING = {
+    # highlights.transcoding.NullTranscoder leaves videos as uploaded, e.g.
+    # where ffmpeg isn't installed.
+    'TRANSCODER': 'highlights.transcoding.FFmpegTranscoder',
+    # Encoding processes per web process, run at a lower CPU priority.
+    'PROCESSES': 2,
+    'MAX_DIMENSION': 1280,
+    'VIDEO_BITRATE': '1500k',
+}
+
+# Local memory by default; point it at Redis/Memcached to share cache tags
+# and cached responses between workers.
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+}
+
+# Cached anonymous catalog, blog and highlight responses (see backend/caching.py).
+RESPONSE_CACHE = {
+    'CACHE_ALIAS': 'default',
+    'TIMEOUT': 60 * 60,
+}
+
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
         'users.authentication.CustomJWTAuthentication',
     ],
+    # Reverse proxies in front of the app. Set it (e.g. 1 behind nginx) so
+    # throttles read the client address from X-Forwarded-For; while None,
+    # the header is ignored and REMOTE_ADDR is used.
+    'NUM_PROXIES': None,
 }
 
 CORS_ALLOW_ALL_ORIGINS = True
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.6 on 2026-10-18 15:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('blog', '0004_alter_post_options_alter_post_author_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='postimage',
+            name='image_derivatives',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+    ]
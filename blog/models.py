@@ -24,6 +24,8 @@ class PostImage(models.Model):
     post = models.ForeignKey(
         Post, related_name='images', on_delete=models.CASCADE)
     image = models.ImageField(upload_to='post_images/')
+    # Manifest of resized copies, see backend/images.py.
+    image_derivatives = models.JSONField(default=dict, blank=True, editable=False)
 
     def __str__(self):
         return f"Image for {self.post.title}"
@@ -1,6 +1,7 @@
 from rest_framework import serializers
 from .models import Post, PostImage
 from django.contrib.auth import get_user_model
+from backend.images import SrcsetField
 
 User = get_user_model()
 
@@ -12,9 +13,11 @@ class UserSerializer(serializers.ModelSerializer):
 
 
 class PostImageSerializer(serializers.ModelSerializer):
+    srcset = SrcsetField()
+
     class Meta:
         model = PostImage
-        fields = ['id', 'post', 'image']
+        fields = ['id', 'post', 'image', 'srcset']
 
 
 class PostSerializer(serializers.ModelSerializer):
@@ -0,0 +1,11 @@
+from backend import images
+from backend.caching import invalidate_tag_on_change
+
+from .models import Post, PostImage
+
+
+BLOG_TAG = 'blog'
+
+invalidate_tag_on_change(BLOG_TAG, Post, PostImage)
+
+images.register(PostImage, 'image')
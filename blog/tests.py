@@ -1,4 +1,5 @@
 from django.test import TestCase
+from django.urls import reverse
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.contrib.auth import get_user_model
 from .models import Post, PostImage
@@ -48,3 +49,19 @@ class PostModelTest(TestCase):
         self.assertTrue(post_image.image)
         self.assertTrue(post_image.image.url.endswith('test_image.jpg'))
 
+
+
+class PostResponseCacheTest(TestCase):
+    def setUp(self):
+        self.post = Post.objects.create(title='Cached', content='Body')
+
+    def test_post_changes_invalidate_cached_list(self):
+        url = reverse('post-list')
+        self.client.get(url)
+        with self.assertNumQueries(0):
+            self.client.get(url)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.post.title = 'Updated'
+            self.post.save()
+        response = self.client.get(url)
+        self.assertEqual(response.json()[0]['title'], 'Updated')
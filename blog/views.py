@@ -1,8 +1,13 @@
 from rest_framework.viewsets import ReadOnlyModelViewSet, ModelViewSet
+
+from backend.caching import CachedResponseMixin
+
 from .models import Post, PostImage
 from .serializers import PostSerializer
+from .signals import BLOG_TAG
 
 
-class PostViewSet(ReadOnlyModelViewSet):
+class PostViewSet(CachedResponseMixin, ReadOnlyModelViewSet):
     queryset = Post.objects.all()
     serializer_class = PostSerializer
+    cache_tags = (BLOG_TAG,)
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Highlight, HighlightMedia
+from .models import Highlight, HighlightMedia, HighlightUpload
 
 @admin.register(Highlight)
 class HighlightAdmin(admin.ModelAdmin):
@@ -7,4 +7,18 @@ class HighlightAdmin(admin.ModelAdmin):
 
 @admin.register(HighlightMedia)
 class HighlightMediaAdmin(admin.ModelAdmin):
-    list_display = ('highlight', 'media_type', 'created_at')
+    list_display = ('highlight', 'media_type', 'processing_status', 'created_at')
+    list_filter = ('processing_status',)
+
+
+@admin.register(HighlightUpload)
+class HighlightUploadAdmin(admin.ModelAdmin):
+    # Written by the upload API only.
+    list_display = ('filename', 'highlight', 'offset', 'size', 'media', 'expires_at')
+    readonly_fields = [field.name for field in HighlightUpload._meta.fields]
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
@@ -4,3 +4,16 @@ from django.apps import AppConfig
 class HighlightsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'highlights'
+
+    def ready(self):
+        from django.conf import settings
+        from . import signals  # noqa: F401
+
+        # Optional in-process sweeper of abandoned uploads; prefer running
+        # `prune_highlight_uploads` from cron when a scheduler is available.
+        interval = getattr(settings, 'HIGHLIGHT_UPLOADS', {}).get('SWEEP_INTERVAL')
+        if interval:
+            from backend.background import start_periodic_task
+            from .uploads import prune_uploads
+            start_periodic_task(prune_uploads, interval,
+                                name='prune-highlight-uploads')
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from highlights.processing import process_pending
+
+
+class Command(BaseCommand):
+    help = (
+        "Make posters and renditions for highlight media that don't have them "
+        "yet, on a pool of worker processes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--processes', type=int, default=None,
+            help="Worker processes; HIGHLIGHT_PROCESSING['PROCESSES'] by default.")
+        parser.add_argument(
+            '--retry-failed', action='store_true',
+            help="Also retry media whose processing failed.")
+
+    def handle(self, *args, **options):
+        processed = process_pending(processes=options['processes'],
+                                    include_failed=options['retry_failed'])
+        self.stdout.write(self.style.SUCCESS(f"Processed {processed} media files."))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from highlights.uploads import prune_uploads
+
+
+class Command(BaseCommand):
+    help = "Delete highlight uploads that have expired, with their partial files."
+
+    def handle(self, *args, **options):
+        deleted = prune_uploads()
+        self.stdout.write(self.style.SUCCESS(f"Deleted {deleted} uploads."))
@@ -0,0 +1,26 @@
+# Generated by Django 5.1.6 on 2026-10-18 15:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('highlights', '0002_highlightmedia_media_type'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='highlight',
+            options={'verbose_name': 'هایلایت', 'verbose_name_plural': 'هایلایت\u200cها'},
+        ),
+        migrations.AlterModelOptions(
+            name='highlightmedia',
+            options={'verbose_name': 'محتوای هایلایت', 'verbose_name_plural': ' محتوای هایلایت\u200cها'},
+        ),
+        migrations.AddField(
+            model_name='highlight',
+            name='cover_image_derivatives',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+    ]
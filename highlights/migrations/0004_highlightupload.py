@@ -0,0 +1,34 @@
+# Generated by Django 5.1.6 on 2026-10-18 15:23
+
+import django.db.models.deletion
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('highlights', '0003_highlight_cover_image_derivatives'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='HighlightUpload',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('filename', models.CharField(max_length=255)),
+                ('size', models.PositiveBigIntegerField()),
+                ('offset', models.PositiveBigIntegerField(default=0)),
+                ('checksum', models.CharField(blank=True, max_length=64)),
+                ('media_type', models.CharField(blank=True, choices=[('image', 'Image'), ('video', 'Video')], max_length=10, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('expires_at', models.DateTimeField(db_index=True)),
+                ('highlight', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='uploads', to='highlights.highlight')),
+                ('media', models.OneToOneField(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='upload', to='highlights.highlightmedia')),
+            ],
+            options={
+                'verbose_name': 'آپلود هایلایت',
+                'verbose_name_plural': 'آپلودهای هایلایت',
+            },
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.1.6 on 2026-10-18 15:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('highlights', '0004_highlightupload'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='highlightmedia',
+            name='poster',
+            field=models.ImageField(blank=True, editable=False, upload_to='highlight_posters/'),
+        ),
+        migrations.AddField(
+            model_name='highlightmedia',
+            name='processing_status',
+            field=models.CharField(choices=[('pending', 'Pending'), ('processing', 'Processing'), ('ready', 'Ready'), ('failed', 'Failed')], default='pending', editable=False, max_length=10),
+        ),
+        migrations.AddField(
+            model_name='highlightmedia',
+            name='rendition',
+            field=models.FileField(blank=True, editable=False, upload_to='highlight_renditions/'),
+        ),
+    ]
@@ -1,9 +1,13 @@
+import uuid
+
 from django.db import models
 
 
 class Highlight(models.Model):
     title = models.CharField(max_length=255)
     cover_image = models.ImageField(upload_to='highlight_covers')
+    # Manifest of resized copies, see backend/images.py.
+    cover_image_derivatives = models.JSONField(default=dict, blank=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
 
     def __str__(self):
@@ -19,12 +23,24 @@ class HighlightMedia(models.Model):
         ('image', 'Image'),
         ('video', 'Video'),
     ]
+    PENDING, PROCESSING, READY, FAILED = 'pending', 'processing', 'ready', 'failed'
+    PROCESSING_STATUS_CHOICES = [
+        (PENDING, 'Pending'),
+        (PROCESSING, 'Processing'),
+        (READY, 'Ready'),
+        (FAILED, 'Failed'),
+    ]
 
     highlight = models.ForeignKey(
         Highlight, on_delete=models.CASCADE, related_name='media')
     media_type = models.CharField(
         max_length=10, choices=MEDIA_TYPE_CHOICES, null=True)
     media_file = models.FileField(upload_to='highlight_media/')
+    # Produced from media_file in the background, see highlights/processing.py.
+    poster = models.ImageField(upload_to='highlight_posters/', blank=True, editable=False)
+    rendition = models.FileField(upload_to='highlight_renditions/', blank=True, editable=False)
+    processing_status = models.CharField(
+        max_length=10, choices=PROCESSING_STATUS_CHOICES, default=PENDING, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
@@ -32,4 +48,36 @@ class HighlightMedia(models.Model):
         verbose_name_plural = " محتوای هایلایت‌ها"
 
     def __str__(self):
-        return f"{self.media_type.capitalize()} for {self.highlight.title}"
+        return f"{(self.media_type or 'media').capitalize()} for {self.highlight.title}"
+
+
+class HighlightUpload(models.Model):
+    """
+    A resumable upload of a highlight video, sent in chunks (see
+    highlights/uploads.py). Completing it creates the HighlightMedia.
+    """
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    highlight = models.ForeignKey(
+        Highlight, on_delete=models.CASCADE, related_name='uploads')
+    filename = models.CharField(max_length=255)
+    # Total bytes announced when the upload was started.
+    size = models.PositiveBigIntegerField()
+    # Bytes received and stored so far; the next chunk must start here.
+    offset = models.PositiveBigIntegerField(default=0)
+    # SHA-256 (hex) of the whole file, checked on completion if given.
+    checksum = models.CharField(max_length=64, blank=True)
+    media_type = models.CharField(
+        max_length=10, choices=HighlightMedia.MEDIA_TYPE_CHOICES, null=True, blank=True)
+    media = models.OneToOneField(
+        HighlightMedia, on_delete=models.SET_NULL, null=True, blank=True,
+        related_name='upload')
+    created_at = models.DateTimeField(auto_now_add=True)
+    # Pushed back by every chunk; abandoned uploads are pruned after it.
+    expires_at = models.DateTimeField(db_index=True)
+
+    class Meta:
+        verbose_name = "آپلود هایلایت"
+        verbose_name_plural = "آپلودهای هایلایت"
+
+    def __str__(self):
+        return f"Upload of {self.filename} ({self.offset}/{self.size})"
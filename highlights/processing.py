@@ -0,0 +1,220 @@
+"""
+Background processing of highlight media.
+
+Every new or replaced HighlightMedia file goes through the following,
+once the transaction commits:
+
+1. Its type is recognised from the file's own header. Whatever
+   `media_type` the client sent is overridden.
+2. A video gets a poster frame and a rendition capped in size and bitrate.
+   An image gets a smaller WebP copy. The work is done by
+   highlights/transcoding.py.
+3. The files are stored next to the original, and `processing_status`
+   becomes 'ready' ('failed' if something went wrong).
+
+Encoding runs on a process pool of PROCESSES workers at a lowered CPU
+priority. A burst of uploads only makes the queue longer; it can't take
+the CPUs from the web workers. The pool is started on first use in each
+web process. Rows are saved with `update_fields`, so the usual signals
+invalidate caches. `manage.py process_highlight_media` works through rows
+left pending, e.g. uploads from before this existed.
+
+The transcoder reads the original from a local path, so the media storage
+must be on the local filesystem (or a mount of it).
+"""
+import logging
+import multiprocessing
+import os
+import posixpath
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+
+from django.conf import settings
+from django.db import close_old_connections, connections, transaction
+
+from .models import HighlightMedia
+from .transcoding import init_worker, process_file
+from .uploads import PartialFile
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'TRANSCODER': 'highlights.transcoding.FFmpegTranscoder',
+    'FFMPEG': 'ffmpeg',
+    # Worker processes per web process.
+    'PROCESSES': 2,
+    # Added to the workers' nice value.
+    'NICENESS': 10,
+    # Longest side of renditions and posters, in pixels.
+    'MAX_DIMENSION': 1280,
+    'VIDEO_BITRATE': '1500k',
+    'AUDIO_BITRATE': '96k',
+    # Seconds into the video the poster is taken from.
+    'POSTER_AT': 1.0,
+    # WebP quality of image renditions.
+    'QUALITY': 80,
+    # Seconds one ffmpeg run may take.
+    'TIMEOUT': 10 * 60,
+    # Process on the pool after upload. False processes during the
+    # request, which is what tests usually want.
+    'ASYNC': True,
+}
+
+# Fields written by the pipeline; saving only these doesn't start it again.
+PROCESSING_FIELDS = {'media_type', 'poster', 'rendition', 'processing_status'}
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def processing_options():
+    return {**DEFAULTS, **getattr(settings, 'HIGHLIGHT_PROCESSING', {})}
+
+
+def reset_if_replaced(instance):
+    """Mark `instance` for processing again when its file has changed."""
+    if instance.pk is None:
+        return
+    stored = HighlightMedia.objects.filter(pk=instance.pk).values_list(
+        'media_file', flat=True).first()
+    if stored is not None and stored != instance.media_file.name:
+        instance.processing_status = HighlightMedia.PENDING
+        instance.poster = None
+        instance.rendition = None
+
+
+def schedule(instances):
+    """Process the pending `instances` once the transaction commits."""
+    jobs = [(instance.pk, instance.media_file.name) for instance in instances
+            if instance.media_file and instance.processing_status == HighlightMedia.PENDING]
+    if jobs:
+        transaction.on_commit(lambda: [_submit(*job) for job in jobs], robust=True)
+
+
+def _submit(pk, source_name):
+    options = processing_options()
+    storage = HighlightMedia._meta.get_field('media_file').storage
+    if not storage.exists(source_name):
+        return
+    updated = HighlightMedia.objects.filter(
+        pk=pk, media_file=source_name, processing_status=HighlightMedia.PENDING,
+    ).update(processing_status=HighlightMedia.PROCESSING)
+    if not updated:
+        # Deleted, replaced or already picked up meanwhile.
+        return
+
+    workdir = tempfile.mkdtemp(prefix='highlight-processing-')
+    job = (storage.path(source_name), workdir, options)
+    if not options['ASYNC']:
+        try:
+            result = process_file(*job)
+        except Exception as exc:
+            result = exc
+        _finish(pk, source_name, workdir, result)
+        return
+    try:
+        future = _get_pool(options).submit(process_file, *job)
+    except BrokenProcessPool:
+        # A worker died (e.g. killed for memory); start a fresh pool.
+        future = _get_pool(options, replace=True).submit(process_file, *job)
+    future.add_done_callback(partial(_finished, pk, source_name, workdir))
+
+
+def _get_pool(options, replace=False):
+    global _pool
+    with _pool_lock:
+        if replace and _pool is not None:
+            _pool.shutdown(wait=False)
+            _pool = None
+        if _pool is None:
+            # Spawned, not forked: the web process has threads and open
+            # connections that a fork would copy.
+            _pool = ProcessPoolExecutor(
+                max_workers=options['PROCESSES'],
+                mp_context=multiprocessing.get_context('spawn'),
+                initializer=init_worker, initargs=(options['NICENESS'],))
+        return _pool
+
+
+def _finished(pk, source_name, workdir, future):
+    # Called on the pool's result thread.
+    try:
+        _finish(pk, source_name, workdir, future.exception() or future.result())
+    except Exception:
+        logger.exception("Saving the processed media %s failed", source_name)
+    finally:
+        close_old_connections()
+
+
+def _finish(pk, source_name, workdir, result):
+    """Store what a job produced for row `pk` and mark it done."""
+    try:
+        with transaction.atomic():
+            media = HighlightMedia.objects.select_for_update().filter(
+                pk=pk, media_file=source_name).first()
+            if media is None:
+                return
+            save_result(media, result)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def save_result(media, result):
+    if isinstance(result, Exception) or result['media_type'] is None:
+        if isinstance(result, Exception):
+            logger.warning("Processing %s failed: %s", media.media_file.name, result)
+        else:
+            logger.warning("%s is neither an image nor a video", media.media_file.name)
+        media.processing_status = HighlightMedia.FAILED
+        media.save(update_fields=['processing_status'])
+        return
+
+    stem = posixpath.splitext(posixpath.basename(media.media_file.name))[0]
+    for field_name in ('poster', 'rendition'):
+        field_file = getattr(media, field_name)
+        if field_file:
+            field_file.delete(save=False)
+        path = result[field_name]
+        if path:
+            extension = os.path.splitext(path)[1]
+            with PartialFile(open(path, 'rb'), name=path) as content:
+                field_file.save(f'{stem}{extension}', content, save=False)
+    media.media_type = result['media_type']
+    media.processing_status = HighlightMedia.READY
+    media.save(update_fields=list(PROCESSING_FIELDS))
+
+
+def process_pending(processes=None, include_failed=False):
+    """
+    Process every pending row, ones a restart left half-done and, with
+    `include_failed`, failed ones on a process pool. Results are saved from
+    this process. Returns the number of rows processed.
+    """
+    options = processing_options()
+    statuses = [HighlightMedia.PENDING, HighlightMedia.PROCESSING]
+    if include_failed:
+        statuses.append(HighlightMedia.FAILED)
+    storage = HighlightMedia._meta.get_field('media_file').storage
+    jobs = [(pk, name) for pk, name in HighlightMedia.objects.filter(
+        processing_status__in=statuses).exclude(media_file='').values_list('pk', 'media_file')
+        if storage.exists(name)]
+    if not jobs:
+        return 0
+
+    connections.close_all()
+    processed = 0
+    with ProcessPoolExecutor(max_workers=processes or options['PROCESSES'],
+                             initializer=init_worker,
+                             initargs=(options['NICENESS'],)) as pool:
+        workdirs = [tempfile.mkdtemp(prefix='highlight-processing-') for _ in jobs]
+        futures = [pool.submit(process_file, storage.path(name), workdir, options)
+                   for (pk, name), workdir in zip(jobs, workdirs)]
+        for (pk, name), workdir, future in zip(jobs, workdirs, futures):
+            _finish(pk, name, workdir, future.exception() or future.result())
+            processed += 1
+    return processed
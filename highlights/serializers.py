@@ -1,16 +1,50 @@
 from rest_framework import serializers
-from .models import Highlight, HighlightMedia
+from backend.images import SrcsetField
+from .models import Highlight, HighlightMedia, HighlightUpload
+from .uploads import upload_options
 
 
 class HighlightMediaSerializer(serializers.ModelSerializer):
+    # The lightweight rendition when there is one, else the original.
+    src = serializers.SerializerMethodField()
+
     class Meta:
         model = HighlightMedia
-        fields = ['id', 'media_type', 'media_file', 'created_at']
+        fields = ['id', 'src', 'highlight', 'media_type', 'poster', 'rendition',
+                  'media_file', 'processing_status', 'created_at']
+
+    def get_src(self, media):
+        file = media.rendition or media.media_file
+        if not file:
+            return None
+        request = self.context.get('request')
+        return request.build_absolute_uri(file.url) if request is not None else file.url
 
 
 class HighlightSerializer(serializers.ModelSerializer):
     media = HighlightMediaSerializer(many=True, read_only=True)
+    cover_image_srcset = SrcsetField(image_field='cover_image')
 
     class Meta:
         model = Highlight
-        fields = ['id', 'title', 'cover_image', 'created_at', 'media']
+        fields = ['id', 'title', 'cover_image', 'cover_image_srcset', 'created_at', 'media']
+
+
+class HighlightUploadSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = HighlightUpload
+        fields = ['id', 'highlight', 'filename', 'size', 'checksum', 'media_type',
+                  'offset', 'media', 'created_at', 'expires_at']
+        read_only_fields = ['offset', 'media', 'created_at', 'expires_at']
+
+    def validate_size(self, size):
+        max_size = upload_options()['MAX_SIZE']
+        if size > max_size:
+            raise serializers.ValidationError(f"Files are limited to {max_size} bytes.")
+        return size
+
+    def validate_checksum(self, checksum):
+        if checksum and (len(checksum) != 64 or
+                         any(c not in '0123456789abcdef' for c in checksum.lower())):
+            raise serializers.ValidationError("Expected a hex SHA-256 digest.")
+        return checksum
@@ -0,0 +1,28 @@
+from django.db.models.signals import post_save, pre_save
+from django.dispatch import receiver
+
+from backend import images
+from backend.caching import invalidate_tag_on_change
+
+from . import processing
+from .models import Highlight, HighlightMedia
+
+
+HIGHLIGHTS_TAG = 'highlights'
+
+invalidate_tag_on_change(HIGHLIGHTS_TAG, Highlight, HighlightMedia)
+
+images.register(Highlight, 'cover_image')
+
+
+@receiver(pre_save, sender=HighlightMedia)
+def reset_replaced_media(sender, instance, update_fields=None, **kwargs):
+    if update_fields is None or 'media_file' in update_fields:
+        processing.reset_if_replaced(instance)
+
+
+@receiver(post_save, sender=HighlightMedia)
+def process_media(sender, instance, update_fields=None, **kwargs):
+    if update_fields is not None and set(update_fields) <= processing.PROCESSING_FIELDS:
+        return
+    processing.schedule([instance])
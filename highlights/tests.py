@@ -1,3 +1,383 @@
-from django.test import TestCase
+import hashlib
+import io
+import os
+import shutil
+import tempfile
+from datetime import timedelta
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import status
+from PIL import Image
+from rest_framework.test import APITestCase
+
+from . import uploads
+from .models import Highlight, HighlightMedia, HighlightUpload
+from .transcoding import BaseTranscoder, TranscodeError, sniff_media_type
+
+
+class UploadTestMixin:
+    CONTENT = bytes(range(256)) * 40  # 10 KiB
+
+    def setUp(self):
+        super().setUp()
+        self.tmp = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp)
+        override = override_settings(
+            MEDIA_ROOT=os.path.join(self.tmp, 'media'),
+            HIGHLIGHT_UPLOADS={'DIR': os.path.join(self.tmp, 'parts'), 'BUFFER_SIZE': 1024})
+        override.enable()
+        self.addCleanup(override.disable)
+        self.highlight = Highlight.objects.create(
+            title="New in", cover_image=SimpleUploadedFile('cover.jpg', b'cover'))
+
+    def part_size(self, upload):
+        return os.path.getsize(uploads.get_chunk_store().path(upload.pk))
+
+
+class UploadServiceTests(UploadTestMixin, TestCase):
+    def test_interrupted_chunk_keeps_what_arrived(self):
+        upload = uploads.initiate(self.highlight, 'clip.mp4', len(self.CONTENT))
+        # The connection drops after 3000 of the announced 6000 bytes.
+        offset = uploads.append(upload, 0, io.BytesIO(self.CONTENT[:3000]), 6000)
+        self.assertEqual(offset, 3000)
+        self.assertEqual(self.part_size(upload), 3000)
+
+        # The client resumes from the offset the server reports.
+        upload = HighlightUpload.objects.get(pk=upload.pk)
+        uploads.append(upload, upload.offset, io.BytesIO(self.CONTENT[3000:]),
+                       len(self.CONTENT) - 3000)
+        media = uploads.complete(upload)
+        with media.media_file.open('rb') as stored:
+            self.assertEqual(stored.read(), self.CONTENT)
+        self.assertFalse(os.path.exists(uploads.get_chunk_store().path(upload.pk)))
+
+    def test_interrupted_chunk_with_checksum_is_discarded(self):
+        upload = uploads.initiate(self.highlight, 'clip.mp4', len(self.CONTENT))
+        chunk = self.CONTENT[:6000]
+        with self.assertRaises(uploads.ChecksumMismatch):
+            uploads.append(upload, 0, io.BytesIO(chunk[:3000]), 6000,
+                           checksum=hashlib.sha256(chunk).hexdigest())
+        upload.refresh_from_db()
+        self.assertEqual(upload.offset, 0)
+        self.assertEqual(self.part_size(upload), 0)
+
+    def test_resending_from_an_older_offset_is_refused(self):
+        upload = uploads.initiate(self.highlight, 'clip.mp4', len(self.CONTENT))
+        uploads.append(upload, 0, io.BytesIO(self.CONTENT[:4000]), 4000)
+        with self.assertRaises(uploads.OffsetMismatch) as caught:
+            uploads.append(HighlightUpload.objects.get(pk=upload.pk), 2000,
+                           io.BytesIO(self.CONTENT[2000:4000]), 2000)
+        self.assertEqual(caught.exception.offset, 4000)
+
+    def test_stale_writer_leaves_the_newer_chunk_alone(self):
+        upload = uploads.initiate(self.highlight, 'clip.mp4', len(self.CONTENT))
+        # Loaded by a request that then waits while another chunk lands.
+        stale = HighlightUpload.objects.get(pk=upload.pk)
+        uploads.append(upload, 0, io.BytesIO(self.CONTENT[:4000]), 4000)
+        with self.assertRaises(uploads.OffsetMismatch) as caught:
+            uploads.append(stale, 0, io.BytesIO(self.CONTENT[:2000]), 2000)
+        self.assertEqual(caught.exception.offset, 4000)
+        self.assertEqual(self.part_size(upload), 4000)
+
+    def test_lost_partial_file_restarts_the_upload(self):
+        upload = uploads.initiate(self.highlight, 'clip.mp4', len(self.CONTENT))
+        uploads.append(upload, 0, io.BytesIO(self.CONTENT[:3000]), 3000)
+        os.remove(uploads.get_chunk_store().path(upload.pk))
+        with self.assertRaises(uploads.OffsetMismatch) as caught:
+            uploads.append(upload, 3000, io.BytesIO(self.CONTENT[3000:]),
+                           len(self.CONTENT) - 3000)
+        self.assertEqual(caught.exception.offset, 0)
+        upload.refresh_from_db()
+        self.assertEqual(upload.offset, 0)
+
+        uploads.append(upload, 0, io.BytesIO(self.CONTENT), len(self.CONTENT))
+        os.remove(uploads.get_chunk_store().path(upload.pk))
+        with self.assertRaises(uploads.OffsetMismatch):
+            uploads.complete(upload)
+        upload.refresh_from_db()
+        self.assertEqual(upload.offset, 0)
+        self.assertEqual(self.part_size(upload), 0)
+
+    def test_corrupt_file_must_be_sent_again(self):
+        upload = uploads.initiate(self.highlight, 'clip.mp4', len(self.CONTENT),
+                                  checksum=hashlib.sha256(self.CONTENT).hexdigest())
+        corrupted = b'\xff' + self.CONTENT[1:]
+        uploads.append(upload, 0, io.BytesIO(corrupted), len(corrupted))
+        with self.assertRaises(uploads.ChecksumMismatch):
+            uploads.complete(upload)
+        upload.refresh_from_db()
+        self.assertEqual(upload.offset, 0)
+        self.assertFalse(HighlightMedia.objects.exists())
+
+    def test_expired_uploads_are_pruned(self):
+        upload = uploads.initiate(self.highlight, 'clip.mp4', len(self.CONTENT))
+        path = uploads.get_chunk_store().path(upload.pk)
+        self.assertEqual(uploads.prune_uploads(now=timezone.now() + timedelta(days=2)), 1)
+        self.assertFalse(HighlightUpload.objects.exists())
+        self.assertFalse(os.path.exists(path))
+
+
+class UploadApiTests(UploadTestMixin, APITestCase):
+    def setUp(self):
+        super().setUp()
+        admin = get_user_model().objects.create_superuser(
+            phone_number='09120000000', password='x')
+        self.client.force_authenticate(admin)
+
+    def send(self, upload_id, offset, chunk, checksum=True):
+        headers = {'HTTP_UPLOAD_OFFSET': str(offset)}
+        if checksum:
+            headers['HTTP_UPLOAD_CHECKSUM'] = f'sha256 {hashlib.sha256(chunk).hexdigest()}'
+        return self.client.generic(
+            'PUT', reverse('highlight-upload-append', args=[upload_id]), chunk,
+            content_type='application/offset+octet-stream', **headers)
+
+    def test_chunked_upload_creates_media(self):
+        response = self.client.post(reverse('highlight-upload-list'), {
+            'highlight': self.highlight.pk, 'filename': 'clip.mp4',
+            'size': len(self.CONTENT), 'checksum': hashlib.sha256(self.CONTENT).hexdigest(),
+        })
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        upload_id = response.data['id']
+
+        for start in range(0, len(self.CONTENT), 4096):
+            response = self.send(upload_id, start, self.CONTENT[start:start + 4096])
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['offset'], len(self.CONTENT))
+
+        # A retried chunk the server already has is answered with the offset.
+        response = self.send(upload_id, 0, self.CONTENT[:4096])
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(response.data['offset'], len(self.CONTENT))
+
+        response = self.client.post(reverse('highlight-upload-complete', args=[upload_id]))
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        media = HighlightMedia.objects.get(pk=response.data['id'])
+        self.assertEqual(media.highlight, self.highlight)
+        with media.media_file.open('rb') as stored:
+            self.assertEqual(stored.read(), self.CONTENT)
+        # Completing twice returns the same media.
+        response = self.client.post(reverse('highlight-upload-complete', args=[upload_id]))
+        self.assertEqual(response.data['id'], media.pk)
+
+    def test_bad_chunk_checksum_is_rejected(self):
+        upload = uploads.initiate(self.highlight, 'clip.mp4', len(self.CONTENT))
+        response = self.client.generic(
+            'PUT', reverse('highlight-upload-append', args=[upload.pk]), self.CONTENT[:100],
+            content_type='application/offset+octet-stream', HTTP_UPLOAD_OFFSET='0',
+            HTTP_UPLOAD_CHECKSUM=f'sha256 {hashlib.sha256(b"other").hexdigest()}')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['offset'], 0)
+
+    def test_incomplete_upload_cannot_complete(self):
+        upload = uploads.initiate(self.highlight, 'clip.mp4', len(self.CONTENT))
+        self.send(upload.pk, 0, self.CONTENT[:100])
+        response = self.client.post(reverse('highlight-upload-complete', args=[upload.pk]))
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(response.data['offset'], 100)
+        self.assertEqual(self.client.get(
+            reverse('highlight-upload-detail', args=[upload.pk])).data['offset'], 100)
+
+    def test_uploads_are_for_admins(self):
+        self.client.force_authenticate(None)
+        response = self.client.post(reverse('highlight-upload-list'), {
+            'highlight': self.highlight.pk, 'filename': 'clip.mp4', 'size': 10})
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+
+class MediaServingTests(TestCase):
+    CONTENT = bytes(range(256)) * 4
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        override = override_settings(MEDIA_ROOT=self.media_root)
+        override.enable()
+        self.addCleanup(override.disable)
+        os.makedirs(os.path.join(self.media_root, 'highlight_media'))
+        with open(os.path.join(self.media_root, 'highlight_media', 'clip.mp4'), 'wb') as f:
+            f.write(self.CONTENT)
+        self.url = reverse('media', args=['highlight_media/clip.mp4'])
+
+    def get(self, **headers):
+        response = self.client.get(self.url, **headers)
+        body = b''.join(response.streaming_content) if response.streaming else response.content
+        response.close()
+        return response, body
+
+    def test_whole_file(self):
+        response, body = self.get()
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(body, self.CONTENT)
+        self.assertEqual(response['Content-Type'], 'video/mp4')
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertEqual(response['Content-Length'], str(len(self.CONTENT)))
+
+    def test_byte_ranges(self):
+        for header, start, end in [('bytes=100-199', 100, 199),
+                                   ('bytes=1000-', 1000, 1023),
+                                   ('bytes=-24', 1000, 1023),
+                                   ('bytes=1000-5000', 1000, 1023)]:
+            with self.subTest(header):
+                response, body = self.get(HTTP_RANGE=header)
+                self.assertEqual(response.status_code, 206)
+                self.assertEqual(body, self.CONTENT[start:end + 1])
+                self.assertEqual(response['Content-Range'], f'bytes {start}-{end}/1024')
+                self.assertEqual(response['Content-Length'], str(end - start + 1))
+
+    def test_unsatisfiable_range(self):
+        response, _ = self.get(HTTP_RANGE='bytes=2000-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], 'bytes */1024')
+
+    def test_conditional_requests(self):
+        response, _ = self.get()
+        etag, last_modified = response['ETag'], response['Last-Modified']
+        self.assertEqual(self.get(HTTP_IF_NONE_MATCH=etag)[0].status_code, 304)
+        self.assertEqual(self.get(HTTP_IF_MODIFIED_SINCE=last_modified)[0].status_code, 304)
+        # A stale If-Range gets the whole, current file.
+        response, body = self.get(HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE='"stale"')
+        self.assertEqual(response.status_code, 200)
+        response, body = self.get(HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE=etag)
+        self.assertEqual(body, self.CONTENT[:10])
+
+    def test_only_media_types_are_rendered_inline(self):
+        for name in ['x.html', 'x.svg', 'x.js', 'x']:
+            with self.subTest(name):
+                with open(os.path.join(self.media_root, 'highlight_media', name), 'wb') as f:
+                    f.write(b'<script>alert(1)</script>')
+                response = self.client.get(reverse('media', args=[f'highlight_media/{name}']))
+                self.assertEqual(response['Content-Type'], 'application/octet-stream')
+                self.assertTrue(response['Content-Disposition'].startswith('attachment'))
+                self.assertEqual(response['Content-Security-Policy'], 'sandbox')
+                response.close()
+        response, _ = self.get()
+        self.assertFalse(response.get('Content-Disposition', '').startswith('attachment'))
+        self.assertEqual(response['Content-Security-Policy'], 'sandbox')
+
+    def test_regenerated_files_are_revalidated(self):
+        self.assertEqual(self.get()[0]['Cache-Control'], 'public, max-age=86400')
+        os.makedirs(os.path.join(self.media_root, 'derivatives', 'products', 'ring'))
+        with open(os.path.join(self.media_root, 'derivatives', 'products', 'ring', '160w.webp'),
+                  'wb') as f:
+            f.write(self.CONTENT)
+        response = self.client.get(reverse('media', args=['derivatives/products/ring/160w.webp']))
+        self.assertEqual(response['Cache-Control'], 'public, no-cache')
+        response.close()
+
+    def test_paths_outside_media_root_are_not_served(self):
+        for path in ['../settings.py', 'highlight_media', '.hidden', 'missing.mp4']:
+            with self.subTest(path):
+                self.assertEqual(self.client.get(f'/media/{path}').status_code, 404)
+
+    @override_settings(MEDIA_SERVING={'ACCEL_REDIRECT_PREFIX': '/protected-media/'})
+    def test_accel_redirect(self):
+        response, body = self.get(HTTP_RANGE='bytes=0-9')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['X-Accel-Redirect'], '/protected-media/highlight_media/clip.mp4')
+        self.assertEqual(body, b'')
+        self.assertIn('ETag', response)
+
+
+MP4_HEADER = b'\x00\x00\x00\x18ftypmp42\x00\x00\x00\x00mp42isom'
+
+
+class FakeTranscoder(BaseTranscoder):
+    """Writes a small poster and a half-size "rendition" without ffmpeg."""
+
+    def poster(self, source, target):
+        Image.new('RGB', (8, 8), 'red').save(target, 'JPEG')
+        return True
+
+    def transcode(self, source, target):
+        with open(source, 'rb') as original:
+            data = original.read()
+        if b'broken' in data:
+            raise TranscodeError("moov atom not found")
+        with open(target, 'wb') as rendition:
+            rendition.write(data[:len(data) // 2])
+        return True
+
+
+class MediaProcessingTests(APITestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        override = override_settings(MEDIA_ROOT=self.media_root, HIGHLIGHT_PROCESSING={
+            'ASYNC': False, 'TRANSCODER': 'highlights.tests.FakeTranscoder'})
+        override.enable()
+        self.addCleanup(override.disable)
+        self.highlight = Highlight.objects.create(
+            title="New in", cover_image=SimpleUploadedFile('cover.jpg', b'cover'))
+
+    def upload(self, name, content, **fields):
+        with self.captureOnCommitCallbacks(execute=True):
+            media = HighlightMedia.objects.create(
+                highlight=self.highlight, media_file=SimpleUploadedFile(name, content), **fields)
+        media.refresh_from_db()
+        return media
+
+    def test_media_type_is_sniffed(self):
+        for header, media_type in [
+                (MP4_HEADER, 'video'),
+                (b'\x00\x00\x00\x1cftypavif', 'image'),
+                (b'\x1a\x45\xdf\xa3\x9fB\x86\x81\x01', 'video'),
+                (b'RIFF\x00\x00\x00\x00WEBPVP8 ', 'image'),
+                (b'\xff\xd8\xff\xe0\x00\x10JFIF', 'image'),
+                (b'\x89PNG\r\n\x1a\n', 'image'),
+                (b'<html>', None)]:
+            with self.subTest(header):
+                self.assertEqual(sniff_media_type(header), media_type)
+
+    def test_video_gets_poster_and_rendition(self):
+        media = self.upload('clip.mov', MP4_HEADER + bytes(1000), media_type='image')
+        self.assertEqual(media.processing_status, HighlightMedia.READY)
+        # The header wins over what the client claimed.
+        self.assertEqual(media.media_type, 'video')
+        self.assertTrue(media.poster.name.startswith('highlight_posters/clip'))
+        self.assertEqual(media.rendition.size, (len(MP4_HEADER) + 1000) // 2)
+
+        response = self.client.get(reverse('highlightmedia-detail', args=[media.pk]))
+        self.assertEqual(response.data['src'], f'http://testserver{media.rendition.url}')
+        self.assertIn(media.poster.url, response.data['poster'])
+
+    @override_settings(HIGHLIGHT_PROCESSING={
+        'ASYNC': False, 'TRANSCODER': 'highlights.transcoding.NullTranscoder'})
+    def test_without_a_transcoder_the_original_is_served(self):
+        media = self.upload('clip.mp4', MP4_HEADER + bytes(1000))
+        self.assertEqual(media.processing_status, HighlightMedia.READY)
+        self.assertFalse(media.rendition)
+        response = self.client.get(reverse('highlightmedia-detail', args=[media.pk]))
+        self.assertEqual(response.data['src'], f'http://testserver{media.media_file.url}')
+
+    def test_large_image_is_shrunk(self):
+        buffer = io.BytesIO()
+        Image.effect_noise((2000, 1000), 64).convert('RGB').save(buffer, 'PNG')
+        media = self.upload('photo.png', buffer.getvalue())
+        self.assertEqual(media.media_type, 'image')
+        self.assertTrue(media.rendition.name.endswith('.webp'))
+        with Image.open(media.rendition) as rendition:
+            self.assertEqual(rendition.size, (1280, 640))
+
+    def test_unreadable_files_fail(self):
+        for name, content in [('notes.txt', b'not a video'),
+                              ('clip.mp4', MP4_HEADER + b'broken')]:
+            with self.subTest(name):
+                media = self.upload(name, content)
+                self.assertEqual(media.processing_status, HighlightMedia.FAILED)
+                self.assertFalse(media.rendition)
+
+    def test_replaced_file_is_processed_again(self):
+        media = self.upload('clip.mp4', MP4_HEADER + bytes(1000))
+        old_rendition = media.rendition.name
+        with self.captureOnCommitCallbacks(execute=True):
+            media.media_file = SimpleUploadedFile('other.mp4', MP4_HEADER + bytes(3000))
+            media.save()
+        media.refresh_from_db()
+        self.assertEqual(media.processing_status, HighlightMedia.READY)
+        self.assertNotEqual(media.rendition.name, old_rendition)
+        self.assertEqual(media.rendition.size, (len(MP4_HEADER) + 3000) // 2)
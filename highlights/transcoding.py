@@ -0,0 +1,174 @@
+"""
+The work done on highlight media outside the request: recognising the
+file, grabbing a poster frame and encoding a lighter rendition.
+
+Everything here runs in worker processes (see highlights/processing.py)
+and only deals with local paths; nothing touches Django's settings or the
+database. The encoder is pluggable (`HIGHLIGHT_PROCESSING['TRANSCODER']`):
+FFmpegTranscoder shells out to ffmpeg, NullTranscoder does nothing and
+leaves clients with the original file.
+"""
+import os
+import subprocess
+
+from django.utils.module_loading import import_string
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+
+# Bytes of the file needed to recognise it.
+HEADER_SIZE = 32
+
+# ISO base media brands that are still images rather than video.
+IMAGE_BRANDS = {b'avif', b'avis', b'heic', b'heix', b'mif1', b'msf1'}
+
+
+class TranscodeError(Exception):
+    pass
+
+
+def sniff_media_type(header):
+    """'image', 'video' or None, from the first bytes of a file."""
+    if header.startswith((b'\xff\xd8\xff', b'\x89PNG\r\n\x1a\n', b'GIF87a', b'GIF89a')):
+        return 'image'
+    if header[:4] == b'RIFF':
+        return {b'WEBP': 'image', b'AVI ': 'video'}.get(header[8:12])
+    if header[4:8] == b'ftyp':
+        # MP4, MOV, 3GP, ... and HEIF/AVIF stills share the container.
+        return 'image' if header[8:12] in IMAGE_BRANDS else 'video'
+    if header.startswith(b'\x1a\x45\xdf\xa3'):
+        # Matroska / WebM.
+        return 'video'
+    return None
+
+
+class BaseTranscoder:
+    """
+    Turns a video into a poster frame and a rendition. Both methods write
+    `target` and return True, return False when they have nothing to
+    offer, or raise TranscodeError.
+    """
+    # Extension of the renditions.
+    extension = 'mp4'
+
+    def __init__(self, options):
+        self.options = options
+
+    def poster(self, source, target):
+        raise NotImplementedError
+
+    def transcode(self, source, target):
+        raise NotImplementedError
+
+
+class NullTranscoder(BaseTranscoder):
+    """Leaves videos as uploaded; for tests and hosts without ffmpeg."""
+
+    def poster(self, source, target):
+        return False
+
+    def transcode(self, source, target):
+        return False
+
+
+class FFmpegTranscoder(BaseTranscoder):
+    """
+    H.264/AAC MP4 no larger than MAX_DIMENSION on its long side, capped at
+    VIDEO_BITRATE, with the index up front so playback starts before the
+    download ends.
+    """
+
+    def poster(self, source, target):
+        at = self.options['POSTER_AT']
+        self._run(['-ss', str(at), '-i', source, '-frames:v', '1',
+                   '-vf', self._scale(), '-q:v', '3', target])
+        if not os.path.exists(target) and at:
+            # The clip is shorter than POSTER_AT; take its first frame.
+            self._run(['-i', source, '-frames:v', '1', '-vf', self._scale(), '-q:v', '3', target])
+        return os.path.exists(target)
+
+    def transcode(self, source, target):
+        bitrate = self.options['VIDEO_BITRATE']
+        self._run([
+            '-i', source, '-vf', self._scale(),
+            '-c:v', 'libx264', '-preset', 'veryfast', '-profile:v', 'main',
+            '-pix_fmt', 'yuv420p', '-crf', '26',
+            '-maxrate', bitrate, '-bufsize', _double(bitrate),
+            '-c:a', 'aac', '-b:a', self.options['AUDIO_BITRATE'],
+            '-movflags', '+faststart', target,
+        ])
+        return True
+
+    def _scale(self):
+        # Shrink the long side to MAX_DIMENSION, never enlarge; -2 keeps the
+        # other side even, as H.264 requires.
+        size = self.options['MAX_DIMENSION']
+        return (f"scale='if(gte(iw,ih),min({size},iw),-2)'"
+                f":'if(gte(iw,ih),-2,min({size},ih))'")
+
+    def _run(self, args):
+        command = [self.options['FFMPEG'], '-hide_banner', '-loglevel', 'error',
+                   '-nostdin', '-y', *args]
+        try:
+            subprocess.run(command, check=True, capture_output=True,
+                           timeout=self.options['TIMEOUT'])
+        except (OSError, subprocess.SubprocessError) as exc:
+            stderr = getattr(exc, 'stderr', None) or b''
+            raise TranscodeError(f"{exc} {stderr.decode(errors='replace')}".strip()) from exc
+
+
+def _double(bitrate):
+    # '1500k' -> '3000k'
+    number = bitrate.rstrip('kKmM')
+    return f'{int(number) * 2}{bitrate[len(number):]}'
+
+
+def init_worker(niceness):
+    # Workers yield the CPU to the web processes.
+    if niceness:
+        os.nice(niceness)
+
+
+def process_file(source, workdir, options):
+    """
+    Recognise `source` and write its poster and rendition into `workdir`.
+    Returns `{'media_type', 'poster', 'rendition'}`; the last two are paths,
+    or None when there is nothing better than the original to offer.
+    """
+    with open(source, 'rb') as file:
+        media_type = sniff_media_type(file.read(HEADER_SIZE))
+    result = {'media_type': media_type, 'poster': None, 'rendition': None}
+
+    if media_type == 'video':
+        transcoder = import_string(options['TRANSCODER'])(options)
+        poster = os.path.join(workdir, 'poster.jpg')
+        if transcoder.poster(source, poster):
+            result['poster'] = poster
+        rendition = os.path.join(workdir, f'rendition.{transcoder.extension}')
+        if transcoder.transcode(source, rendition):
+            result['rendition'] = rendition
+    elif media_type == 'image':
+        rendition = os.path.join(workdir, 'rendition.webp')
+        if _shrink_image(source, rendition, options):
+            result['rendition'] = rendition
+
+    # A "rendition" that isn't lighter than the upload is no use.
+    if result['rendition'] and os.path.getsize(result['rendition']) >= os.path.getsize(source):
+        result['rendition'] = None
+    return result
+
+
+def _shrink_image(source, target, options):
+    try:
+        with Image.open(source) as original:
+            if getattr(original, 'is_animated', False):
+                # A still would lose the animation.
+                return False
+            image = ImageOps.exif_transpose(original)
+            image.thumbnail((options['MAX_DIMENSION'], options['MAX_DIMENSION']))
+            if image.mode not in ('RGB', 'RGBA'):
+                has_alpha = image.mode in ('LA', 'PA') or 'transparency' in image.info
+                image = image.convert('RGBA' if has_alpha else 'RGB')
+            image.save(target, 'WEBP', quality=options['QUALITY'])
+    except (OSError, UnidentifiedImageError, Image.DecompressionBombError) as exc:
+        raise TranscodeError(f"Could not shrink {source}: {exc}") from exc
+    return True
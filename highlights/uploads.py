@@ -0,0 +1,303 @@
+"""
+Resumable, chunked uploads of highlight media.
+
+1. `initiate` records the file's name, total size and optional SHA-256.
+2. `append` streams one chunk from the request body straight to a partial
+   file on disk, at the offset the client says it starts at. The offset
+   must equal what the server already has. After a dropped connection the
+   client asks for the current offset and continues from there.
+3. `complete` checks the size and checksum and moves the file into media
+   storage as a new HighlightMedia.
+
+A chunk sent with a checksum is all or nothing. Without one, whatever
+arrived before the connection dropped is kept. The offset is only recorded
+once the bytes are on disk, so a crash can't lose data the server claims to
+have. Partial files live in the chunk store (`HIGHLIGHT_UPLOADS['BACKEND']`);
+LocalChunkStore keeps them in a directory on local disk. If a partial file
+disappears (say a temp dir cleaner got to it), the upload restarts from 0:
+the client is told so through the usual offset mismatch.
+"""
+import fcntl
+import hashlib
+import os
+import tempfile
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files import File
+from django.db import transaction
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from .models import HighlightMedia, HighlightUpload
+
+
+DEFAULTS = {
+    'BACKEND': 'highlights.uploads.LocalChunkStore',
+    # Directory of partial files; None uses a directory under the system
+    # temp dir. On the same volume as MEDIA_ROOT, completed files are moved
+    # into place instead of copied.
+    'DIR': None,
+    # Largest file accepted, in bytes.
+    'MAX_SIZE': 1024 * 1024 * 1024,
+    # Seconds an upload may sit idle before it is pruned.
+    'TTL': 24 * 60 * 60,
+    # Bytes read from the request per write.
+    'BUFFER_SIZE': 64 * 1024,
+    # Seconds between in-process sweeps of abandoned uploads. None disables
+    # the sweeper; run `manage.py prune_highlight_uploads` instead.
+    'SWEEP_INTERVAL': None,
+}
+
+
+class UploadError(Exception):
+    pass
+
+
+class OffsetMismatch(UploadError):
+    def __init__(self, offset):
+        # Where the client should continue from.
+        self.offset = offset
+        super().__init__(f"The upload continues at byte {offset}.")
+
+
+class ChecksumMismatch(UploadError):
+    pass
+
+
+class UploadBusy(UploadError):
+    pass
+
+
+class UploadCompleted(UploadError):
+    pass
+
+
+class PartialFileMissing(UploadError):
+    pass
+
+
+def upload_options():
+    return {**DEFAULTS, **getattr(settings, 'HIGHLIGHT_UPLOADS', {})}
+
+
+def get_chunk_store():
+    options = upload_options()
+    directory = options['DIR'] or os.path.join(tempfile.gettempdir(), 'highlight-uploads')
+    return import_string(options['BACKEND'])(directory)
+
+
+class PartialFile(File):
+    # Lets FileSystemStorage move the file into place rather than copy it.
+    def temporary_file_path(self):
+        return self.name
+
+
+class PartWriter:
+    """A locked partial file; nothing is changed before `start`."""
+
+    def __init__(self, file):
+        self.file = file
+        self.size = os.fstat(file.fileno()).st_size
+        self.offset = None
+
+    def start(self, offset):
+        """Drop anything after `offset` and continue writing there."""
+        self.file.seek(offset)
+        self.file.truncate()
+        self.offset = offset
+
+    def write(self, data):
+        self.file.write(data)
+
+    def sync(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+
+class LocalChunkStore:
+    """Partial uploads as files named after the upload id, in `directory`."""
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def path(self, upload_id):
+        return os.path.join(self.directory, f'{upload_id}.part')
+
+    def create(self, upload_id):
+        os.makedirs(self.directory, exist_ok=True)
+        open(self.path(upload_id), 'wb').close()
+
+    @contextmanager
+    def writer(self, upload_id):
+        """
+        Yield a PartWriter for the upload. One writer per upload at a time;
+        if the block raises after `start(offset)`, the file is cut back to
+        `offset`. A block that raises before `start` leaves the file alone.
+        """
+        with self._open(upload_id, 'r+b') as part:
+            try:
+                fcntl.flock(part, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                raise UploadBusy("Another chunk of this upload is being written.")
+            writer = PartWriter(part)
+            try:
+                yield writer
+            except BaseException:
+                if writer.offset is not None:
+                    part.truncate(writer.offset)
+                raise
+
+    def checksum(self, upload_id):
+        digest = hashlib.sha256()
+        with self._open(upload_id, 'rb') as part:
+            for block in iter(lambda: part.read(1024 * 1024), b''):
+                digest.update(block)
+        return digest.hexdigest()
+
+    def open(self, upload_id):
+        return PartialFile(self._open(upload_id, 'rb'), name=self.path(upload_id))
+
+    def delete(self, upload_id):
+        try:
+            os.remove(self.path(upload_id))
+        except FileNotFoundError:
+            pass
+
+    def _open(self, upload_id, mode):
+        try:
+            return open(self.path(upload_id), mode)
+        except FileNotFoundError:
+            raise PartialFileMissing("The partial file of the upload is gone.")
+
+
+def initiate(highlight, filename, size, checksum='', media_type=None):
+    upload = HighlightUpload.objects.create(
+        highlight=highlight, filename=os.path.basename(filename), size=size,
+        checksum=checksum.lower(), media_type=media_type,
+        expires_at=timezone.now() + timedelta(seconds=upload_options()['TTL']))
+    get_chunk_store().create(upload.pk)
+    return upload
+
+
+def append(upload, offset, stream, length, checksum=None):
+    """
+    Write `length` bytes read from `stream` at `offset` and return the new
+    offset. `checksum` is the SHA-256 (hex) of the chunk.
+    """
+    options = upload_options()
+    if upload.media_id:
+        raise UploadCompleted("The upload is already complete.")
+    if offset != upload.offset:
+        raise OffsetMismatch(upload.offset)
+    if offset + length > upload.size:
+        raise UploadError("The chunk goes past the announced size.")
+
+    store = get_chunk_store()
+    try:
+        with store.writer(upload.pk) as part:
+            # Another chunk may have landed while this request waited for the
+            # lock; check before touching the file.
+            upload.refresh_from_db(fields=['offset', 'media'])
+            if upload.media_id:
+                raise UploadCompleted("The upload is already complete.")
+            if upload.offset != offset:
+                raise OffsetMismatch(upload.offset)
+            if part.size < offset:
+                # Bytes the server confirmed are gone; continue from what is left.
+                HighlightUpload.objects.filter(pk=upload.pk).update(offset=part.size)
+                raise OffsetMismatch(part.size)
+
+            part.start(offset)
+            digest = hashlib.sha256()
+            received = 0
+            for block in _read(stream, length, options['BUFFER_SIZE']):
+                part.write(block)
+                digest.update(block)
+                received += len(block)
+            if checksum is not None and (received != length or digest.hexdigest() != checksum.lower()):
+                raise ChecksumMismatch("The chunk doesn't match its checksum.")
+
+            part.sync()
+            HighlightUpload.objects.filter(pk=upload.pk, offset=offset).update(
+                offset=offset + received,
+                expires_at=timezone.now() + timedelta(seconds=options['TTL']))
+    except PartialFileMissing:
+        _restart(upload, store)
+    upload.offset = offset + received
+    return upload.offset
+
+
+def complete(upload):
+    """Turn a fully received upload into a HighlightMedia; safe to repeat."""
+    store = get_chunk_store()
+    with transaction.atomic():
+        upload = HighlightUpload.objects.select_for_update().select_related('media').get(
+            pk=upload.pk)
+        if upload.media_id:
+            return upload.media
+        if upload.offset != upload.size:
+            raise OffsetMismatch(upload.offset)
+        try:
+            corrupt = bool(upload.checksum) and store.checksum(upload.pk) != upload.checksum
+            if corrupt:
+                # Some chunk was corrupted without a chunk checksum to catch
+                # it; the file has to be sent again.
+                with store.writer(upload.pk) as part:
+                    part.start(0)
+                    HighlightUpload.objects.filter(pk=upload.pk).update(offset=0)
+            else:
+                media = HighlightMedia(highlight=upload.highlight, media_type=upload.media_type)
+                with store.open(upload.pk) as content:
+                    media.media_file.save(upload.filename, content, save=False)
+                media.save()
+                upload.media = media
+                upload.save(update_fields=['media'])
+        except PartialFileMissing:
+            missing = True
+        else:
+            missing = False
+    if missing:
+        _restart(upload, store)
+    if corrupt:
+        raise ChecksumMismatch("The file doesn't match its checksum.")
+    store.delete(upload.pk)
+    return media
+
+
+def _restart(upload, store):
+    """Start a lost partial file over and tell the client to resend from 0."""
+    store.create(upload.pk)
+    HighlightUpload.objects.filter(pk=upload.pk).update(offset=0)
+    upload.offset = 0
+    raise OffsetMismatch(0)
+
+
+def abort(upload):
+    get_chunk_store().delete(upload.pk)
+    upload.delete()
+
+
+def prune_uploads(now=None):
+    """Delete uploads past their expiry, with their partial files."""
+    now = now or timezone.now()
+    deleted = 0
+    for upload in HighlightUpload.objects.filter(expires_at__lt=now).iterator():
+        abort(upload)
+        deleted += 1
+    return deleted
+
+
+def _read(stream, length, buffer_size):
+    remaining = length
+    while remaining > 0:
+        try:
+            block = stream.read(min(buffer_size, remaining))
+        except OSError:
+            # The client went away mid-chunk.
+            return
+        if not block:
+            return
+        remaining -= len(block)
+        yield block
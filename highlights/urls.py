@@ -1,10 +1,11 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import HighlightViewSet, HighlightMediaViewSet
+from .views import HighlightViewSet, HighlightMediaViewSet, HighlightUploadViewSet
 
 router = DefaultRouter()
 router.register(r'highlights', HighlightViewSet)
 router.register(r'highlight-media', HighlightMediaViewSet)
+router.register(r'uploads', HighlightUploadViewSet, basename='highlight-upload')
 
 urlpatterns = [
     path('', include(router.urls))
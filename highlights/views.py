@@ -1,13 +1,91 @@
-from rest_framework import viewsets
-from .serializers import HighlightMediaSerializer, HighlightSerializer
-from .models import HighlightMedia, Highlight
+from rest_framework import mixins, permissions, status, viewsets
+from rest_framework.decorators import action
+from rest_framework.response import Response
 
+from backend.caching import CachedResponseMixin
 
-class HighlightViewSet(viewsets.ModelViewSet):
+from . import uploads
+from .serializers import HighlightMediaSerializer, HighlightSerializer, HighlightUploadSerializer
+from .models import HighlightMedia, Highlight, HighlightUpload
+from .signals import HIGHLIGHTS_TAG
+
+
+class HighlightViewSet(CachedResponseMixin, viewsets.ModelViewSet):
     queryset = Highlight.objects.all()
     serializer_class = HighlightSerializer
+    cache_tags = (HIGHLIGHTS_TAG,)
 
 
-class HighlightMediaViewSet(viewsets.ModelViewSet):
+class HighlightMediaViewSet(CachedResponseMixin, viewsets.ModelViewSet):
     queryset = HighlightMedia.objects.all()
-    serializer_class = HighlightSerializer
+    serializer_class = HighlightMediaSerializer
+    cache_tags = (HIGHLIGHTS_TAG,)
+
+
+class HighlightUploadViewSet(mixins.CreateModelMixin,
+                             mixins.RetrieveModelMixin,
+                             mixins.DestroyModelMixin,
+                             viewsets.GenericViewSet):
+    """
+    Resumable uploads of highlight videos (see highlights/uploads.py).
+
+    - `POST uploads/` with highlight, filename, size and optionally the
+      file's SHA-256 `checksum` starts an upload.
+    - `PUT uploads/<id>/append/` sends the next chunk as the raw request
+      body, with `Upload-Offset: <offset>` and optionally
+      `Upload-Checksum: sha256 <hex digest of the chunk>`.
+    - `GET uploads/<id>/` tells where to resume after an interruption.
+    - `POST uploads/<id>/complete/` creates the HighlightMedia.
+    """
+    queryset = HighlightUpload.objects.all()
+    serializer_class = HighlightUploadSerializer
+    permission_classes = [permissions.IsAdminUser]
+
+    def perform_create(self, serializer):
+        serializer.instance = uploads.initiate(**serializer.validated_data)
+
+    def perform_destroy(self, instance):
+        uploads.abort(instance)
+
+    @action(detail=True, methods=['put'])
+    def append(self, request, pk=None):
+        upload = self.get_object()
+        try:
+            offset = int(request.headers['Upload-Offset'])
+            length = int(request.headers['Content-Length'])
+        except (KeyError, ValueError):
+            return Response({"error": "Upload-Offset and Content-Length are required."},
+                            status=status.HTTP_400_BAD_REQUEST)
+        checksum = request.headers.get('Upload-Checksum')
+        if checksum is not None:
+            algorithm, _, checksum = checksum.partition(' ')
+            if algorithm.lower() != 'sha256':
+                return Response({"error": "Only sha256 checksums are supported."},
+                                status=status.HTTP_400_BAD_REQUEST)
+        try:
+            # The body is read straight from the request stream; DRF's
+            # parsers (and their buffering) are never involved.
+            offset = uploads.append(upload, offset, request.stream, length, checksum=checksum)
+        except uploads.UploadError as exc:
+            return self._error(exc, upload)
+        return Response({'offset': offset})
+
+    @action(detail=True, methods=['post'])
+    def complete(self, request, pk=None):
+        upload = self.get_object()
+        try:
+            media = uploads.complete(upload)
+        except uploads.UploadError as exc:
+            return self._error(exc, upload)
+        return Response(HighlightMediaSerializer(media, context={'request': request}).data,
+                        status=status.HTTP_201_CREATED)
+
+    def _error(self, exc, upload):
+        if isinstance(exc, uploads.OffsetMismatch):
+            return Response({"error": str(exc), 'offset': exc.offset},
+                            status=status.HTTP_409_CONFLICT)
+        if isinstance(exc, (uploads.UploadBusy, uploads.UploadCompleted)):
+            return Response({"error": str(exc)}, status=status.HTTP_409_CONFLICT)
+        upload.refresh_from_db(fields=['offset'])
+        return Response({"error": str(exc), 'offset': upload.offset},
+                        status=status.HTTP_400_BAD_REQUEST)
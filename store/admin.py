@@ -11,9 +11,32 @@ from .models import (
     Order,
     OrderItem,
     Cart,
-    CartItem
+    CartItem,
+    StockReservation,
+    DailySales,
+    DailyCollectionSales,
+    DailyVariantSales
 )
 
+# -----------------------------------------------------------
+# Shared form-field querysets
+# Variant and attribute value labels walk product, attribute and collection;
+# load those up front so select widgets don't query once per option.
+# -----------------------------------------------------------
+
+
+class VariantLabelMixin:
+    def formfield_for_foreignkey(self, db_field, request, **kwargs):
+        if db_field.related_model is ProductVariant:
+            kwargs['queryset'] = ProductVariant.objects.with_display_data()
+        return super().formfield_for_foreignkey(db_field, request, **kwargs)
+
+    def formfield_for_manytomany(self, db_field, request, **kwargs):
+        if db_field.related_model is AttributeValue:
+            kwargs['queryset'] = AttributeValue.objects.select_related(
+                'attribute__collection')
+        return super().formfield_for_manytomany(db_field, request, **kwargs)
+
 # -----------------------------------------------------------
 # Inline for AttributeValue (used in the Attribute admin)
 # -----------------------------------------------------------
@@ -58,11 +81,14 @@ class ProductImageInline(admin.TabularInline):
 # -----------------------------------------------------------
 
 
-class ProductVariantInline(admin.TabularInline):
+class ProductVariantInline(VariantLabelMixin, admin.TabularInline):
     model = ProductVariant
     extra = 1
     filter_horizontal = ('attributes',)  # Easier M2M selection
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).with_display_data()
+
 # -----------------------------------------------------------
 # Product Admin
 # -----------------------------------------------------------
@@ -112,9 +138,9 @@ class ProductVariantAdminForm(forms.ModelForm):
             provided_attribute_ids = set()
             if attributes:
                 for attr_value in attributes:
-                    # Ensure the attribute field is available on each AttributeValue.
-                    if getattr(attr_value, 'attribute', None):
-                        provided_attribute_ids.add(attr_value.attribute.id)
+                    # Read the FK column directly; no query per value.
+                    if attr_value.attribute_id:
+                        provided_attribute_ids.add(attr_value.attribute_id)
             missing = required_attribute_ids - provided_attribute_ids
             if missing:
                 raise ValidationError({
@@ -128,13 +154,17 @@ class ProductVariantAdminForm(forms.ModelForm):
 
 
 @admin.register(ProductVariant)
-class ProductVariantAdmin(admin.ModelAdmin):
+class ProductVariantAdmin(VariantLabelMixin, admin.ModelAdmin):
     form = ProductVariantAdminForm
     list_display = ('product', 'stock', 'attributes_display')
     search_fields = ('product__title',)
     list_filter = ('product__collection',)
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).with_display_data()
+
     def attributes_display(self, obj):
+        # Uses the values prefetched by get_queryset.
         return ", ".join([str(val) for val in obj.attributes.all()])
     attributes_display.short_description = 'Attributes'
 
@@ -143,45 +173,130 @@ class ProductVariantAdmin(admin.ModelAdmin):
 # -----------------------------------------------------------
 
 
-class OrderItemInline(admin.TabularInline):
+class OrderItemInline(VariantLabelMixin, admin.TabularInline):
     model = OrderItem
     extra = 0  # No extra blank rows
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related(
+            'product_variant__product').prefetch_related(
+            ProductVariant.display_prefetch('product_variant__'))
+
 
 @admin.register(Order)
 class OrderAdmin(admin.ModelAdmin):
     inlines = [OrderItemInline]
     list_display = ('id', 'user', 'status', 'total', 'created_at')
+    list_select_related = ('user',)
     list_filter = ('status', 'created_at')
     # Assuming the User model uses phone_number.
     search_fields = ('user__phone_number',)
 
 
 @admin.register(OrderItem)
-class OrderItemAdmin(admin.ModelAdmin):
+class OrderItemAdmin(VariantLabelMixin, admin.ModelAdmin):
     list_display = ('order', 'product_variant', 'quantity', 'price')
     search_fields = ('order__user__phone_number',
                      'product_variant__product__title')
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related(
+            'order__user', 'product_variant__product').prefetch_related(
+            ProductVariant.display_prefetch('product_variant__'))
+
 # -----------------------------------------------------------
 # Cart and CartItem Admin
 # -----------------------------------------------------------
 
 
-class CartItemInline(admin.TabularInline):
+class CartItemInline(VariantLabelMixin, admin.TabularInline):
     model = CartItem
     extra = 0
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related(
+            'product_variant__product').prefetch_related(
+            ProductVariant.display_prefetch('product_variant__'))
+
 
 @admin.register(Cart)
 class CartAdmin(admin.ModelAdmin):
     inlines = [CartItemInline]
     list_display = ('id', 'user', 'session_key', 'created_at')
+    list_select_related = ('user',)
     search_fields = ('user__phone_number', 'session_key')
 
 
 @admin.register(CartItem)
-class CartItemAdmin(admin.ModelAdmin):
+class CartItemAdmin(VariantLabelMixin, admin.ModelAdmin):
     list_display = ('cart', 'product_variant', 'quantity')
     search_fields = ('cart__user__phone_number',
                      'product_variant__product__title')
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related(
+            'cart__user', 'product_variant__product').prefetch_related(
+            ProductVariant.display_prefetch('product_variant__'))
+
+
+@admin.register(StockReservation)
+class StockReservationAdmin(admin.ModelAdmin):
+    # Holds are managed by store.reservations, which also keeps
+    # ProductVariant.reserved in step; the admin only shows them.
+    list_display = ('cart', 'product_variant', 'quantity', 'expires_at')
+    list_filter = ('expires_at',)
+    search_fields = ('cart__user__phone_number', 'product_variant__product__title')
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related(
+            'cart__user', 'product_variant__product').prefetch_related(
+            ProductVariant.display_prefetch('product_variant__'))
+
+# -----------------------------------------------------------
+# Sales rollups (read-only; maintained by store.reporting)
+# -----------------------------------------------------------
+
+
+class RollupAdmin(admin.ModelAdmin):
+    date_hierarchy = 'date'
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(DailySales)
+class DailySalesAdmin(RollupAdmin):
+    list_display = ('date', 'orders', 'items', 'revenue')
+
+
+@admin.register(DailyCollectionSales)
+class DailyCollectionSalesAdmin(RollupAdmin):
+    list_display = ('date', 'collection', 'items', 'revenue')
+    list_filter = ('collection',)
+    list_select_related = ('collection',)
+
+
+@admin.register(DailyVariantSales)
+class DailyVariantSalesAdmin(RollupAdmin):
+    list_display = ('date', 'product_variant', 'quantity', 'revenue')
+    search_fields = ('product_variant__product__title',)
+
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related(
+            'product_variant__product').prefetch_related(
+            ProductVariant.display_prefetch('product_variant__'))
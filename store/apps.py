@@ -4,3 +4,17 @@ from django.apps import AppConfig
 class StoreConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'store'
+
+    def ready(self):
+        from django.conf import settings
+        # Register the signal receivers that keep derived data in sync.
+        from . import signals  # noqa: F401
+
+        # Optional in-process sweeper for expired stock holds; prefer running
+        # `release_expired_reservations` from cron when a scheduler is available.
+        interval = getattr(settings, 'STOCK_RESERVATIONS', {}).get('SWEEP_INTERVAL')
+        if interval:
+            from backend.background import start_periodic_task
+            from .reservations import release_expired
+            start_periodic_task(release_expired, interval,
+                                name='release-expired-reservations')
@@ -0,0 +1,23 @@
+from backend.caching import bump_tags, get_tag_version, schedule_tag_bump
+
+
+# Cache tag covering the whole catalog: collections, attributes, products,
+# variants and images.
+CATALOG_TAG = 'catalog'
+
+
+def get_catalog_version():
+    """
+    Counter bumped after every committed catalog change. Derived data
+    (facet index, filter summaries, cached responses) is keyed on it, so a
+    bump invalidates it in every process that shares the cache.
+    """
+    return get_tag_version(CATALOG_TAG)
+
+
+def bump_catalog_version():
+    bump_tags(CATALOG_TAG)
+
+
+def schedule_catalog_version_bump():
+    schedule_tag_bump(CATALOG_TAG)
@@ -0,0 +1,135 @@
+"""
+Cart lookup and line changes.
+
+Signed-in users have one cart; anonymous visitors have one per session.
+Lines are unique per (cart, variant), so every change is an upsert. On
+login the session's cart is folded into the user's cart.
+"""
+from django.db import IntegrityError, transaction
+from django.db.models import Case, F, Prefetch, When
+
+from .checkout import OutOfStockError
+from .models import Cart, CartItem, ProductVariant, StockReservation
+from .reservations import reserve
+
+
+def cart_queryset():
+    """
+    Carts with everything CartSerializer renders: four queries in all,
+    however many lines the cart has.
+    """
+    items = CartItem.objects.select_related('product_variant__product').prefetch_related(
+        'product_variant__attributes', 'product_variant__product__images').order_by('id')
+    return Cart.objects.prefetch_related(Prefetch('items', queryset=items))
+
+
+def get_cart(request, create=False):
+    """
+    The cart of the signed-in user or of the anonymous session, or None
+    when there is none yet and `create` is false.
+    """
+    if request.user.is_authenticated:
+        lookup = {'user': request.user}
+    else:
+        if not request.session.session_key:
+            if not create:
+                return None
+            request.session.save()
+        lookup = {'session_key': request.session.session_key}
+    cart = cart_queryset().filter(**lookup).first()
+    if cart is None and create:
+        # The unique constraints make concurrent first requests share a cart.
+        cart, _ = Cart.objects.get_or_create(**lookup)
+    return cart
+
+
+def add_item(cart, variant_id, quantity):
+    """Add `quantity` of a variant, on top of what the cart already has."""
+    with transaction.atomic():
+        current = CartItem.objects.filter(
+            cart=cart, product_variant_id=variant_id).values_list('quantity', flat=True).first()
+        _check_available(cart, variant_id, (current or 0) + quantity)
+        _upsert(cart, variant_id, quantity)
+        _drop_hold(cart, variant_id)
+
+
+def set_item(cart, variant_id, quantity):
+    """Set the quantity of a variant; 0 removes the line."""
+    if quantity <= 0:
+        return remove_item(cart, variant_id)
+    with transaction.atomic():
+        _check_available(cart, variant_id, quantity)
+        CartItem.objects.bulk_create(
+            [CartItem(cart=cart, product_variant_id=variant_id, quantity=quantity)],
+            update_conflicts=True,
+            unique_fields=['cart', 'product_variant'],
+            update_fields=['quantity'],
+        )
+        _drop_hold(cart, variant_id)
+
+
+def remove_item(cart, variant_id):
+    with transaction.atomic():
+        CartItem.objects.filter(cart=cart, product_variant_id=variant_id).delete()
+        _drop_hold(cart, variant_id)
+
+
+def merge_carts(source, target):
+    """
+    Move the lines of `source` into `target`, adding up quantities of
+    variants both carts have, and delete `source` (releasing its holds).
+    """
+    with transaction.atomic():
+        incoming = dict(source.items.values_list('product_variant_id', 'quantity'))
+        shared = list(target.items.filter(
+            product_variant_id__in=incoming).values_list('product_variant_id', flat=True))
+        if shared:
+            target.items.filter(product_variant_id__in=shared).update(
+                quantity=F('quantity') + Case(
+                    *[When(product_variant_id=pk, then=incoming[pk]) for pk in shared]))
+        source.items.exclude(product_variant_id__in=shared).update(cart=target)
+        source.delete()
+
+
+def merge_session_cart(request, user):
+    """Fold the anonymous session's cart into `user`'s cart on login."""
+    session_key = request.session.session_key
+    if not session_key:
+        return
+    source = Cart.objects.filter(session_key=session_key, user__isnull=True).first()
+    if source is None:
+        return
+    target, _ = Cart.objects.get_or_create(user=user)
+    merge_carts(source, target)
+
+
+def _upsert(cart, variant_id, quantity):
+    updated = CartItem.objects.filter(cart=cart, product_variant_id=variant_id).update(
+        quantity=F('quantity') + quantity)
+    if updated:
+        return
+    try:
+        with transaction.atomic():
+            CartItem.objects.create(cart=cart, product_variant_id=variant_id, quantity=quantity)
+    except IntegrityError:
+        # A concurrent request created the line first.
+        CartItem.objects.filter(cart=cart, product_variant_id=variant_id).update(
+            quantity=F('quantity') + quantity)
+
+
+def _check_available(cart, variant_id, quantity):
+    variant = ProductVariant.objects.filter(pk=variant_id).values('stock', 'reserved').first()
+    if variant is None:
+        raise OutOfStockError({variant_id: 0})
+    held = StockReservation.objects.filter(
+        cart=cart, product_variant_id=variant_id).values_list('quantity', flat=True).first() or 0
+    available = max(variant['stock'] - variant['reserved'], 0) + held
+    if quantity > available:
+        raise OutOfStockError({variant_id: available})
+
+
+def _drop_hold(cart, variant_id):
+    # A changed line no longer matches its hold; it is taken again with
+    # the rest of the cart when the customer reserves or checks out.
+    if StockReservation.objects.filter(cart=cart, product_variant_id=variant_id).exists():
+        reserve(cart, {variant_id: 0})
@@ -0,0 +1,125 @@
+"""
+Turn a Cart into an Order without overselling.
+
+All of it happens in one transaction. Variant rows are locked in primary
+key order, so concurrent checkouts over overlapping carts queue up instead
+of deadlocking. Stock is then taken with a single conditional UPDATE that
+only matches rows that still have enough left, after other carts' holds.
+Either every line is taken or the whole order is rolled back.
+"""
+from django.db import transaction
+from django.db.models import Case, F, OuterRef, Q, Subquery, Sum, When
+from django.db.models.functions import Coalesce
+
+from .models import CartItem, Order, OrderItem, ProductVariant, StockReservation
+from .signals import products_bulk_changed
+
+
+class CheckoutError(Exception):
+    pass
+
+
+class OutOfStockError(CheckoutError):
+    def __init__(self, shortages):
+        # {variant id: quantity still available}
+        self.shortages = shortages
+        super().__init__(
+            f"Not enough stock for variants {sorted(shortages)}.")
+
+
+def checkout(cart, user=None):
+    """
+    Create an Order for `user` (the cart's owner by default) from the cart's
+    items, decrement stock and empty the cart. Raises CheckoutError when the
+    cart can't be ordered, leaving stock and cart untouched.
+    """
+    # store.reservations imports this module for OutOfStockError.
+    from .reservations import release_expired_holds
+
+    user = user or cart.user
+    if user is None:
+        raise CheckoutError("Sign in to place an order.")
+
+    with transaction.atomic():
+        # {variant id: quantity}; lines are unique per variant in a cart.
+        quantities = dict(
+            CartItem.objects.filter(cart=cart).values('product_variant_id')
+            .annotate(quantity=Sum('quantity')).values_list('product_variant_id', 'quantity'))
+        if not quantities:
+            raise CheckoutError("The cart is empty.")
+
+        # The cart's own holds (see store.reservations) are available to it
+        # and are consumed by the order. They are read again once the
+        # variants are locked, since the sweeper may release them meanwhile.
+        held_ids = StockReservation.objects.filter(cart=cart).values_list(
+            'product_variant_id', flat=True)
+        variants = {
+            row['pk']: row
+            for row in ProductVariant.objects.select_for_update().filter(
+                pk__in=set(quantities) | set(held_ids)).order_by('pk').values(
+                    'pk', 'product_id', 'price', 'stock', 'reserved')
+        }
+        # Lapsed holds, this cart's included, no longer count.
+        release_expired_holds(variants)
+        held = dict(StockReservation.objects.select_for_update().filter(
+            cart=cart, product_variant_id__in=variants,
+        ).values_list('product_variant_id', 'quantity'))
+        unpriced = [pk for pk in quantities if pk in variants and variants[pk]['price'] is None]
+        if unpriced:
+            raise CheckoutError(f"Variants {sorted(unpriced)} are not for sale.")
+        shortages = {
+            pk: _available(variants.get(pk), held.get(pk, 0))
+            for pk, quantity in quantities.items()
+            if _available(variants.get(pk), held.get(pk, 0)) < quantity
+        }
+        if shortages:
+            raise OutOfStockError(shortages)
+
+        # One statement for every line; each row only matches while it still
+        # has enough unreserved stock, so the row count proves nothing was
+        # oversold. Holds on variants no longer in the cart are released too.
+        enough = Q()
+        for pk in variants:
+            enough |= Q(pk=pk, reserved__gte=held.get(pk, 0),
+                        stock__gte=F('reserved') - held.get(pk, 0) + quantities.get(pk, 0))
+        updated = ProductVariant.objects.filter(enough).update(
+            stock=F('stock') - Case(
+                *[When(pk=pk, then=quantities.get(pk, 0)) for pk in variants]),
+            reserved=F('reserved') - Case(
+                *[When(pk=pk, then=held.get(pk, 0)) for pk in variants]),
+        )
+        if updated != len(variants):
+            raise OutOfStockError(_current_availability(quantities, held))
+
+        order = Order.objects.create(user=user)
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order, product_variant_id=pk, quantity=quantity,
+                      price=variants[pk]['price'])
+            for pk, quantity in sorted(quantities.items())
+        ])
+        line_totals = OrderItem.objects.filter(order=OuterRef('pk')).values('order').annotate(
+            total=Sum(F('price') * F('quantity'))).values('total')
+        Order.objects.filter(pk=order.pk).update(total=Coalesce(Subquery(line_totals), 0))
+        order.refresh_from_db(fields=['total', 'updated_at'])
+
+        CartItem.objects.filter(cart=cart).delete()
+        StockReservation.objects.filter(cart=cart, product_variant_id__in=held).delete()
+        # Stock changed through a bulk UPDATE, which skips model signals.
+        products_bulk_changed.send(
+            sender=ProductVariant,
+            product_ids=sorted({row['product_id'] for row in variants.values()}))
+    return order
+
+
+def _available(variant, held):
+    if variant is None:
+        return 0
+    return max(variant['stock'] - variant['reserved'], 0) + held
+
+
+def _current_availability(quantities, held):
+    variants = {row['pk']: row for row in ProductVariant.objects.filter(
+        pk__in=quantities).values('pk', 'stock', 'reserved')}
+    available = {pk: _available(variants.get(pk), held.get(pk, 0)) for pk in quantities}
+    return {pk: available[pk] for pk, quantity in quantities.items()
+            if available[pk] < quantity}
@@ -0,0 +1,218 @@
+import hashlib
+import json
+import threading
+
+from django.core.cache import cache
+from django.db.models import Count, Max, Min
+
+from .cache import get_catalog_version
+from .models import AttributeValue, ProductVariant
+
+
+# Entries are keyed on the catalog version, so this only bounds how long
+# unreachable ones linger.
+FILTER_SUMMARY_TIMEOUT = 60 * 60
+
+
+class FacetIndex:
+    """
+    Inverted index from AttributeValue id to the ids of the products that
+    have at least one variant with that value.
+
+    Attribute filters and facet counts become set operations over it
+    instead of JOIN + DISTINCT queries. The index is rebuilt lazily, with
+    two queries, whenever the catalog version changes.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._version = None
+        self.postings = {}
+        self.values = {}
+
+    def refresh(self):
+        version = get_catalog_version()
+        if version == self._version:
+            return self
+        with self._lock:
+            if version == self._version:
+                return self
+            values = {}
+            for value_id, value, attribute_id, title in AttributeValue.objects.values_list(
+                    'id', 'value', 'attribute_id', 'attribute__title'):
+                values[value_id] = {
+                    'value': value,
+                    'attribute_id': attribute_id,
+                    'attribute_title': title,
+                }
+            postings = {}
+            links = ProductVariant.attributes.through.objects.values_list(
+                'attributevalue_id', 'productvariant__product_id')
+            for value_id, product_id in links.iterator():
+                postings.setdefault(value_id, set()).add(product_id)
+            self.values, self.postings = values, postings
+            self._version = version
+        return self
+
+    def group_key(self, value_id):
+        # Values are grouped by attribute title, so "Color" means the same
+        # thing across collections that each define their own Color.
+        return self.values[value_id]['attribute_title'].strip().lower()
+
+    def resolve(self, pairs=(), value_ids=()):
+        """
+        Turn `(attribute title, value)` pairs and raw value ids into a
+        selection: `{group key: {value ids}}`. Unknown entries still create
+        their group, with no values, so they match nothing.
+        """
+        selection = {}
+        wanted = {}
+        for title, value in pairs:
+            wanted.setdefault(title.strip().lower(), set()).add(value.strip().lower())
+            selection.setdefault(title.strip().lower(), set())
+        if wanted:
+            for value_id, meta in self.values.items():
+                key = meta['attribute_title'].strip().lower()
+                if meta['value'].strip().lower() in wanted.get(key, ()):
+                    selection[key].add(value_id)
+        for value_id in value_ids:
+            if value_id in self.values:
+                selection.setdefault(self.group_key(value_id), set()).add(value_id)
+            else:
+                selection.setdefault(f'#{value_id}', set())
+        return selection
+
+    def matching(self, selection, exclude_group=None):
+        """
+        Product ids matching the selection: any of the values within an
+        attribute (OR), and every selected attribute (AND). Returns None
+        when nothing constrains the result.
+        """
+        result = None
+        for key, value_ids in selection.items():
+            if key == exclude_group:
+                continue
+            ids = set()
+            for value_id in value_ids:
+                ids |= self.postings.get(value_id, set())
+            result = ids if result is None else result & ids
+        return result
+
+    def facet_counts(self, base_ids, selection):
+        """
+        Count, for each attribute value, the products of `base_ids` that
+        have it and match the selection on the *other* attributes. Counting
+        each attribute without its own selection lets clients show how many
+        results picking another value of that attribute would give.
+        """
+        base_ids = set(base_ids)
+        candidates = {}
+        for value_id, product_ids in self.postings.items():
+            if value_id in self.values and not product_ids.isdisjoint(base_ids):
+                candidates.setdefault(self.group_key(value_id), []).append(value_id)
+        for key, value_ids in selection.items():
+            candidates.setdefault(key, [])
+            for value_id in value_ids:
+                if value_id in self.values and value_id not in candidates[key]:
+                    candidates[key].append(value_id)
+
+        facets = []
+        for key, value_ids in candidates.items():
+            if not value_ids:
+                continue
+            scope = base_ids
+            others = self.matching(selection, exclude_group=key)
+            if others is not None:
+                scope = scope & others
+            selected = selection.get(key, set())
+            meta = self.values[value_ids[0]]
+            facets.append({
+                'attribute': meta['attribute_title'],
+                'values': sorted(
+                    [{
+                        'id': value_id,
+                        'value': self.values[value_id]['value'],
+                        'count': len(self.postings.get(value_id, set()) & scope),
+                        'selected': value_id in selected,
+                    } for value_id in value_ids],
+                    key=lambda item: (-item['count'], item['value'])),
+            })
+        facets.sort(key=lambda facet: facet['attribute'])
+        return facets
+
+
+facet_index = FacetIndex()
+
+
+def parse_attribute_pairs(value):
+    """Parse `Color:Gold,Color:Silver,Size:52` into title/value pairs."""
+    pairs = []
+    for pair in (value or '').split(','):
+        if ':' in pair:
+            title, val = pair.split(':', 1)
+            if title.strip() and val.strip():
+                pairs.append((title, val))
+    return pairs
+
+
+def parse_value_ids(value):
+    ids = []
+    for part in (value or '').split(','):
+        part = part.strip()
+        if part.isdigit():
+            ids.append(int(part))
+    return ids
+
+
+def build_collection_filter_summary(collection):
+    """
+    The collection's attributes and values, each value with the number of
+    in-stock products having it and their price range. Three queries.
+    """
+    stats = {
+        row['attributevalue_id']: row
+        for row in ProductVariant.attributes.through.objects.filter(
+            productvariant__product__collection=collection,
+            productvariant__stock__gt=0,
+        ).values('attributevalue_id').annotate(
+            product_count=Count('productvariant__product', distinct=True),
+            min_price=Min('productvariant__price'),
+            max_price=Max('productvariant__price'),
+        )
+    }
+    summary = []
+    for attribute in collection.attributes.prefetch_related('values').order_by('id'):
+        values = []
+        for value in attribute.values.all():
+            row = stats.get(value.id, {})
+            values.append({
+                'id': value.id,
+                'value': value.value,
+                'attribute': attribute.id,
+                'product_count': row.get('product_count', 0),
+                'min_price': _price(row.get('min_price')),
+                'max_price': _price(row.get('max_price')),
+            })
+        summary.append({'id': attribute.id, 'title': attribute.title, 'values': values})
+    return summary
+
+
+def get_collection_filter_summary(collection_id, loader):
+    """
+    Cached summary for a collection as `(etag, data)`. `loader` returns the
+    Collection and is only called on a cache miss.
+    """
+    key = f'store:collection-filters:{collection_id}:{get_catalog_version()}'
+    cached = cache.get(key)
+    if cached is None:
+        data = build_collection_filter_summary(loader())
+        digest = hashlib.md5(
+            json.dumps(data, sort_keys=True).encode(), usedforsecurity=False).hexdigest()
+        cached = (f'"{digest}"', data)
+        cache.set(key, cached, timeout=FILTER_SUMMARY_TIMEOUT)
+    return cached
+
+
+def _price(value):
+    # Match the string rendering of the serializers' DecimalFields.
+    return None if value is None else str(value)
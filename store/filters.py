@@ -1,32 +1,57 @@
 from django_filters import rest_framework as filters
-from .models import Product
-from django.db.models import Q
+from django.db.models import Exists, OuterRef
+from .models import Product, ProductCard, ProductVariant
+from .facets import facet_index, parse_attribute_pairs, parse_value_ids
+
+
+# Query parameters that select attribute values; the facet endpoint applies
+# them in memory instead of through the filterset.
+ATTRIBUTE_PARAMS = ('attribute', 'attribute_value')
 
 
 class ProductFilter(filters.FilterSet):
+    # `attribute=Color:Gold,Color:Silver,Size:52` or `attribute_value=3,7`:
+    # values of the same attribute are ORed, different attributes are ANDed.
     attribute = filters.CharFilter(method='filter_by_attribute')
+    attribute_value = filters.CharFilter(method='filter_by_attribute_value')
     min_price = filters.NumberFilter(
-        field_name='variants__price', lookup_expr='gte')  # Price >= min_price
+        method='filter_min_price')  # Some variant priced >= min_price
     max_price = filters.NumberFilter(
-        field_name='variants__price', lookup_expr='lte')  # Price <= max_price
+        method='filter_max_price')  # Some variant priced <= max_price
 
     class Meta:
         model = Product
-        fields = ['attribute', 'min_price', 'max_price']
+        fields = ['attribute', 'attribute_value', 'min_price', 'max_price']
 
     def filter_by_attribute(self, queryset, name, value):
-        # Initialize an empty Q object
-        attribute_conditions = Q()
-
-        # Split the attribute filter into key-value pairs
-        for pair in value.split(','):
-            if ':' in pair:
-                key, val = pair.split(':')
-                # Add each condition to the Q object using OR logic
-                attribute_conditions |= Q(
-                    variants__attributes__attribute__name=key,
-                    variants__attributes__value=val,
-                )
-
-        # Apply the combined conditions to the queryset
-        return queryset.filter(attribute_conditions).distinct()
+        selection = facet_index.refresh().resolve(pairs=parse_attribute_pairs(value))
+        return self._filter_selection(queryset, selection)
+
+    def filter_by_attribute_value(self, queryset, name, value):
+        selection = facet_index.refresh().resolve(value_ids=parse_value_ids(value))
+        return self._filter_selection(queryset, selection)
+
+    def _filter_selection(self, queryset, selection):
+        # Set intersections over the inverted index replace JOIN + DISTINCT.
+        product_ids = facet_index.matching(selection)
+        if product_ids is None:
+            return queryset
+        return queryset.filter(pk__in=product_ids)
+
+    # EXISTS keeps one row per product, so no DISTINCT is needed.
+    def filter_min_price(self, queryset, name, value):
+        return queryset.filter(Exists(ProductVariant.objects.filter(
+            product=OuterRef('pk'), price__gte=value)))
+
+    def filter_max_price(self, queryset, name, value):
+        return queryset.filter(Exists(ProductVariant.objects.filter(
+            product=OuterRef('pk'), price__lte=value)))
+
+
+class ProductCardFilter(filters.FilterSet):
+    # Filter on the raw column so no extra query validates the collection.
+    collection = filters.NumberFilter(field_name='collection_id')
+
+    class Meta:
+        model = ProductCard
+        fields = ['collection']
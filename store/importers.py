@@ -0,0 +1,268 @@
+"""
+Streaming bulk import of products, variants, attribute values and image
+references from CSV or JSON Lines.
+
+Each row describes one variant. Rows of the same product share a `product`
+reference and must be contiguous, which lets the importer work through the
+file one product at a time with constant memory:
+
+    product,title,description,collection,price,stock,attributes,images
+    r-1,Gold ring,...,Rings,1200000,3,Color:Gold;Size:52,products/r-1.webp
+    r-1,Gold ring,...,Rings,1250000,1,Color:Gold;Size:56,
+
+In JSONL, `attributes` may be an object ({"Color": "Gold"}) and `images` a
+list. `collection` is a collection id or title; image references are paths
+relative to MEDIA_ROOT, and are collected from all rows of the product.
+"""
+import csv
+import io
+import json
+from itertools import groupby
+
+from django.core.exceptions import ValidationError
+from django.db import transaction
+
+from .models import AttributeValue, Collection, Product, ProductImage, ProductVariant
+from .signals import products_bulk_changed
+
+
+FORMATS = ('csv', 'jsonl')
+DEFAULT_CHUNK_SIZE = 500
+
+
+class RowError(Exception):
+    pass
+
+
+class ImportReport:
+    def __init__(self, max_errors=100):
+        self.max_errors = max_errors
+        self.products = 0
+        self.variants = 0
+        self.images = 0
+        self.skipped = 0
+        self.errors = []
+
+    def add_error(self, line, message):
+        self.skipped += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append({'line': line, 'error': message})
+
+    def as_dict(self):
+        return {
+            'products': self.products,
+            'variants': self.variants,
+            'images': self.images,
+            'skipped_products': self.skipped,
+            'errors': self.errors,
+        }
+
+
+def read_rows(stream, file_format):
+    """Yield `(line_number, row)` pairs from a text stream."""
+    if file_format == 'csv':
+        reader = csv.DictReader(stream)
+        for row in reader:
+            yield reader.line_num, row
+    elif file_format == 'jsonl':
+        for line_number, line in enumerate(stream, start=1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as exc:
+                row = {'__error__': f"Invalid JSON: {exc}"}
+            if not isinstance(row, dict):
+                row = {'__error__': "Each line must be a JSON object."}
+            yield line_number, row
+    else:
+        raise ValueError(f"Unsupported import format: {file_format}")
+
+
+def guess_format(filename):
+    return 'jsonl' if filename.lower().endswith(('.jsonl', '.ndjson')) else 'csv'
+
+
+class ProductImporter:
+    """
+    Resolve rows against lookup tables built once up front and write them
+    with `bulk_create`, one transaction per chunk of products.
+    """
+
+    def __init__(self, chunk_size=DEFAULT_CHUNK_SIZE, max_errors=100):
+        self.chunk_size = chunk_size
+        self.report = ImportReport(max_errors=max_errors)
+        self._build_lookups()
+
+    def _build_lookups(self):
+        self.collections_by_id = {}
+        self.collections_by_title = {}
+        for pk, title in Collection.objects.values_list('id', 'title'):
+            self.collections_by_id[str(pk)] = pk
+            self.collections_by_title.setdefault(title.strip().lower(), pk)
+
+        # (collection id, attribute title, value) -> (value id, attribute id)
+        self.values = {}
+        self.required_attributes = {}
+        rows = AttributeValue.objects.values_list(
+            'id', 'value', 'attribute_id', 'attribute__title',
+            'attribute__collection_id')
+        for value_id, value, attribute_id, attribute_title, collection_id in rows:
+            key = (collection_id, attribute_title.strip().lower(), value.strip().lower())
+            self.values[key] = (value_id, attribute_id)
+            self.required_attributes.setdefault(collection_id, set()).add(attribute_id)
+
+    def import_stream(self, stream, file_format):
+        pending = []
+        rows = read_rows(stream, file_format)
+        for reference, group in groupby(rows, key=lambda item: _text(item[1].get('product'))):
+            group = list(group)
+            first_line = group[0][0]
+            try:
+                pending.append(self._prepare_product(reference, group))
+            except RowError as exc:
+                self.report.add_error(first_line, str(exc))
+                continue
+            if len(pending) >= self.chunk_size:
+                self._write(pending)
+                pending = []
+        if pending:
+            self._write(pending)
+        return self.report
+
+    def _prepare_product(self, reference, group):
+        for line, row in group:
+            if '__error__' in row:
+                raise RowError(row['__error__'])
+        if not reference:
+            raise RowError("Missing product reference.")
+        _, first = group[0]
+        title = _text(first.get('title'))
+        if not title:
+            raise RowError(f"Product {reference!r} has no title.")
+        collection_id = self._resolve_collection(_text(first.get('collection')))
+
+        variants = []
+        images = []
+        for line, row in group:
+            try:
+                variants.append(self._prepare_variant(collection_id, row))
+            except RowError as exc:
+                raise RowError(f"Line {line}: {exc}")
+            for name in _split(row.get('images'), '|'):
+                if name.startswith('/') or '..' in name.split('/'):
+                    raise RowError(f"Line {line}: invalid image path {name!r}.")
+                if name not in images:
+                    images.append(name)
+        return {
+            'product': Product(
+                title=title,
+                description=_text(first.get('description')),
+                collection_id=collection_id,
+            ),
+            'variants': variants,
+            'images': images,
+        }
+
+    def _resolve_collection(self, value):
+        collection_id = (self.collections_by_id.get(value) or
+                         self.collections_by_title.get(value.lower()))
+        if collection_id is None:
+            raise RowError(f"Unknown collection {value!r}.")
+        return collection_id
+
+    def _prepare_variant(self, collection_id, row):
+        price_field = ProductVariant._meta.get_field('price')
+        stock_field = ProductVariant._meta.get_field('stock')
+        price = _text(row.get('price'))
+        try:
+            price = price_field.clean(price, None) if price else None
+            stock = stock_field.clean(_text(row.get('stock')) or 0, None)
+        except ValidationError as exc:
+            raise RowError("; ".join(exc.messages))
+
+        attributes = row.get('attributes') or {}
+        if isinstance(attributes, str):
+            pairs = []
+            for pair in _split(attributes, ';'):
+                if ':' not in pair:
+                    raise RowError(f"Attribute {pair!r} must look like 'Title:Value'.")
+                pairs.append(tuple(part.strip() for part in pair.split(':', 1)))
+        else:
+            pairs = [(_text(key), _text(value)) for key, value in attributes.items()]
+
+        value_ids = []
+        attribute_ids = set()
+        for attribute_title, value in pairs:
+            found = self.values.get(
+                (collection_id, attribute_title.lower(), value.lower()))
+            if found is None:
+                raise RowError(f"Unknown value {value!r} for attribute {attribute_title!r}.")
+            value_id, attribute_id = found
+            if attribute_id in attribute_ids:
+                raise RowError(
+                    f"Multiple values provided for attribute {attribute_title!r}.")
+            attribute_ids.add(attribute_id)
+            value_ids.append(value_id)
+
+        missing = self.required_attributes.get(collection_id, set()) - attribute_ids
+        if missing:
+            raise RowError(
+                f"Missing attribute values for required attributes with IDs: {sorted(missing)}.")
+        return {'variant': ProductVariant(price=price, stock=stock), 'value_ids': value_ids}
+
+    def _write(self, pending):
+        Through = ProductVariant.attributes.through
+        with transaction.atomic():
+            products = Product.objects.bulk_create(
+                [item['product'] for item in pending])
+
+            images = []
+            variants = []
+            for product, item in zip(products, pending):
+                images.extend(ProductImage(product=product, image=name)
+                              for name in item['images'])
+                for entry in item['variants']:
+                    entry['variant'].product = product
+                    variants.append(entry['variant'])
+            ProductImage.objects.bulk_create(images)
+            ProductVariant.objects.bulk_create(variants)
+
+            links = [
+                Through(productvariant_id=entry['variant'].pk, attributevalue_id=value_id)
+                for item in pending
+                for entry in item['variants']
+                for value_id in entry['value_ids']
+            ]
+            Through.objects.bulk_create(links)
+
+            products_bulk_changed.send(
+                sender=Product, product_ids=[product.pk for product in products])
+
+        self.report.products += len(products)
+        self.report.variants += len(variants)
+        self.report.images += len(images)
+
+
+def import_products(stream, file_format, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Import a text or binary stream and return an ImportReport.
+    Binary streams (uploaded files) are decoded as UTF-8 on the fly.
+    """
+    if file_format not in FORMATS:
+        raise ValueError(f"Unsupported import format: {file_format}")
+    if not isinstance(stream, io.TextIOBase):
+        stream = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    return ProductImporter(chunk_size=chunk_size).import_stream(stream, file_format)
+
+
+def _text(value):
+    return '' if value is None else str(value).strip()
+
+
+def _split(value, separator):
+    if not value:
+        return []
+    if isinstance(value, (list, tuple)):
+        return [_text(item) for item in value if _text(item)]
+    return [part.strip() for part in str(value).split(separator) if part.strip()]
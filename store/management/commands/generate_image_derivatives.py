@@ -0,0 +1,37 @@
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+
+from backend import images
+
+
+class Command(BaseCommand):
+    help = (
+        "Generate the resized copies of uploaded images that don't have them "
+        "yet (or whose file changed), on a pool of worker processes."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'models', nargs='*', metavar='app_label.Model',
+            help="Only these models; all models with derivatives by default.")
+        parser.add_argument(
+            '--processes', type=int, default=None,
+            help="Worker processes; the number of CPUs by default.")
+        parser.add_argument(
+            '--batch-size', type=int, default=200,
+            help="Rows updated per transaction.")
+        parser.add_argument(
+            '--force', action='store_true',
+            help="Regenerate even up-to-date derivatives, e.g. after changing the widths.")
+
+    def handle(self, *args, **options):
+        models = None
+        if options['models']:
+            try:
+                models = [apps.get_model(label) for label in options['models']]
+            except (LookupError, ValueError) as exc:
+                raise CommandError(exc)
+        updated = images.backfill(
+            models=models, processes=options['processes'],
+            batch_size=options['batch_size'], force=options['force'])
+        self.stdout.write(self.style.SUCCESS(f"Generated derivatives for {updated} images."))
@@ -0,0 +1,33 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+
+from store.importers import DEFAULT_CHUNK_SIZE, FORMATS, guess_format, import_products
+
+
+class Command(BaseCommand):
+    help = "Stream products, variants, attribute values and image references from a CSV or JSONL file."
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="File to import.")
+        parser.add_argument(
+            '--format', choices=FORMATS,
+            help="Input format; guessed from the file extension by default.")
+        parser.add_argument(
+            '--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+            help="Number of products written per transaction.")
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or guess_format(path)
+        try:
+            with open(path, encoding='utf-8-sig', newline='') as stream:
+                report = import_products(
+                    stream, file_format, chunk_size=options['chunk_size'])
+        except OSError as exc:
+            raise CommandError(str(exc))
+
+        for error in report.errors:
+            self.stderr.write(f"line {error['line']}: {error['error']}")
+        self.stdout.write(self.style.SUCCESS(
+            json.dumps({k: v for k, v in report.as_dict().items() if k != 'errors'})))
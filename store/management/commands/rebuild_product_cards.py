@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from store.models import ProductCard
+from store.projections import rebuild_product_cards
+
+
+class Command(BaseCommand):
+    help = "Recompute the ProductCard listing projection for every product."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=500,
+            help="Number of products refreshed per batch.")
+
+    def handle(self, *args, **options):
+        rebuild_product_cards(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt {ProductCard.objects.count()} product cards."))
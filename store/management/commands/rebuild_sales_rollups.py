@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from store.reporting import rebuild_sales_rollups
+
+
+class Command(BaseCommand):
+    help = "Recompute the daily sales rollups from the processing and completed orders."
+
+    def handle(self, *args, **options):
+        days = rebuild_sales_rollups()
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt sales rollups for {days} days."))
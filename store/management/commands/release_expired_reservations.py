@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from store.reservations import release_expired, reservation_options
+
+
+class Command(BaseCommand):
+    help = "Release stock held by cart reservations that have expired."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=reservation_options()['BATCH_SIZE'],
+            help="Number of reservations released per transaction.")
+
+    def handle(self, *args, **options):
+        released = release_expired(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f"Released {released} reservations."))
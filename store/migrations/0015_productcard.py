@@ -0,0 +1,34 @@
+# Generated by Django 5.1.6 on 2026-10-18 14:53
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0014_product_pagination_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProductCard',
+            fields=[
+                ('product', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='card', serialize=False, to='store.product', verbose_name='محصول')),
+                ('title', models.CharField(max_length=255, verbose_name='عنوان محصول')),
+                ('created_at', models.DateTimeField(verbose_name='زمان ایجاد محصول')),
+                ('min_price', models.DecimalField(decimal_places=0, max_digits=12, null=True, verbose_name='کمترین قیمت')),
+                ('max_price', models.DecimalField(decimal_places=0, max_digits=12, null=True, verbose_name='بیشترین قیمت')),
+                ('total_stock', models.PositiveIntegerField(default=0, verbose_name='موجودی کل')),
+                ('image', models.ImageField(blank=True, upload_to='products/', verbose_name='تصویر اول')),
+                ('attribute_summary', models.JSONField(blank=True, default=dict, verbose_name='خلاصه ویژگی\u200cها')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='آخرین به\u200cروزرسانی')),
+                ('collection', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='product_cards', to='store.collection', verbose_name='دسته بندی')),
+            ],
+            options={
+                'verbose_name': 'کارت محصول',
+                'verbose_name_plural': 'کارت\u200cهای محصولات',
+                'indexes': [models.Index(fields=['-created_at', '-product'], name='store_card_created_idx'), models.Index(fields=['collection', '-created_at', '-product'], name='store_card_coll_created_idx')],
+            },
+        ),
+    ]
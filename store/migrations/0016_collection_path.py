@@ -0,0 +1,40 @@
+# Generated by Django 5.1.6 on 2026-10-18 15:00
+
+from django.db import migrations, models
+
+
+def fill_paths(apps, schema_editor):
+    Collection = apps.get_model('store', 'Collection')
+    parents = dict(Collection.objects.values_list('id', 'parent_id'))
+    paths = {}
+
+    def path_of(pk):
+        if pk not in paths:
+            parent = parents[pk]
+            paths[pk] = f"{path_of(parent) if parent else '/'}{pk}/"
+        return paths[pk]
+
+    for pk in parents:
+        path = path_of(pk)
+        Collection.objects.filter(pk=pk).update(path=path, depth=path.count('/') - 2)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0015_productcard'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='collection',
+            name='depth',
+            field=models.PositiveSmallIntegerField(default=0, editable=False, verbose_name='عمق'),
+        ),
+        migrations.AddField(
+            model_name='collection',
+            name='path',
+            field=models.CharField(db_index=True, default='', editable=False, max_length=255, verbose_name='مسیر'),
+        ),
+        migrations.RunPython(fill_paths, migrations.RunPython.noop),
+    ]
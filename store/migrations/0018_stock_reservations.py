@@ -0,0 +1,35 @@
+# Generated by Django 5.1.6 on 2026-10-18 15:07
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0017_product_updated_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productvariant',
+            name='reserved',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='رزرو شده'),
+        ),
+        migrations.CreateModel(
+            name='StockReservation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.PositiveIntegerField(verbose_name='تعداد')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='زمان ایجاد')),
+                ('expires_at', models.DateTimeField(db_index=True, verbose_name='زمان انقضا')),
+                ('cart', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reservations', to='store.cart', verbose_name='سبد خرید')),
+                ('product_variant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reservations', to='store.productvariant', verbose_name='نوع محصول')),
+            ],
+            options={
+                'verbose_name': 'رزرو موجودی',
+                'verbose_name_plural': 'رزروهای موجودی',
+                'constraints': [models.UniqueConstraint(fields=('cart', 'product_variant'), name='store_reservation_cart_variant_uniq')],
+            },
+        ),
+    ]
@@ -0,0 +1,59 @@
+# Generated by Django 5.1.6 on 2026-10-18 15:08
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Count, F
+
+
+def merge_duplicates(apps, schema_editor):
+    Cart = apps.get_model('store', 'Cart')
+    CartItem = apps.get_model('store', 'CartItem')
+    ProductVariant = apps.get_model('store', 'ProductVariant')
+    StockReservation = apps.get_model('store', 'StockReservation')
+
+    # Fold every extra cart of a user or session into its oldest cart.
+    for field in ('user', 'session_key'):
+        values = Cart.objects.filter(**{f'{field}__isnull': False}).values(field).annotate(
+            carts=Count('id')).filter(carts__gt=1).values_list(field, flat=True)
+        for value in values:
+            keep, *extra = Cart.objects.filter(**{field: value}).order_by('created_at', 'id')
+            for cart in extra:
+                CartItem.objects.filter(cart=cart).update(cart=keep)
+                for reservation in StockReservation.objects.filter(cart=cart):
+                    ProductVariant.objects.filter(pk=reservation.product_variant_id).update(
+                        reserved=F('reserved') - reservation.quantity)
+                cart.delete()
+
+    # Then add up repeated lines of the same variant.
+    lines = CartItem.objects.values('cart', 'product_variant').annotate(
+        lines=Count('id')).filter(lines__gt=1)
+    for line in lines:
+        keep, *extra = CartItem.objects.filter(
+            cart=line['cart'], product_variant=line['product_variant']).order_by('id')
+        keep.quantity += sum(item.quantity for item in extra)
+        keep.save(update_fields=['quantity'])
+        CartItem.objects.filter(pk__in=[item.pk for item in extra]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0018_stock_reservations'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicates, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='cart',
+            constraint=models.UniqueConstraint(condition=models.Q(('user__isnull', False)), fields=('user',), name='store_cart_user_uniq'),
+        ),
+        migrations.AddConstraint(
+            model_name='cart',
+            constraint=models.UniqueConstraint(condition=models.Q(('session_key__isnull', False)), fields=('session_key',), name='store_cart_session_uniq'),
+        ),
+        migrations.AddConstraint(
+            model_name='cartitem',
+            constraint=models.UniqueConstraint(fields=('cart', 'product_variant'), name='store_cartitem_cart_variant_uniq'),
+        ),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 5.1.6 on 2026-10-18 15:11
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0020_order_history_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailySales',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(unique=True, verbose_name='تاریخ')),
+                ('orders', models.PositiveIntegerField(default=0, verbose_name='تعداد سفارش')),
+                ('items', models.PositiveIntegerField(default=0, verbose_name='تعداد اقلام')),
+                ('revenue', models.DecimalField(decimal_places=0, default=0, max_digits=14, verbose_name='فروش')),
+            ],
+            options={
+                'verbose_name': 'فروش روزانه',
+                'verbose_name_plural': 'فروش روزانه',
+                'ordering': ['-date'],
+            },
+        ),
+        migrations.CreateModel(
+            name='DailyCollectionSales',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='تاریخ')),
+                ('items', models.PositiveIntegerField(default=0, verbose_name='تعداد اقلام')),
+                ('revenue', models.DecimalField(decimal_places=0, default=0, max_digits=14, verbose_name='فروش')),
+                ('collection', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_sales', to='store.collection', verbose_name='دسته بندی')),
+            ],
+            options={
+                'verbose_name': 'فروش روزانه دسته بندی',
+                'verbose_name_plural': 'فروش روزانه دسته بندی ها',
+                'ordering': ['-date'],
+                'constraints': [models.UniqueConstraint(fields=('date', 'collection'), name='store_daily_collection_uniq')],
+            },
+        ),
+        migrations.CreateModel(
+            name='DailyVariantSales',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(verbose_name='تاریخ')),
+                ('quantity', models.PositiveIntegerField(default=0, verbose_name='تعداد')),
+                ('revenue', models.DecimalField(decimal_places=0, default=0, max_digits=14, verbose_name='فروش')),
+                ('product_variant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_sales', to='store.productvariant', verbose_name='نوع محصول')),
+            ],
+            options={
+                'verbose_name': 'فروش روزانه نوع محصول',
+                'verbose_name_plural': 'فروش روزانه انواع محصولات',
+                'ordering': ['-date'],
+                'constraints': [models.UniqueConstraint(fields=('date', 'product_variant'), name='store_daily_variant_uniq')],
+            },
+        ),
+    ]
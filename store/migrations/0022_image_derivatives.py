@@ -0,0 +1,28 @@
+# Generated by Django 5.1.6 on 2026-10-18 15:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('store', '0021_sales_rollups'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='collection',
+            name='image_derivatives',
+            field=models.JSONField(blank=True, default=dict, editable=False, verbose_name='نسخه\u200cهای تصویر'),
+        ),
+        migrations.AddField(
+            model_name='productcard',
+            name='image_derivatives',
+            field=models.JSONField(blank=True, default=dict, verbose_name='نسخه\u200cهای تصویر اول'),
+        ),
+        migrations.AddField(
+            model_name='productimage',
+            name='image_derivatives',
+            field=models.JSONField(blank=True, default=dict, editable=False, verbose_name='نسخه\u200cهای تصویر'),
+        ),
+    ]
@@ -1,6 +1,9 @@
 from django.core.exceptions import ValidationError
-from django.db import models
+from django.db import models, transaction
+from django.db.models import F, Value
+from django.db.models.functions import Concat, Substr
 from django.conf import settings
+from django.utils.functional import cached_property
 
 
 class Collection(models.Model):
@@ -14,10 +17,56 @@ class Collection(models.Model):
         null=True, blank=True, verbose_name="توضیحات")
     image = models.ImageField(
         upload_to='collections/', verbose_name="تصویر دسته بندی", null=True, blank=True)
+    # Manifest of resized copies, see backend/images.py.
+    image_derivatives = models.JSONField(
+        default=dict, blank=True, editable=False, verbose_name="نسخه‌های تصویر")
+    # Materialized path of ancestor ids, e.g. "/1/5/12/", maintained by save().
+    # A whole subtree is `path__startswith=<path>`, one indexed range scan.
+    path = models.CharField(
+        max_length=255, db_index=True, editable=False, default='', verbose_name="مسیر")
+    depth = models.PositiveSmallIntegerField(
+        default=0, editable=False, verbose_name="عمق")
 
     def __str__(self):
         return self.title
 
+    def clean(self):
+        super().clean()
+        if self.would_create_cycle(self.parent):
+            raise ValidationError(
+                {'parent': "A collection can't be placed under itself or one of its descendants."})
+
+    def would_create_cycle(self, parent):
+        if parent is None or not self.pk:
+            return False
+        return parent.pk == self.pk or (
+            bool(self.path) and parent.path.startswith(self.path))
+
+    def save(self, *args, **kwargs):
+        parent_path = '/'
+        if self.parent_id:
+            # Read the parent's current path rather than a possibly stale instance.
+            parent_path = Collection.objects.filter(
+                pk=self.parent_id).values_list('path', flat=True).get()
+            if self.path and parent_path.startswith(self.path):
+                raise ValidationError(
+                    "A collection can't be placed under itself or one of its descendants.")
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            old_path = self.path
+            new_path = f"{parent_path}{self.pk}/"
+            if new_path == old_path:
+                return
+            new_depth = new_path.count('/') - 2
+            Collection.objects.filter(pk=self.pk).update(path=new_path, depth=new_depth)
+            if old_path:
+                # Move the subtree: swap the old prefix for the new one.
+                Collection.objects.filter(path__startswith=old_path).exclude(pk=self.pk).update(
+                    path=Concat(Value(new_path), Substr('path', len(old_path) + 1)),
+                    depth=F('depth') + (new_depth - self.depth),
+                )
+            self.path, self.depth = new_path, new_depth
+
     class Meta:
         verbose_name = "دسته بندی"
         verbose_name_plural = "دسته بندی ها"
@@ -31,6 +80,8 @@ class Attribute(models.Model):
     )
 
     def __str__(self):
+        if self.collection_id is None:
+            return self.title
         return f'{self.title} ({self.collection.title})'
 
     class Meta:
@@ -70,6 +121,15 @@ class Product(models.Model):
     class Meta:
         verbose_name = "محصول"
         verbose_name_plural = "محصولات"
+        # Support keyset pagination on (created_at, id), globally and per collection.
+        indexes = [
+            models.Index(fields=['-created_at', '-id'],
+                         name='store_product_created_idx'),
+            models.Index(fields=['collection', '-created_at', '-id'],
+                         name='store_product_coll_created_idx'),
+            # MAX(updated_at) for conditional GET validators.
+            models.Index(fields=['updated_at'], name='store_product_updated_idx'),
+        ]
 
 
 class ProductImage(models.Model):
@@ -77,6 +137,9 @@ class ProductImage(models.Model):
         Product, on_delete=models.CASCADE, related_name='images', null=True, verbose_name="محصول")
     image = models.ImageField(
         upload_to='products/', verbose_name="تصویر محصول")
+    # Manifest of resized copies, see backend/images.py.
+    image_derivatives = models.JSONField(
+        default=dict, blank=True, editable=False, verbose_name="نسخه‌های تصویر")
 
     def __str__(self):
         return f"Image {self.id}"
@@ -86,6 +149,16 @@ class ProductImage(models.Model):
         verbose_name_plural = "تصاویر محصولات"
 
 
+class ProductVariantQuerySet(models.QuerySet):
+    def with_display_data(self):
+        """
+        Load everything `display_label` reads, so listing variants costs a
+        fixed number of queries instead of several per row.
+        """
+        return self.select_related('product').prefetch_related(
+            ProductVariant.display_prefetch())
+
+
 class ProductVariant(models.Model):
     product = models.ForeignKey(
         Product, on_delete=models.CASCADE, related_name='variants', verbose_name="محصول"
@@ -99,24 +172,94 @@ class ProductVariant(models.Model):
     stock = models.PositiveIntegerField(
         default=0, verbose_name="موجودی انبار"
     )
+    # Sum of the active StockReservations, kept in step by store.reservations
+    # so availability never needs a SUM over the reservations table.
+    reserved = models.PositiveIntegerField(
+        default=0, editable=False, verbose_name="رزرو شده"
+    )
 
-    def __str__(self):
+    objects = ProductVariantQuerySet.as_manager()
+
+    @property
+    def available(self):
+        return max(self.stock - self.reserved, 0)
+
+    @staticmethod
+    def display_prefetch(prefix=''):
+        """
+        Prefetch for the attribute values shown in `display_label`. Pass the
+        path to the variant when prefetching from a related model, e.g.
+        `ProductVariant.display_prefetch('product_variant__')`.
+        """
+        return models.Prefetch(
+            f'{prefix}attributes',
+            queryset=AttributeValue.objects.select_related('attribute__collection'))
+
+    @cached_property
+    def display_label(self):
         # If the object is not yet saved, there may be no M2M data available.
         if not self.pk:
             return f"{self.product.title} - (بدون ویژگی)"
-        # Retrieve the attribute values.
-        attr_values = self.attributes.all()
-        if attr_values.exists():
+        # Evaluate once; this reuses prefetched values when they were loaded.
+        attr_values = list(self.attributes.all())
+        if attr_values:
             attr_string = ", ".join([str(val) for val in attr_values])
         else:
             attr_string = "(بدون ویژگی)"
         return f"{self.product.title} - {attr_string}"
 
+    def __str__(self):
+        return self.display_label
+
     class Meta:
         verbose_name = "نوع محصول"
         verbose_name_plural = "انواع محصولات"
 
 
+class ProductCard(models.Model):
+    """
+    Denormalized read model for catalog listings: one row per product.
+    Kept current by the receivers in `store.signals`; never edit it by hand.
+    """
+    product = models.OneToOneField(
+        Product, on_delete=models.CASCADE, primary_key=True, related_name='card', verbose_name="محصول")
+    collection = models.ForeignKey(
+        Collection, on_delete=models.CASCADE, related_name='product_cards', verbose_name="دسته بندی")
+    title = models.CharField(
+        max_length=255, verbose_name="عنوان محصول")
+    created_at = models.DateTimeField(
+        verbose_name="زمان ایجاد محصول")
+    min_price = models.DecimalField(
+        max_digits=12, decimal_places=0, null=True, verbose_name="کمترین قیمت")
+    max_price = models.DecimalField(
+        max_digits=12, decimal_places=0, null=True, verbose_name="بیشترین قیمت")
+    total_stock = models.PositiveIntegerField(
+        default=0, verbose_name="موجودی کل")
+    image = models.ImageField(
+        upload_to='products/', blank=True, verbose_name="تصویر اول")
+    # Copied from the first ProductImage along with the image.
+    image_derivatives = models.JSONField(
+        default=dict, blank=True, verbose_name="نسخه‌های تصویر اول")
+    # {"Color": ["Gold", "Silver"], ...}
+    attribute_summary = models.JSONField(
+        default=dict, blank=True, verbose_name="خلاصه ویژگی‌ها")
+    updated_at = models.DateTimeField(
+        auto_now=True, verbose_name="آخرین به‌روزرسانی")
+
+    def __str__(self):
+        return self.title
+
+    class Meta:
+        verbose_name = "کارت محصول"
+        verbose_name_plural = "کارت‌های محصولات"
+        indexes = [
+            models.Index(fields=['-created_at', '-product'],
+                         name='store_card_created_idx'),
+            models.Index(fields=['collection', '-created_at', '-product'],
+                         name='store_card_coll_created_idx'),
+        ]
+
+
 class Order(models.Model):
     ORDER_STATUS_CHOICES = [
         ('pending', 'در انتظار'),
@@ -141,6 +284,11 @@ class Order(models.Model):
     class Meta:
         verbose_name = "سفارش"
         verbose_name_plural = "سفارش‌ها"
+        # A user's order history, newest first, paged on (created_at, id).
+        indexes = [
+            models.Index(fields=['user', '-created_at', '-id'],
+                         name='store_order_user_created_idx'),
+        ]
 
 
 class OrderItem(models.Model):
@@ -177,6 +325,15 @@ class Cart(models.Model):
     class Meta:
         verbose_name = "سبد خرید"
         verbose_name_plural = "سبدهای خرید"
+        # One cart per user and per anonymous session (see store.carts).
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user'], condition=models.Q(user__isnull=False),
+                name='store_cart_user_uniq'),
+            models.UniqueConstraint(
+                fields=['session_key'], condition=models.Q(session_key__isnull=False),
+                name='store_cart_session_uniq'),
+        ]
 
 
 class CartItem(models.Model):
@@ -193,3 +350,100 @@ class CartItem(models.Model):
     class Meta:
         verbose_name = "آیتم سبد خرید"
         verbose_name_plural = "آیتم‌های سبد خرید"
+        # A variant appears once per cart, so adding it again is an upsert.
+        constraints = [
+            models.UniqueConstraint(
+                fields=['cart', 'product_variant'], name='store_cartitem_cart_variant_uniq'),
+        ]
+
+
+class StockReservation(models.Model):
+    """
+    Stock held for a cart until `expires_at`. Only store.reservations
+    creates or removes these, together with `ProductVariant.reserved`.
+    """
+    cart = models.ForeignKey(
+        Cart, on_delete=models.CASCADE, related_name='reservations', verbose_name="سبد خرید")
+    product_variant = models.ForeignKey(
+        ProductVariant, on_delete=models.CASCADE, related_name='reservations',
+        verbose_name="نوع محصول")
+    quantity = models.PositiveIntegerField(verbose_name="تعداد")
+    created_at = models.DateTimeField(
+        auto_now_add=True, verbose_name="زمان ایجاد")
+    expires_at = models.DateTimeField(
+        db_index=True, verbose_name="زمان انقضا")
+
+    def __str__(self):
+        return f"{self.product_variant} x {self.quantity}"
+
+    class Meta:
+        verbose_name = "رزرو موجودی"
+        verbose_name_plural = "رزروهای موجودی"
+        constraints = [
+            models.UniqueConstraint(
+                fields=['cart', 'product_variant'], name='store_reservation_cart_variant_uniq'),
+        ]
+
+
+# ------------------------------------------------------------------
+# Sales rollups, maintained by store.reporting as orders enter or leave
+# the counted statuses. Reports read these instead of scanning OrderItem.
+# ------------------------------------------------------------------
+class DailySales(models.Model):
+    date = models.DateField(unique=True, verbose_name="تاریخ")
+    orders = models.PositiveIntegerField(default=0, verbose_name="تعداد سفارش")
+    items = models.PositiveIntegerField(default=0, verbose_name="تعداد اقلام")
+    revenue = models.DecimalField(
+        max_digits=14, decimal_places=0, default=0, verbose_name="فروش")
+
+    def __str__(self):
+        return f"{self.date}: {self.revenue}"
+
+    class Meta:
+        verbose_name = "فروش روزانه"
+        verbose_name_plural = "فروش روزانه"
+        ordering = ['-date']
+
+
+class DailyCollectionSales(models.Model):
+    date = models.DateField(verbose_name="تاریخ")
+    collection = models.ForeignKey(
+        Collection, on_delete=models.CASCADE, related_name='daily_sales',
+        verbose_name="دسته بندی")
+    items = models.PositiveIntegerField(default=0, verbose_name="تعداد اقلام")
+    revenue = models.DecimalField(
+        max_digits=14, decimal_places=0, default=0, verbose_name="فروش")
+
+    def __str__(self):
+        return f"{self.date} {self.collection}: {self.revenue}"
+
+    class Meta:
+        verbose_name = "فروش روزانه دسته بندی"
+        verbose_name_plural = "فروش روزانه دسته بندی ها"
+        ordering = ['-date']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['date', 'collection'], name='store_daily_collection_uniq'),
+        ]
+
+
+class DailyVariantSales(models.Model):
+    date = models.DateField(verbose_name="تاریخ")
+    product_variant = models.ForeignKey(
+        ProductVariant, on_delete=models.CASCADE, related_name='daily_sales',
+        verbose_name="نوع محصول")
+    quantity = models.PositiveIntegerField(default=0, verbose_name="تعداد")
+    revenue = models.DecimalField(
+        max_digits=14, decimal_places=0, default=0, verbose_name="فروش")
+
+    def __str__(self):
+        return f"{self.date} {self.product_variant}: {self.quantity}"
+
+    class Meta:
+        verbose_name = "فروش روزانه نوع محصول"
+        verbose_name_plural = "فروش روزانه انواع محصولات"
+        ordering = ['-date']
+        constraints = [
+            models.UniqueConstraint(
+                fields=['date', 'product_variant'], name='store_daily_variant_uniq'),
+        ]
@@ -0,0 +1,128 @@
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import Cursor, CursorPagination
+
+
+class KeysetCursorPagination(CursorPagination):
+    """
+    Keyset (seek) pagination over a composite `(timestamp, pk)` ordering.
+
+    DRF's CursorPagination only stores the first ordering field in the cursor
+    and falls back to an OFFSET for rows that share the same value. Here the
+    cursor holds both fields, so every page is a single indexed range scan:
+    `WHERE (created_at, id) < (:created_at, :id) ORDER BY ... LIMIT n`,
+    no matter how deep the client scrolls. Cursors stay opaque (base64).
+    """
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    # Both fields must share the same direction; the last one must be unique.
+    ordering = ('-created_at', '-pk')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+        self.cursor = self.decode_cursor(request)
+        if self.cursor is None:
+            reverse, position = False, None
+        else:
+            reverse = self.cursor.reverse
+            position = self._decode_position(self.cursor.position)
+        self.position = position
+
+        fields = [field.lstrip('-') for field in self.ordering]
+        descending = self.ordering[0].startswith('-')
+        # Walking backwards flips the scan direction of the ordering.
+        scan_descending = descending != reverse
+        prefix = '-' if scan_descending else ''
+        queryset = queryset.order_by(*[prefix + field for field in fields])
+        if position is not None:
+            queryset = queryset.filter(
+                self._seek_condition(fields, position, scan_descending))
+
+        # Fetch one extra row to find out whether another page follows.
+        results = list(queryset[:self.page_size + 1])
+        has_following = len(results) > self.page_size
+        self.page = results[:self.page_size]
+        if reverse:
+            self.page.reverse()
+            self.has_next = position is not None
+            self.has_previous = has_following
+        else:
+            self.has_next = has_following
+            self.has_previous = position is not None
+
+        if self.has_next or self.has_previous:
+            self.display_page_controls = True
+        return self.page
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        if self.page:
+            position = self._get_position_from_instance(
+                self.page[-1], self.ordering)
+        else:
+            position = self._encode_position(self.position)
+        return self.encode_cursor(
+            Cursor(offset=0, reverse=False, position=position))
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if self.page:
+            position = self._get_position_from_instance(
+                self.page[0], self.ordering)
+        else:
+            position = self._encode_position(self.position)
+        return self.encode_cursor(
+            Cursor(offset=0, reverse=True, position=position))
+
+    def _seek_condition(self, fields, position, descending):
+        lookup = 'lt' if descending else 'gt'
+        first, second = fields
+        first_value, second_value = position
+        return (
+            Q(**{f'{first}__{lookup}': first_value}) |
+            Q(**{first: first_value, f'{second}__{lookup}': second_value})
+        )
+
+    def _get_position_from_instance(self, instance, ordering):
+        values = []
+        for field in ordering:
+            field_name = field.lstrip('-')
+            if isinstance(instance, dict):
+                values.append(instance[field_name])
+            else:
+                values.append(getattr(instance, field_name))
+        return self._encode_position(values)
+
+    def _encode_position(self, values):
+        timestamp, pk = values
+        return f'{timestamp.isoformat()}|{pk}'
+
+    def _decode_position(self, position):
+        try:
+            timestamp, pk = position.split('|', 1)
+            timestamp = parse_datetime(timestamp)
+            pk = int(pk)
+        except (AttributeError, TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        if timestamp is None:
+            raise NotFound(self.invalid_cursor_message)
+        return timestamp, pk
+
+
+class ProductCursorPagination(KeysetCursorPagination):
+    """Newest products first, paged on `(created_at, id)`."""
+    ordering = ('-created_at', '-pk')
+
+
+class OrderCursorPagination(KeysetCursorPagination):
+    """A user's orders, newest first, paged on `(created_at, id)`."""
+    ordering = ('-created_at', '-pk')
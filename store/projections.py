@@ -0,0 +1,118 @@
+import threading
+
+from django.db import transaction
+from django.db.models import Max, Min, OuterRef, Subquery, Sum
+
+from .models import Product, ProductCard, ProductImage, ProductVariant
+
+
+_pending = threading.local()
+
+
+def refresh_product_cards(product_ids):
+    """
+    Recompute the ProductCard rows of the given products.
+    Products that no longer exist simply lose their card.
+    """
+    product_ids = set(product_ids)
+    if not product_ids:
+        return
+
+    first_image = ProductImage.objects.filter(
+        product=OuterRef('pk')).order_by('id')
+    # A single join over variants; images are read through a subquery so the
+    # aggregates are not multiplied by the number of images.
+    rows = Product.objects.filter(pk__in=product_ids).annotate(
+        min_price=Min('variants__price'),
+        max_price=Max('variants__price'),
+        total_stock=Sum('variants__stock'),
+        first_image=Subquery(first_image.values('image')[:1]),
+        first_image_derivatives=Subquery(first_image.values('image_derivatives')[:1]),
+    ).values('id', 'title', 'collection_id', 'created_at', 'min_price',
+             'max_price', 'total_stock', 'first_image', 'first_image_derivatives')
+
+    summaries = {}
+    links = ProductVariant.attributes.through.objects.filter(
+        productvariant__product_id__in=product_ids
+    ).values_list(
+        'productvariant__product_id',
+        'attributevalue__attribute__title',
+        'attributevalue__value',
+    ).distinct()
+    for product_id, attribute_title, value in links:
+        values = summaries.setdefault(product_id, {}).setdefault(attribute_title, [])
+        if value not in values:
+            values.append(value)
+    for summary in summaries.values():
+        for values in summary.values():
+            values.sort()
+
+    cards = [
+        ProductCard(
+            product_id=row['id'],
+            collection_id=row['collection_id'],
+            title=row['title'],
+            created_at=row['created_at'],
+            min_price=row['min_price'],
+            max_price=row['max_price'],
+            total_stock=row['total_stock'] or 0,
+            image=row['first_image'] or '',
+            image_derivatives=row['first_image_derivatives'] or {},
+            attribute_summary=summaries.get(row['id'], {}),
+        )
+        for row in rows
+    ]
+    if cards:
+        ProductCard.objects.bulk_create(
+            cards,
+            update_conflicts=True,
+            unique_fields=['product'],
+            update_fields=['collection', 'title', 'created_at', 'min_price',
+                           'max_price', 'total_stock', 'image',
+                           'image_derivatives', 'attribute_summary', 'updated_at'],
+        )
+    missing = product_ids - {card.product_id for card in cards}
+    if missing:
+        ProductCard.objects.filter(product_id__in=missing).delete()
+
+
+def schedule_product_card_refresh(product_ids):
+    """
+    Refresh the cards once the surrounding transaction commits.
+
+    Saving a product from the admin fires a signal per inline variant and
+    image; the ids are collected and refreshed together in one pass.
+    Deferring also avoids re-creating a card while its product is being
+    cascade-deleted.
+    """
+    product_ids = {pk for pk in product_ids if pk is not None}
+    if not product_ids:
+        return
+    pending = getattr(_pending, 'product_ids', None)
+    if pending is None:
+        pending = _pending.product_ids = set()
+    pending.update(product_ids)
+    # The writes are committed by the time this runs: a failed refresh is
+    # logged (rebuild_product_cards repairs it) instead of failing the caller.
+    transaction.on_commit(_flush_pending_refresh, robust=True)
+
+
+def _flush_pending_refresh():
+    product_ids = getattr(_pending, 'product_ids', None)
+    _pending.product_ids = set()
+    if product_ids:
+        refresh_product_cards(product_ids)
+
+
+def rebuild_product_cards(batch_size=500):
+    """Recompute every card, e.g. after a deploy or a bulk data fix."""
+    product_ids = Product.objects.order_by('id').values_list('id', flat=True)
+    batch = []
+    for product_id in product_ids.iterator(chunk_size=batch_size):
+        batch.append(product_id)
+        if len(batch) >= batch_size:
+            refresh_product_cards(batch)
+            batch = []
+    refresh_product_cards(batch)
+    # Drop cards of products that disappeared without a signal (raw SQL, etc.).
+    ProductCard.objects.exclude(product__in=Product.objects.all()).delete()
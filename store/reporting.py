@@ -0,0 +1,122 @@
+"""
+Daily sales rollups.
+
+An order counts towards sales while its status is in COUNTED_STATUSES.
+Whenever an order enters or leaves those statuses, its items are added to
+or subtracted from the rollup rows of the order's day:
+- DailySales, per day
+- DailyCollectionSales, per day and collection
+- DailyVariantSales, per day and variant
+Reports then aggregate a few rows per day instead of joining OrderItem
+through variants, products and collections.
+
+Writes that bypass Order.save() (queryset.update, raw SQL), or edits to
+the items of a counted order, are not tracked. `rebuild_sales_rollups`
+recomputes everything from the orders.
+"""
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from .models import (
+    DailyCollectionSales,
+    DailySales,
+    DailyVariantSales,
+    Order,
+    OrderItem,
+)
+
+
+COUNTED_STATUSES = ('processing', 'completed')
+
+
+def is_counted(status):
+    return status in COUNTED_STATUSES
+
+
+def apply_order(order, sign):
+    """Add (`sign=1`) or subtract (`sign=-1`) an order's items from the rollups."""
+    day = timezone.localdate(order.created_at)
+    lines = list(OrderItem.objects.filter(order=order).values(
+        'product_variant_id', 'product_variant__product__collection_id',
+    ).annotate(
+        revenue=Sum(F('price') * F('quantity')),
+        units=Sum('quantity'),
+    ))
+    with transaction.atomic():
+        _increment(DailySales, {'date': day}, {
+            'orders': sign,
+            'items': sign * sum(line['units'] for line in lines),
+            'revenue': sign * sum(line['revenue'] or 0 for line in lines),
+        })
+        collections = {}
+        for line in lines:
+            totals = collections.setdefault(
+                line['product_variant__product__collection_id'], {'items': 0, 'revenue': 0})
+            totals['items'] += line['units']
+            totals['revenue'] += line['revenue'] or 0
+        for collection_id, totals in sorted(collections.items()):
+            _increment(DailyCollectionSales, {'date': day, 'collection_id': collection_id}, {
+                'items': sign * totals['items'],
+                'revenue': sign * totals['revenue'],
+            })
+        for line in sorted(lines, key=lambda line: line['product_variant_id']):
+            _increment(DailyVariantSales, {
+                'date': day, 'product_variant_id': line['product_variant_id'],
+            }, {
+                'quantity': sign * line['units'],
+                'revenue': sign * (line['revenue'] or 0),
+            })
+
+
+def rebuild_sales_rollups():
+    """Recompute every rollup row from the counted orders, in SQL."""
+    items = OrderItem.objects.filter(order__status__in=COUNTED_STATUSES).annotate(
+        date=TruncDate('order__created_at'))
+    with transaction.atomic():
+        DailySales.objects.all().delete()
+        DailyCollectionSales.objects.all().delete()
+        DailyVariantSales.objects.all().delete()
+
+        orders = dict(Order.objects.filter(status__in=COUNTED_STATUSES).annotate(
+            date=TruncDate('created_at')).values('date').annotate(
+            count=Count('pk')).values_list('date', 'count'))
+        days = {
+            row['date']: row for row in items.values('date').annotate(
+                items=Sum('quantity'), revenue=Sum(F('price') * F('quantity')))
+        }
+        DailySales.objects.bulk_create([
+            DailySales(date=date, orders=count,
+                       items=days.get(date, {}).get('items') or 0,
+                       revenue=days.get(date, {}).get('revenue') or 0)
+            for date, count in orders.items()
+        ])
+        DailyCollectionSales.objects.bulk_create([
+            DailyCollectionSales(
+                date=row['date'], collection_id=row['product_variant__product__collection'],
+                items=row['items'], revenue=row['revenue'] or 0)
+            for row in items.values('date', 'product_variant__product__collection').annotate(
+                items=Sum('quantity'), revenue=Sum(F('price') * F('quantity')))
+        ])
+        DailyVariantSales.objects.bulk_create([
+            DailyVariantSales(
+                date=row['date'], product_variant_id=row['product_variant'],
+                quantity=row['units'], revenue=row['revenue'] or 0)
+            for row in items.values('date', 'product_variant').annotate(
+                units=Sum('quantity'), revenue=Sum(F('price') * F('quantity')))
+        ])
+    return len(orders)
+
+
+def _increment(model, key, deltas):
+    # Update-or-insert; concurrent transitions on the same day add up
+    # through the UPDATE instead of overwriting each other.
+    updates = {field: F(field) + delta for field, delta in deltas.items()}
+    if model.objects.filter(**key).update(**updates):
+        return
+    try:
+        with transaction.atomic():
+            model.objects.create(**key, **deltas)
+    except IntegrityError:
+        model.objects.filter(**key).update(**updates)
@@ -0,0 +1,186 @@
+"""
+Time-boxed stock holds for carts.
+
+A StockReservation holds `quantity` units of a variant for a cart until it
+expires. `ProductVariant.reserved` is the running total of the holds on a
+variant. Every change to the reservations updates it in the same
+transaction, so availability (`stock - reserved`) is a column read.
+
+Locks are always taken variant rows first, in primary key order, then
+reservation rows. Reserving, checking out and sweeping therefore queue up
+on a hot variant instead of deadlocking.
+
+Reserving and checking out release the expired holds on the variants they
+lock before counting what is available, so holds lapse on time even when
+no sweeper runs. The sweeper only reclaims holds on variants nobody is
+buying.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, Q, Sum, When
+from django.utils import timezone
+
+from .checkout import OutOfStockError
+from .models import CartItem, ProductVariant, StockReservation
+
+
+DEFAULTS = {
+    # Seconds a hold lasts; reserving again extends it.
+    'TTL': 15 * 60,
+    # Seconds between in-process sweeps of expired holds. None disables the
+    # sweeper; run `manage.py release_expired_reservations` instead.
+    'SWEEP_INTERVAL': None,
+    # Reservations released per transaction by the sweeper.
+    'BATCH_SIZE': 500,
+}
+
+
+def reservation_options():
+    return {**DEFAULTS, **getattr(settings, 'STOCK_RESERVATIONS', {})}
+
+
+def reserve(cart, quantities, ttl=None):
+    """
+    Set the cart's holds to `{variant id: quantity}`; a quantity of 0
+    releases the hold. All holds of the cart are extended by `ttl` seconds.
+    Raises OutOfStockError, changing nothing, when a variant can't cover
+    the increase. Returns the new expiry time.
+    """
+    ttl = reservation_options()['TTL'] if ttl is None else ttl
+    expires_at = timezone.now() + timedelta(seconds=ttl)
+    with transaction.atomic():
+        variants = _lock_variants(quantities)
+        release_expired_holds(variants)
+        held = dict(StockReservation.objects.select_for_update().filter(
+            cart=cart, product_variant_id__in=quantities,
+        ).values_list('product_variant_id', 'quantity'))
+
+        deltas = {}
+        shortages = {}
+        for pk, quantity in quantities.items():
+            delta = quantity - held.get(pk, 0)
+            if not delta:
+                continue
+            if pk not in variants:
+                shortages[pk] = 0
+            elif delta > 0 and variants[pk]['stock'] - variants[pk]['reserved'] < delta:
+                shortages[pk] = max(
+                    variants[pk]['stock'] - variants[pk]['reserved'], 0) + held.get(pk, 0)
+            deltas[pk] = delta
+        if shortages:
+            raise OutOfStockError(shortages)
+        _apply_deltas(deltas)
+
+        StockReservation.objects.filter(
+            cart=cart, product_variant_id__in=[pk for pk, q in quantities.items() if not q],
+        ).delete()
+        StockReservation.objects.bulk_create(
+            [StockReservation(cart=cart, product_variant_id=pk, quantity=quantity,
+                              expires_at=expires_at)
+             for pk, quantity in quantities.items() if quantity],
+            update_conflicts=True,
+            unique_fields=['cart', 'product_variant'],
+            update_fields=['quantity', 'expires_at'],
+        )
+        StockReservation.objects.filter(cart=cart).update(expires_at=expires_at)
+    return expires_at
+
+
+def reserve_cart(cart, ttl=None):
+    """Hold exactly the cart's items, e.g. when the customer starts paying."""
+    with transaction.atomic():
+        quantities = dict(
+            CartItem.objects.filter(cart=cart).values('product_variant_id')
+            .annotate(quantity=Sum('quantity')).values_list('product_variant_id', 'quantity'))
+        for pk in cart.reservations.exclude(product_variant_id__in=quantities).values_list(
+                'product_variant_id', flat=True):
+            quantities[pk] = 0
+        return reserve(cart, quantities, ttl=ttl)
+
+
+def release(cart):
+    """Drop every hold of the cart."""
+    with transaction.atomic():
+        held = dict(cart.reservations.values_list('product_variant_id', 'quantity'))
+        if held:
+            reserve(cart, {pk: 0 for pk in held})
+
+
+def release_expired(batch_size=None, now=None):
+    """
+    Release holds that expired before `now`, `batch_size` per transaction so
+    a flash-sale backlog never locks a hot variant for long. Returns the
+    number released.
+    """
+    batch_size = batch_size or reservation_options()['BATCH_SIZE']
+    now = now or timezone.now()
+    released = 0
+    while True:
+        batch = list(StockReservation.objects.filter(expires_at__lte=now).order_by(
+            'expires_at', 'pk').values_list('pk', 'product_variant_id')[:batch_size])
+        if not batch:
+            return released
+        with transaction.atomic():
+            _lock_variants({variant_id for _, variant_id in batch})
+            # Re-read under the locks; a cart may have renewed or checked out.
+            expired = StockReservation.objects.select_for_update().filter(
+                pk__in=[pk for pk, _ in batch], expires_at__lte=now)
+            deltas = {}
+            pks = []
+            for pk, variant_id, quantity in expired.values_list(
+                    'pk', 'product_variant_id', 'quantity'):
+                deltas[variant_id] = deltas.get(variant_id, 0) - quantity
+                pks.append(pk)
+            StockReservation.objects.filter(pk__in=pks).delete()
+            _apply_deltas(deltas)
+        released += len(pks)
+        if len(batch) < batch_size:
+            return released
+
+
+def release_expired_holds(variants, now=None):
+    """
+    Release the expired holds on `variants`, `{pk: row}` as returned by
+    _lock_variants (the rows must be locked), and update their `reserved`.
+    """
+    now = now or timezone.now()
+    expired = list(StockReservation.objects.select_for_update().filter(
+        product_variant_id__in=variants, expires_at__lte=now,
+    ).values_list('pk', 'product_variant_id', 'quantity'))
+    if not expired:
+        return
+    deltas = {}
+    for _, variant_id, quantity in expired:
+        deltas[variant_id] = deltas.get(variant_id, 0) - quantity
+    StockReservation.objects.filter(pk__in=[pk for pk, _, _ in expired]).delete()
+    _apply_deltas(deltas)
+    for variant_id, delta in deltas.items():
+        variants[variant_id]['reserved'] += delta
+
+
+def _lock_variants(variant_ids):
+    return {
+        row['pk']: row
+        for row in ProductVariant.objects.select_for_update().filter(
+            pk__in=variant_ids).order_by('pk').values('pk', 'stock', 'reserved')
+    }
+
+
+def _apply_deltas(deltas):
+    """Add `{variant id: delta}` to `reserved` in one conditional UPDATE."""
+    deltas = {pk: delta for pk, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    matches = Q()
+    for pk, delta in deltas.items():
+        if delta > 0:
+            matches |= Q(pk=pk, stock__gte=F('reserved') + delta)
+        else:
+            matches |= Q(pk=pk, reserved__gte=-delta)
+    updated = ProductVariant.objects.filter(matches).update(
+        reserved=F('reserved') + Case(*[When(pk=pk, then=delta) for pk, delta in deltas.items()]))
+    if updated != len(deltas):
+        # Only possible if a variant vanished under us; undo everything.
+        raise OutOfStockError({pk: 0 for pk in deltas})
@@ -1,8 +1,11 @@
 from .models import Collection, Attribute
 from rest_framework import serializers
 from collections import Counter
+from datetime import timedelta
 from django.contrib.auth import get_user_model
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
+from backend.images import SrcsetField
 from .models import (
     Collection,
     Attribute,
@@ -10,10 +13,12 @@ from .models import (
     ProductImage,
     Product,
     ProductVariant,
+    ProductCard,
     Order,
     OrderItem,
     Cart,
-    CartItem
+    CartItem,
+    DailySales
 )
 
 
@@ -52,17 +57,42 @@ class AttributeSerializer(serializers.ModelSerializer):
 class CollectionSerializer(serializers.ModelSerializer):
     subcollections = NestedCollectionSerializer(many=True, read_only=True)
     attributes = AttributeSerializer(many=True, read_only=True)
+    image_srcset = SrcsetField()
 
     class Meta:
         model = Collection
         fields = ['id', 'title', 'description',
-                  'image', 'parent', 'subcollections', 'attributes']
+                  'image', 'image_srcset', 'parent', 'subcollections', 'attributes']
+
+    def validate_parent(self, parent):
+        if self.instance is not None and self.instance.would_create_cycle(parent):
+            raise serializers.ValidationError(
+                _("A collection can't be placed under itself or one of its descendants."))
+        return parent
+
+
+class CollectionTreeSerializer(serializers.ModelSerializer):
+    # `tree_children` is attached by the view, which builds the whole tree
+    # from one query.
+    children = serializers.SerializerMethodField()
+    image_srcset = SrcsetField()
+
+    class Meta:
+        model = Collection
+        fields = ['id', 'title', 'image', 'image_srcset', 'parent', 'depth', 'children']
+
+    def get_children(self, obj):
+        return CollectionTreeSerializer(
+            obj.tree_children, many=True, context=self.context).data
 
 
 class ProductImageSerializer(serializers.ModelSerializer):
+    # {format: srcset} of the resized copies; empty until they're generated.
+    srcset = SrcsetField()
+
     class Meta:
         model = ProductImage
-        fields = ['id', 'image']
+        fields = ['id', 'image', 'srcset']
 
 
 class ProductVariantSerializer(serializers.ModelSerializer):
@@ -156,6 +186,19 @@ class ProductSerializer(serializers.ModelSerializer):
         ]
 
 
+class ProductCardSerializer(serializers.ModelSerializer):
+    # Flat listing row read straight from the projection table.
+    id = serializers.IntegerField(source='product_id', read_only=True)
+    collection_id = serializers.IntegerField(read_only=True)
+    image_srcset = SrcsetField()
+
+    class Meta:
+        model = ProductCard
+        fields = ['id', 'title', 'collection_id', 'created_at',
+                  'min_price', 'max_price', 'total_stock', 'image',
+                  'image_srcset', 'attribute_summary']
+
+
 # ------------------------------------------------------------------
 # Order & OrderItem Serializers
 # ------------------------------------------------------------------
@@ -206,9 +249,35 @@ class OrderSerializer(serializers.ModelSerializer):
                   'updated_at', 'status', 'total', 'items']
 
 
+class OrderSummarySerializer(serializers.ModelSerializer):
+    # Annotated by OrderViewSet; no items are loaded for the list.
+    item_count = serializers.IntegerField(read_only=True)
+    thumbnail = serializers.SerializerMethodField()
+
+    class Meta:
+        model = Order
+        fields = ['id', 'status', 'total', 'created_at', 'updated_at',
+                  'item_count', 'thumbnail']
+
+    def get_thumbnail(self, obj):
+        if not obj.thumbnail:
+            return None
+        url = ProductImage._meta.get_field('image').storage.url(obj.thumbnail)
+        request = self.context.get('request')
+        return request.build_absolute_uri(url) if request else url
+
+
 # ------------------------------------------------------------------
 # Cart & CartItem Serializers
 # ------------------------------------------------------------------
+class CartProductSerializer(serializers.ModelSerializer):
+    images = ProductImageSerializer(many=True, read_only=True)
+
+    class Meta:
+        model = Product
+        fields = ['id', 'title', 'images']
+
+
 class CartItemSerializer(serializers.ModelSerializer):
     product_variant = ProductVariantSerializer(read_only=True)
     product_variant_id = serializers.PrimaryKeyRelatedField(
@@ -216,18 +285,75 @@ class CartItemSerializer(serializers.ModelSerializer):
         write_only=True,
         source='product_variant'
     )
+    product = CartProductSerializer(source='product_variant.product', read_only=True)
 
     class Meta:
         model = CartItem
-        fields = ['id', 'product_variant', 'product_variant_id', 'quantity']
+        fields = ['id', 'product', 'product_variant', 'product_variant_id', 'quantity']
 
 
 class CartSerializer(serializers.ModelSerializer):
     items = CartItemSerializer(many=True, read_only=True)
-    # Depending on your use case, you might let clients update items via nested writes;
-    # here we simply return a read-only list.
+    # Computed from the prefetched lines (see store.carts.cart_queryset).
+    total = serializers.SerializerMethodField()
 
     class Meta:
         model = Cart
-        fields = ['id', 'user', 'session_key',
-                  'created_at', 'updated_at', 'items']
+        # The owner and session key are never sent back: the key is the
+        # session cookie's value, which must stay HttpOnly.
+        fields = ['id', 'created_at', 'updated_at', 'items', 'total']
+
+    def get_total(self, obj):
+        # Rendered like the DecimalFields, as a string.
+        return str(sum((item.product_variant.price or 0) * item.quantity
+                       for item in obj.items.all()))
+
+
+class CartLineSerializer(serializers.Serializer):
+    # Input for the cart endpoints; lines are addressed by variant id.
+    product_variant_id = serializers.IntegerField(min_value=1)
+    quantity = serializers.IntegerField(min_value=0, default=1)
+
+    def validate_quantity(self, value):
+        if self.context.get('adding') and value < 1:
+            raise serializers.ValidationError(_("Add at least one item."))
+        return value
+
+
+# ------------------------------------------------------------------
+# Sales report Serializers (read from the daily rollups)
+# ------------------------------------------------------------------
+class SalesReportQuerySerializer(serializers.Serializer):
+    # Defaults to the last 30 days, today included.
+    start = serializers.DateField(required=False)
+    end = serializers.DateField(required=False)
+    limit = serializers.IntegerField(min_value=1, max_value=100, default=10)
+
+    def validate(self, attrs):
+        end = attrs.get('end') or timezone.localdate()
+        start = attrs.get('start') or end - timedelta(days=29)
+        if start > end:
+            raise serializers.ValidationError(_("start must not be after end."))
+        attrs.update(start=start, end=end)
+        return attrs
+
+
+class DailySalesSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = DailySales
+        fields = ['date', 'orders', 'items', 'revenue']
+
+
+class CollectionSalesSerializer(serializers.Serializer):
+    collection_id = serializers.IntegerField()
+    title = serializers.CharField(source='collection__title')
+    items = serializers.IntegerField()
+    revenue = serializers.DecimalField(max_digits=16, decimal_places=0)
+
+
+class VariantSalesSerializer(serializers.Serializer):
+    product_variant_id = serializers.IntegerField()
+    product_id = serializers.IntegerField(source='product_variant__product_id')
+    title = serializers.CharField(source='product_variant__product__title')
+    quantity = serializers.IntegerField()
+    revenue = serializers.DecimalField(max_digits=16, decimal_places=0)
@@ -0,0 +1,149 @@
+from django.contrib.auth.signals import user_logged_in
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
+from django.dispatch import Signal, receiver
+from django.utils import timezone
+
+from backend import images
+from backend.caching import invalidate_tag_on_change
+
+from .cache import CATALOG_TAG
+from .models import (
+    Attribute, AttributeValue, Cart, Collection, Order, Product, ProductImage, ProductVariant,
+)
+from .projections import schedule_product_card_refresh
+from .reporting import apply_order, is_counted
+
+
+# Sent by bulk write paths (imports, batched uploads) that bypass the model
+# signals, with `product_ids` of every product they created or changed.
+products_bulk_changed = Signal()
+
+
+def _products_using_values(value_ids):
+    return ProductVariant.objects.filter(
+        attributes__in=value_ids).values_list('product_id', flat=True).distinct()
+
+
+def _products_changed(product_ids):
+    """
+    Record a change to the variants, images or attribute values of products:
+    bump their `updated_at`, which conditional GETs validate against, and
+    schedule their cards for a refresh.
+    """
+    product_ids = list(product_ids)
+    if product_ids:
+        Product.objects.filter(pk__in=product_ids).update(updated_at=timezone.now())
+        schedule_product_card_refresh(product_ids)
+
+
+@receiver(products_bulk_changed)
+def refresh_cards_on_bulk_change(sender, product_ids, **kwargs):
+    _products_changed(product_ids)
+
+
+@receiver(post_save, sender=Product)
+def refresh_card_on_product_save(sender, instance, **kwargs):
+    schedule_product_card_refresh([instance.pk])
+
+
+@receiver(post_save, sender=ProductVariant)
+@receiver(post_delete, sender=ProductVariant)
+@receiver(post_save, sender=ProductImage)
+@receiver(post_delete, sender=ProductImage)
+def refresh_card_on_child_change(sender, instance, **kwargs):
+    _products_changed([instance.product_id])
+
+
+@receiver(post_save, sender=AttributeValue)
+def refresh_cards_on_value_save(sender, instance, created, **kwargs):
+    if not created:
+        _products_changed(_products_using_values([instance.pk]))
+
+
+@receiver(pre_delete, sender=AttributeValue)
+def refresh_cards_on_value_delete(sender, instance, **kwargs):
+    # The M2M rows are cascade-deleted without m2m_changed, so collect the
+    # affected products while they can still be found.
+    _products_changed(_products_using_values([instance.pk]))
+
+
+@receiver(post_save, sender=Attribute)
+def refresh_cards_on_attribute_save(sender, instance, created, **kwargs):
+    if not created:
+        _products_changed(_products_using_values(instance.values.values('pk')))
+
+
+@receiver(m2m_changed, sender=ProductVariant.attributes.through)
+def refresh_cards_on_variant_attributes(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear', 'pre_clear'):
+        return
+    if not reverse:
+        # instance is a ProductVariant; its cached label is now out of date.
+        instance.__dict__.pop('display_label', None)
+        if action != 'pre_clear':
+            _products_changed([instance.product_id])
+        return
+    # instance is an AttributeValue and pk_set holds variant ids.
+    if action == 'pre_clear':
+        variants = instance.variants.all()
+    elif action == 'post_clear':
+        return
+    else:
+        variants = ProductVariant.objects.filter(pk__in=pk_set)
+    _products_changed(variants.values_list('product_id', flat=True).distinct())
+
+
+@receiver(pre_delete, sender=Cart)
+def release_reservations_on_cart_delete(sender, instance, **kwargs):
+    # Holds are cascade-deleted with the cart (or its user); release them
+    # first so ProductVariant.reserved doesn't keep counting them.
+    from .reservations import release
+    release(instance)
+
+
+@receiver(user_logged_in)
+def merge_session_cart_on_login(sender, request, user, **kwargs):
+    # Whatever was added before signing in moves into the user's cart.
+    if request is not None and hasattr(request, 'session'):
+        from .carts import merge_session_cart
+        merge_session_cart(request, user)
+
+
+def _stored_status(order):
+    if order.pk is None:
+        return None
+    return Order.objects.filter(pk=order.pk).values_list('status', flat=True).first()
+
+
+@receiver(pre_save, sender=Order)
+def remember_order_status(sender, instance, **kwargs):
+    # Read the stored status rather than trusting a possibly stale instance.
+    instance._previous_status = _stored_status(instance)
+
+
+@receiver(post_save, sender=Order)
+def roll_up_order_on_status_change(sender, instance, **kwargs):
+    was_counted = is_counted(getattr(instance, '_previous_status', None))
+    if is_counted(instance.status) != was_counted:
+        apply_order(instance, -1 if was_counted else 1)
+
+
+@receiver(pre_delete, sender=Order)
+def roll_up_order_on_delete(sender, instance, **kwargs):
+    # Items are still there in pre_delete; they are cascade-deleted first.
+    if is_counted(_stored_status(instance)):
+        apply_order(instance, -1)
+
+
+# Any catalog write invalidates data derived from the whole catalog
+# (facet index, filter summaries, cached responses) through the catalog tag.
+CATALOG_MODELS = (Collection, Attribute, AttributeValue, Product, ProductVariant, ProductImage)
+
+bump_catalog_version_on_change = invalidate_tag_on_change(CATALOG_TAG, *CATALOG_MODELS)
+products_bulk_changed.connect(bump_catalog_version_on_change,
+                              dispatch_uid='catalog-version-bulk')
+
+# Resized copies for clients; their manifests are saved back through the
+# models, which refreshes cards and the catalog tag like any other edit.
+images.register(Collection, 'image')
+images.register(ProductImage, 'image')
@@ -1,5 +1,57 @@
+import io
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+from unittest import mock
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import OperationalError, close_old_connections, connection, connections
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.http import http_date
+from rest_framework import status
+from rest_framework.test import APITestCase
+from PIL import Image
+
+from backend import images
+
+from .checkout import CheckoutError, OutOfStockError, checkout
+from .importers import import_products
+from .reporting import rebuild_sales_rollups
+from .reservations import release_expired, reserve, reserve_cart
+from .uploads import InvalidImageError, save_product_images
+from .models import (
+    Attribute,
+    AttributeValue,
+    Cart,
+    CartItem,
+    Collection,
+    DailyCollectionSales,
+    DailySales,
+    DailyVariantSales,
+    Order,
+    OrderItem,
+    Product,
+    ProductCard,
+    ProductImage,
+    ProductVariant,
+    StockReservation,
+)
+
 # from django.urls import reverse
-# from django.core.files.uploadedfile import SimpleUploadedFile
+# from django.core.files.storage import FileSystemStorage, default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
 # from rest_framework import status
 # from rest_framework.test import APITestCase
 # from .models import Collection, Attribute, AttributeValue, Product, ProductImage, ProductVariant
@@ -143,3 +195,1034 @@
 #         response = self.client.get(url)
 #         self.assertEqual(response.status_code, status.HTTP_200_OK)
 #         self.assertGreaterEqual(len(response.data), 1)
+
+
+class ProductCursorPaginationTests(APITestCase):
+    def setUp(self):
+        self.collection = Collection.objects.create(title="Rings")
+        self.other_collection = Collection.objects.create(title="Necklaces")
+        now = timezone.now()
+        self.products = []
+        for index in range(7):
+            product = Product.objects.create(
+                title=f"Ring {index}", description="-", collection=self.collection)
+            self.products.append(product)
+        Product.objects.create(
+            title="Necklace", description="-", collection=self.other_collection)
+        # Give several products the same timestamp so the id tie-breaker matters.
+        Product.objects.filter(collection=self.collection).update(created_at=now)
+        Product.objects.filter(pk=self.products[0].pk).update(
+            created_at=now + timedelta(minutes=1))
+
+    def _walk(self, url):
+        seen = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            seen.extend(item['id'] for item in response.data['results'])
+            url = response.data['next']
+        return seen
+
+    def test_product_list_walks_every_product_once(self):
+        seen = self._walk(reverse('product-list') + '?page_size=3')
+        expected = list(Product.objects.order_by(
+            '-created_at', '-id').values_list('id', flat=True))
+        self.assertEqual(seen, expected)
+
+    def test_previous_link_returns_preceding_page(self):
+        first = self.client.get(reverse('product-list') + '?page_size=3')
+        self.assertIsNone(first.data['previous'])
+        second = self.client.get(first.data['next'])
+        back = self.client.get(second.data['previous'])
+        self.assertEqual(
+            [item['id'] for item in back.data['results']],
+            [item['id'] for item in first.data['results']])
+
+    def test_collection_products_are_paginated(self):
+        url = reverse('collection-products',
+                      kwargs={'pk': self.collection.pk}) + '?page_size=4'
+        seen = self._walk(url)
+        self.assertEqual(sorted(seen), sorted(p.pk for p in self.products))
+        self.assertEqual(seen[0], self.products[0].pk)
+
+    def test_invalid_cursor_returns_404(self):
+        response = self.client.get(reverse('product-list') + '?cursor=bogus')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class ProductCardProjectionTests(APITestCase):
+    def setUp(self):
+        self.collection = Collection.objects.create(title="Rings")
+        self.color = Attribute.objects.create(
+            title="Color", collection=self.collection)
+        self.gold = AttributeValue.objects.create(
+            attribute=self.color, value="Gold")
+        self.silver = AttributeValue.objects.create(
+            attribute=self.color, value="Silver")
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product = Product.objects.create(
+                title="Ring", description="-", collection=self.collection)
+
+    def test_card_tracks_variants_images_and_attributes(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            cheap = ProductVariant.objects.create(
+                product=self.product, price=100, stock=2)
+            cheap.attributes.add(self.silver)
+            pricey = ProductVariant.objects.create(
+                product=self.product, price=300, stock=5)
+            pricey.attributes.add(self.gold)
+            ProductImage.objects.create(
+                product=self.product, image='products/ring.webp')
+        card = ProductCard.objects.get(product=self.product)
+        self.assertEqual((card.min_price, card.max_price), (100, 300))
+        self.assertEqual(card.total_stock, 7)
+        self.assertEqual(card.image.name, 'products/ring.webp')
+        self.assertEqual(card.attribute_summary, {"Color": ["Gold", "Silver"]})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.gold.value = "Rose Gold"
+            self.gold.save()
+            cheap.delete()
+        card.refresh_from_db()
+        self.assertEqual((card.min_price, card.total_stock), (300, 5))
+        self.assertEqual(card.attribute_summary, {"Color": ["Rose Gold"]})
+
+    def test_card_list_is_a_single_query(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            for index in range(5):
+                product = Product.objects.create(
+                    title=f"Ring {index}", description="-", collection=self.collection)
+                ProductVariant.objects.create(product=product, price=10, stock=1)
+        with self.assertNumQueries(1):
+            response = self.client.get(
+                reverse('product-card-list') + f'?collection={self.collection.pk}')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['results']), 6)
+
+    def test_deleting_product_removes_card(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            ProductVariant.objects.create(product=self.product, price=10, stock=1)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.product.delete()
+        self.assertFalse(ProductCard.objects.exists())
+
+
+class ProductImportTests(APITestCase):
+    CSV = (
+        "product,title,description,collection,price,stock,attributes,images\n"
+        "r-1,Gold ring,Shiny,Rings,1200,3,Color:Gold;Size:52,products/r-1.webp\n"
+        "r-1,Gold ring,Shiny,Rings,1250,1,Color:Gold;Size:56,products/r-1b.webp\n"
+        "r-2,Bad ring,-,Rings,100,1,Color:Purple;Size:52,\n"
+        "r-3,Silver ring,-,{collection_id},900,0,color:silver;size:52,\n"
+    )
+
+    def setUp(self):
+        self.collection = Collection.objects.create(title="Rings")
+        color = Attribute.objects.create(title="Color", collection=self.collection)
+        size = Attribute.objects.create(title="Size", collection=self.collection)
+        for attribute, values in ((color, ["Gold", "Silver"]), (size, ["52", "56"])):
+            for value in values:
+                AttributeValue.objects.create(attribute=attribute, value=value)
+
+    def test_csv_import_in_chunks(self):
+        data = self.CSV.format(collection_id=self.collection.pk)
+        with self.captureOnCommitCallbacks(execute=True):
+            report = import_products(io.StringIO(data), 'csv', chunk_size=1)
+        self.assertEqual(
+            (report.products, report.variants, report.images, report.skipped),
+            (2, 3, 2, 1))
+        self.assertIn("Purple", report.errors[0]['error'])
+        ring = Product.objects.get(title="Gold ring")
+        self.assertEqual(
+            sorted(str(v.price) for v in ring.variants.all()), ["1200", "1250"])
+        self.assertEqual(
+            sorted(ring.variants.values_list('attributes__value', flat=True)),
+            ["52", "56", "Gold", "Gold"])
+        # Bulk writes still keep the listing projection current.
+        self.assertEqual(ProductCard.objects.get(product=ring).total_stock, 4)
+
+    def test_jsonl_import_rejects_incomplete_variants(self):
+        lines = [
+            {"product": "n-1", "title": "Ring", "collection": "Rings", "price": 5,
+             "stock": 1, "attributes": {"Color": "Gold"}},
+            {"product": "n-2", "title": "Ring 2", "collection": "Rings", "price": 5,
+             "attributes": {"Color": "Gold", "Size": "56"}, "images": ["products/a.webp"]},
+        ]
+        data = "\n".join(json.dumps(line) for line in lines)
+        report = import_products(io.BytesIO(data.encode()), 'jsonl')
+        self.assertEqual((report.products, report.skipped), (1, 1))
+        self.assertIn("Missing attribute values", report.errors[0]['error'])
+
+    def test_import_endpoint_requires_admin(self):
+        url = reverse('product-bulk-import')
+        upload = SimpleUploadedFile("catalog.csv", self.CSV.format(
+            collection_id=self.collection.pk).encode())
+        response = self.client.post(url, {'file': upload}, format='multipart')
+        self.assertIn(response.status_code, (401, 403))
+
+        admin = get_user_model().objects.create_superuser(
+            phone_number="09129999999", password="password")
+        self.client.force_authenticate(admin)
+        upload.seek(0)
+        response = self.client.post(url, {'file': upload}, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['products'], 2)
+
+
+class VariantLabelQueryTests(TestCase):
+    def setUp(self):
+        User = get_user_model()
+        self.admin = User.objects.create_superuser(
+            phone_number="09128888888", password="password")
+        self.client.force_login(self.admin)
+        self.collection = Collection.objects.create(title="Rings")
+        color = Attribute.objects.create(title="Color", collection=self.collection)
+        self.values = [AttributeValue.objects.create(attribute=color, value=v)
+                       for v in ("Gold", "Silver")]
+        self.order = Order.objects.create(user=self.admin)
+
+    def _add_variants(self, count):
+        for index in range(count):
+            product = Product.objects.create(
+                title=f"Ring {index}", description="-", collection=self.collection)
+            variant = ProductVariant.objects.create(product=product, price=10, stock=1)
+            variant.attributes.set(self.values)
+            OrderItem.objects.create(order=self.order, product_variant=variant, price=10)
+
+    def _count_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_changelists_use_constant_queries(self):
+        urls = [reverse('admin:store_productvariant_changelist'),
+                reverse('admin:store_orderitem_changelist')]
+        self._add_variants(2)
+        small = [self._count_queries(url) for url in urls]
+        self._add_variants(10)
+        self.assertEqual([self._count_queries(url) for url in urls], small)
+
+    def test_label_matches_previous_format(self):
+        self._add_variants(1)
+        variant = ProductVariant.objects.with_display_data().get()
+        with self.assertNumQueries(0):
+            label = str(variant)
+        self.assertEqual(label, "Ring 0 - Gold (Color (Rings)), Silver (Color (Rings))")
+
+
+class FacetFilterTests(APITestCase):
+    def setUp(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.collection = Collection.objects.create(title="Rings")
+            color = Attribute.objects.create(title="Color", collection=self.collection)
+            size = Attribute.objects.create(title="Size", collection=self.collection)
+            self.gold, self.silver = [
+                AttributeValue.objects.create(attribute=color, value=v)
+                for v in ("Gold", "Silver")]
+            self.small, self.large = [
+                AttributeValue.objects.create(attribute=size, value=v)
+                for v in ("52", "56")]
+            self.gold_small = self._product("A", 100, self.gold, self.small)
+            self.gold_large = self._product("B", 200, self.gold, self.large)
+            self.silver_small = self._product("C", 300, self.silver, self.small)
+
+    def _product(self, title, price, *values):
+        product = Product.objects.create(
+            title=title, description="-", collection=self.collection)
+        # Two variants with the same values must not duplicate the product.
+        for _ in range(2):
+            variant = ProductVariant.objects.create(product=product, price=price, stock=1)
+            variant.attributes.set(values)
+        return product
+
+    def _ids(self, query):
+        response = self.client.get(reverse('product-list') + query)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return sorted(item['id'] for item in response.data['results'])
+
+    def test_or_within_attribute_and_across_attributes(self):
+        self.assertEqual(self._ids('?attribute=Color:Gold,Color:Silver'),
+                         sorted([self.gold_small.pk, self.gold_large.pk, self.silver_small.pk]))
+        self.assertEqual(self._ids('?attribute=color:gold,Size:52'), [self.gold_small.pk])
+        self.assertEqual(self._ids(f'?attribute_value={self.silver.pk},{self.large.pk}'), [])
+        self.assertEqual(self._ids('?attribute=Color:Purple'), [])
+        self.assertEqual(self._ids('?min_price=150&attribute=Color:Gold'), [self.gold_large.pk])
+
+    def test_facet_counts_exclude_own_attribute(self):
+        url = reverse('collection-facets', kwargs={'pk': self.collection.pk})
+        response = self.client.get(url + '?attribute=Color:Gold')
+        self.assertEqual(response.data['count'], 2)
+        counts = {
+            facet['attribute']: {v['value']: (v['count'], v['selected']) for v in facet['values']}
+            for facet in response.data['facets']
+        }
+        # Colors are counted ignoring the color selection; sizes respect it.
+        self.assertEqual(counts['Color'], {"Gold": (2, True), "Silver": (1, False)})
+        self.assertEqual(counts['Size'], {"52": (1, False), "56": (1, False)})
+
+    def test_index_follows_catalog_changes(self):
+        self.assertEqual(self._ids('?attribute=Color:Silver'), [self.silver_small.pk])
+        with self.captureOnCommitCallbacks(execute=True):
+            variant = self.gold_large.variants.first()
+            variant.attributes.set([self.silver, self.large])
+        self.assertEqual(self._ids('?attribute=Color:Silver'),
+                         sorted([self.gold_large.pk, self.silver_small.pk]))
+
+
+class CollectionFiltersTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.collection = Collection.objects.create(title="Rings")
+            color = Attribute.objects.create(title="Color", collection=self.collection)
+            self.gold, self.silver = [
+                AttributeValue.objects.create(attribute=color, value=v)
+                for v in ("Gold", "Silver")]
+            for price, stock, value in ((100, 1, self.gold), (300, 2, self.gold),
+                                        (500, 0, self.silver)):
+                product = Product.objects.create(
+                    title="Ring", description="-", collection=self.collection)
+                variant = ProductVariant.objects.create(
+                    product=product, price=price, stock=stock)
+                variant.attributes.add(value)
+        self.url = reverse('collection-filters', kwargs={'pk': self.collection.pk})
+
+    def test_counts_and_price_ranges_for_in_stock_products(self):
+        response = self.client.get(self.url)
+        values = {v['value']: v for v in response.data[0]['values']}
+        self.assertEqual(
+            (values['Gold']['product_count'], values['Gold']['min_price'],
+             values['Gold']['max_price']), (2, "100", "300"))
+        self.assertEqual(
+            (values['Silver']['product_count'], values['Silver']['min_price']), (0, None))
+
+    def test_cached_until_catalog_changes_and_honours_etag(self):
+        first = self.client.get(self.url)
+        etag = first['ETag']
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            ProductVariant.objects.filter(price=500).update(stock=3)
+            ProductVariant.objects.get(price=500).save()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_unknown_collection_is_404(self):
+        response = self.client.get(reverse('collection-filters', kwargs={'pk': 999}))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class CollectionTreeTests(APITestCase):
+    def setUp(self):
+        self.jewelry = Collection.objects.create(title="Jewelry")
+        self.rings = Collection.objects.create(title="Rings", parent=self.jewelry)
+        self.gold = Collection.objects.create(title="Gold rings", parent=self.rings)
+        self.watches = Collection.objects.create(title="Watches")
+
+    def test_paths_follow_parent_changes(self):
+        self.assertEqual(self.gold.path, f"/{self.jewelry.pk}/{self.rings.pk}/{self.gold.pk}/")
+        self.rings.parent = self.watches
+        self.rings.save()
+        self.gold.refresh_from_db()
+        self.assertEqual(self.gold.path, f"/{self.watches.pk}/{self.rings.pk}/{self.gold.pk}/")
+        self.assertEqual(self.gold.depth, 2)
+
+        self.jewelry.parent = self.gold
+        self.jewelry.save()
+        self.rings.parent = self.jewelry
+        with self.assertRaises(ValidationError):
+            self.rings.save()
+
+    def test_tree_is_loaded_with_one_query(self):
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('collection-tree'))
+        self.assertEqual([node['title'] for node in response.data], ["Jewelry", "Watches"])
+        rings = response.data[0]['children'][0]
+        self.assertEqual(rings['children'][0]['title'], "Gold rings")
+
+        response = self.client.get(reverse('collection-tree'), {'root': self.rings.pk})
+        self.assertEqual([node['id'] for node in response.data], [self.rings.pk])
+
+    def test_products_can_include_descendants(self):
+        Product.objects.create(title="Ring", collection=self.gold)
+        Product.objects.create(title="Watch", collection=self.watches)
+        url = reverse('collection-products', kwargs={'pk': self.jewelry.pk})
+        self.assertEqual(self.client.get(url).data['results'], [])
+        response = self.client.get(url, {'include_descendants': 1})
+        self.assertEqual([p['title'] for p in response.data['results']], ["Ring"])
+
+    def test_api_rejects_moving_under_descendant(self):
+        user = get_user_model().objects.create_superuser(phone_number='09120000000', password='x')
+        self.client.force_authenticate(user)
+        response = self.client.patch(
+            reverse('collection-detail', kwargs={'pk': self.jewelry.pk}),
+            {'parent': self.gold.pk}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class ResponseCacheTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.collection = Collection.objects.create(title="Rings")
+        self.product = Product.objects.create(title="Ring", collection=self.collection)
+        self.url = reverse('product-detail', kwargs={'pk': self.product.pk})
+
+    def test_hits_skip_the_database(self):
+        first = self.client.get(self.url)
+        with self.assertNumQueries(0):
+            second = self.client.get(self.url)
+        self.assertEqual(second.status_code, status.HTTP_200_OK)
+        self.assertEqual(json.loads(second.content), first.data)
+
+    def test_catalog_changes_invalidate(self):
+        self.client.get(self.url)
+        with self.captureOnCommitCallbacks(execute=True):
+            ProductVariant.objects.create(product=self.product, price=100, stock=1)
+        response = self.client.get(self.url)
+        self.assertEqual(len(response.data['variants']), 1)
+
+    def test_query_params_and_authenticated_requests_are_separate(self):
+        self.client.get(reverse('product-list'))
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('product-list'), {'collection': self.collection.pk})
+        self.assertTrue(queries.captured_queries)
+
+        self.client.get(self.url)
+        user = get_user_model().objects.create_user(phone_number='09121111111', password='x')
+        self.client.force_authenticate(user)
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(self.url, HTTP_AUTHORIZATION='Bearer x')
+        self.assertTrue(queries.captured_queries)
+
+
+class ConditionalGetTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.collection = Collection.objects.create(title="Rings")
+        self.product = Product.objects.create(title="Ring", collection=self.collection)
+        self.url = reverse('product-detail', kwargs={'pk': self.product.pk})
+        # Authenticated requests bypass the response cache.
+        user = get_user_model().objects.create_user(phone_number='09122222222', password='x')
+        self.client.force_authenticate(user)
+        self.client.credentials(HTTP_AUTHORIZATION='Bearer token')
+
+    def test_not_modified_without_serializing(self):
+        response = self.client.get(self.url)
+        self.assertIn('Last-Modified', response)
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        listing = self.client.get(reverse('product-list'))
+        self.assertNotIn('Last-Modified', listing)
+        with self.assertNumQueries(1):
+            response = self.client.get(
+                reverse('product-list'), HTTP_IF_NONE_MATCH=listing['ETag'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_deleting_a_row_changes_the_list(self):
+        other = Product.objects.create(title="Band", collection=self.collection)
+        self.client.get(reverse('product-list'))
+        other.delete()
+        # MAX(updated_at) is unchanged; the client must not be told "not modified".
+        response = self.client.get(reverse('product-list'),
+                                   HTTP_IF_MODIFIED_SINCE=http_date(time.time() + 60))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['results']), 1)
+
+    def test_variant_changes_touch_the_product(self):
+        etag = self.client.get(self.url)['ETag']
+        ProductVariant.objects.create(product=self.product, price=100, stock=1)
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_version_validated_collections_and_cached_responses(self):
+        url = reverse('collection-detail', kwargs={'pk': self.collection.pk})
+        etag = self.client.get(url)['ETag']
+        with self.assertNumQueries(0):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        # A cached anonymous response carries its validators too.
+        self.client.force_authenticate(None)
+        self.client.credentials()
+        etag = self.client.get(self.url)['ETag']
+        with self.assertNumQueries(0):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_malformed_pk_is_not_found(self):
+        for name in ['product-detail', 'collection-detail', 'variant-detail',
+                     'product-card-detail']:
+            with self.subTest(name):
+                response = self.client.get(reverse(name, kwargs={'pk': 'abc'}))
+                self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class CheckoutTests(TestCase):
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(phone_number='09123333333', password='x')
+        collection = Collection.objects.create(title="Rings")
+        product = Product.objects.create(title="Ring", collection=collection)
+        self.small = ProductVariant.objects.create(product=product, price=100, stock=5)
+        self.large = ProductVariant.objects.create(product=product, price=250, stock=1)
+        self.cart = Cart.objects.create(user=self.user)
+
+    def test_order_is_created_and_stock_taken(self):
+        CartItem.objects.create(cart=self.cart, product_variant=self.small, quantity=3)
+        CartItem.objects.create(cart=self.cart, product_variant=self.large, quantity=1)
+        order = checkout(self.cart)
+        self.assertEqual(order.total, 550)
+        self.assertEqual(
+            sorted(order.items.values_list('product_variant_id', 'quantity', 'price')),
+            [(self.small.pk, 3, 100), (self.large.pk, 1, 250)])
+        self.small.refresh_from_db()
+        self.assertEqual(self.small.stock, 2)
+        self.assertFalse(self.cart.items.exists())
+
+    def test_shortage_rolls_everything_back(self):
+        CartItem.objects.create(cart=self.cart, product_variant=self.small, quantity=2)
+        CartItem.objects.create(cart=self.cart, product_variant=self.large, quantity=2)
+        with self.assertRaises(OutOfStockError) as caught:
+            checkout(self.cart)
+        self.assertEqual(caught.exception.shortages, {self.large.pk: 1})
+        self.small.refresh_from_db()
+        self.assertEqual(self.small.stock, 5)
+        self.assertEqual(self.cart.items.count(), 2)
+        self.assertFalse(Order.objects.exists())
+
+    def test_empty_and_anonymous_carts_are_rejected(self):
+        with self.assertRaises(CheckoutError):
+            checkout(self.cart)
+        anonymous = Cart.objects.create(session_key='abc')
+        CartItem.objects.create(cart=anonymous, product_variant=self.small)
+        with self.assertRaises(CheckoutError):
+            checkout(anonymous)
+
+
+class CheckoutConcurrencyTests(TransactionTestCase):
+    workers = 12
+    stock = 5
+
+    def setUp(self):
+        collection = Collection.objects.create(title="Rings")
+        product = Product.objects.create(title="Ring", collection=collection)
+        self.variant = ProductVariant.objects.create(product=product, price=100, stock=self.stock)
+        self.other = ProductVariant.objects.create(product=product, price=100, stock=100)
+        self.carts = []
+        for i in range(self.workers):
+            user = get_user_model().objects.create_user(phone_number=f'0912000{i:04d}')
+            cart = Cart.objects.create(user=user)
+            # Alternate line order so lock ordering is exercised.
+            variants = [self.variant, self.other] if i % 2 else [self.other, self.variant]
+            for variant in variants:
+                CartItem.objects.create(cart=cart, product_variant=variant)
+            self.carts.append(cart)
+
+    def test_parallel_checkouts_never_oversell(self):
+        results = []
+        barrier = threading.Barrier(self.workers)
+
+        def worker(cart):
+            barrier.wait()
+            try:
+                for attempt in range(50):
+                    try:
+                        results.append(checkout(cart).pk)
+                        return
+                    except OperationalError:
+                        # SQLite reports lock contention instead of waiting.
+                        time.sleep(0.01)
+                    except OutOfStockError:
+                        results.append(None)
+                        return
+            finally:
+                close_old_connections()
+
+        threads = [threading.Thread(target=worker, args=(cart,)) for cart in self.carts]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.variant.refresh_from_db()
+        orders = [pk for pk in results if pk is not None]
+        self.assertEqual(len(results), self.workers)
+        self.assertEqual(len(orders), self.stock)
+        self.assertEqual(self.variant.stock, 0)
+        self.assertEqual(
+            OrderItem.objects.filter(product_variant=self.variant).count(), self.stock)
+
+
+class StockReservationTests(TestCase):
+    def setUp(self):
+        User = get_user_model()
+        collection = Collection.objects.create(title="Rings")
+        product = Product.objects.create(title="Ring", collection=collection)
+        self.variant = ProductVariant.objects.create(product=product, price=100, stock=3)
+        self.cart = Cart.objects.create(user=User.objects.create_user(phone_number='09124444441'))
+        self.other = Cart.objects.create(user=User.objects.create_user(phone_number='09124444442'))
+
+    def reserved(self):
+        self.variant.refresh_from_db()
+        return self.variant.reserved
+
+    def test_holds_are_counted_and_bounded_by_stock(self):
+        reserve(self.cart, {self.variant.pk: 2})
+        self.assertEqual(self.reserved(), 2)
+        self.assertEqual(self.variant.available, 1)
+        with self.assertRaises(OutOfStockError) as caught:
+            reserve(self.other, {self.variant.pk: 2})
+        self.assertEqual(caught.exception.shortages, {self.variant.pk: 1})
+
+        reserve(self.cart, {self.variant.pk: 1})
+        reserve(self.other, {self.variant.pk: 2})
+        self.assertEqual(self.reserved(), 3)
+
+    def test_sweeper_releases_expired_holds_in_batches(self):
+        reserve(self.cart, {self.variant.pk: 1}, ttl=60)
+        reserve(self.other, {self.variant.pk: 2}, ttl=600)
+        later = timezone.now() + timedelta(seconds=120)
+        self.assertEqual(release_expired(batch_size=1, now=later), 1)
+        self.assertEqual(self.reserved(), 2)
+        self.assertEqual(release_expired(batch_size=1, now=later + timedelta(hours=1)), 1)
+        self.assertEqual(self.reserved(), 0)
+        self.assertFalse(StockReservation.objects.exists())
+
+    def test_expired_holds_lapse_without_the_sweeper(self):
+        reserve(self.other, {self.variant.pk: 3}, ttl=0)
+        CartItem.objects.create(cart=self.cart, product_variant=self.variant, quantity=2)
+        reserve_cart(self.cart)
+        self.assertEqual(self.reserved(), 2)
+        self.assertFalse(StockReservation.objects.filter(cart=self.other).exists())
+
+        reserve(self.cart, {self.variant.pk: 2}, ttl=0)
+        CartItem.objects.create(cart=self.other, product_variant=self.variant, quantity=3)
+        checkout(self.other)
+        self.variant.refresh_from_db()
+        self.assertEqual((self.variant.stock, self.variant.reserved), (0, 0))
+
+    def test_checkout_consumes_the_carts_own_hold(self):
+        CartItem.objects.create(cart=self.cart, product_variant=self.variant, quantity=3)
+        CartItem.objects.create(cart=self.other, product_variant=self.variant, quantity=1)
+        reserve_cart(self.cart)
+        with self.assertRaises(OutOfStockError):
+            checkout(self.other)
+        checkout(self.cart)
+        self.variant.refresh_from_db()
+        self.assertEqual((self.variant.stock, self.variant.reserved), (0, 0))
+
+    def test_deleting_a_cart_releases_its_holds(self):
+        reserve(self.cart, {self.variant.pk: 2})
+        self.cart.delete()
+        self.assertEqual(self.reserved(), 0)
+
+
+class CartApiTests(APITestCase):
+    def setUp(self):
+        collection = Collection.objects.create(title="Rings")
+        color = Attribute.objects.create(title="Color", collection=collection)
+        gold = AttributeValue.objects.create(attribute=color, value="Gold")
+        self.variants = []
+        for i in range(5):
+            product = Product.objects.create(title=f"Ring {i}", collection=collection)
+            ProductImage.objects.create(product=product, image=f'products/{i}.webp')
+            variant = ProductVariant.objects.create(product=product, price=100, stock=3)
+            variant.attributes.add(gold)
+            self.variants.append(variant)
+        self.cart_url = reverse('cart-list')
+        self.items_url = reverse('cart-add-item')
+
+    def item_url(self, variant):
+        return reverse('cart-item', kwargs={'variant_id': variant.pk})
+
+    def test_anonymous_lines_are_upserted(self):
+        variant = self.variants[0]
+        self.client.post(self.items_url, {'product_variant_id': variant.pk})
+        response = self.client.post(
+            self.items_url, {'product_variant_id': variant.pk, 'quantity': 2})
+        self.assertEqual([item['quantity'] for item in response.data['items']], [3])
+        self.assertEqual(response.data['total'], "300")
+        self.assertNotIn('session_key', response.data)
+        self.assertNotIn('user', response.data)
+
+        response = self.client.post(self.items_url, {'product_variant_id': variant.pk})
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+
+        response = self.client.patch(self.item_url(variant), {'quantity': 1})
+        self.assertEqual(response.data['items'][0]['quantity'], 1)
+        response = self.client.delete(self.item_url(variant))
+        self.assertEqual(response.data['items'], [])
+        self.assertEqual(CartItem.objects.count(), 0)
+
+    def test_reads_use_a_bounded_number_of_queries(self):
+        self.client.post(self.items_url, {'product_variant_id': self.variants[0].pk})
+        with CaptureQueriesContext(connection) as one:
+            self.client.get(self.cart_url)
+        for variant in self.variants[1:]:
+            self.client.post(self.items_url, {'product_variant_id': variant.pk})
+        with CaptureQueriesContext(connection) as five:
+            response = self.client.get(self.cart_url)
+        self.assertEqual(len(response.data['items']), 5)
+        self.assertEqual(len(one.captured_queries), len(five.captured_queries))
+
+    def test_session_cart_is_merged_on_login(self):
+        from users.otp_store import issue
+        User = get_user_model()
+        user = User.objects.create_user(phone_number='09125555555')
+        cart = Cart.objects.create(user=user)
+        CartItem.objects.create(cart=cart, product_variant=self.variants[0], quantity=1)
+
+        self.client.post(self.items_url, {'product_variant_id': self.variants[0].pk})
+        self.client.post(self.items_url, {'product_variant_id': self.variants[1].pk})
+        code = issue('09125555555')
+        response = self.client.post(
+            reverse('verify-otp'), {'phone_number': '09125555555', 'code': code})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        self.assertEqual(Cart.objects.count(), 1)
+        self.assertEqual(
+            sorted(cart.items.values_list('product_variant_id', 'quantity')),
+            [(self.variants[0].pk, 2), (self.variants[1].pk, 1)])
+
+    def test_checkout_places_the_order(self):
+        user = get_user_model().objects.create_user(phone_number='09126666666')
+        self.client.force_authenticate(user)
+        self.client.post(self.items_url, {'product_variant_id': self.variants[0].pk,
+                                          'quantity': 2})
+        response = self.client.post(reverse('cart-reserve'))
+        self.assertIn('expires_at', response.data)
+        response = self.client.post(reverse('cart-checkout'))
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['total'], "200")
+        self.assertEqual(self.client.get(self.cart_url).data['items'], [])
+
+    def test_anonymous_carts_cannot_hold_stock(self):
+        self.client.post(self.items_url, {'product_variant_id': self.variants[0].pk,
+                                          'quantity': 3})
+        response = self.client.post(reverse('cart-reserve'))
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+        self.assertFalse(StockReservation.objects.exists())
+
+
+class OrderHistoryTests(APITestCase):
+    def setUp(self):
+        User = get_user_model()
+        self.user = User.objects.create_user(phone_number='09127777777')
+        collection = Collection.objects.create(title="Rings")
+        color = Attribute.objects.create(title="Color", collection=collection)
+        gold = AttributeValue.objects.create(attribute=color, value="Gold")
+        self.orders = []
+        for i in range(3):
+            product = Product.objects.create(title=f"Ring {i}", collection=collection)
+            ProductImage.objects.create(product=product, image=f'products/{i}.webp')
+            variant = ProductVariant.objects.create(product=product, price=100, stock=3)
+            variant.attributes.add(gold)
+            order = Order.objects.create(user=self.user, total=100 * (i + 1))
+            for _ in range(i + 1):
+                OrderItem.objects.create(order=order, product_variant=variant, price=100)
+            self.orders.append(order)
+        Order.objects.create(user=User.objects.create_user(phone_number='09128888880'))
+        self.client.force_authenticate(self.user)
+
+    def test_list_is_a_summary_computed_in_sql(self):
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('order-list'))
+        results = response.data['results']
+        self.assertEqual([row['id'] for row in results],
+                         [order.pk for order in reversed(self.orders)])
+        self.assertEqual(results[0]['item_count'], 3)
+        self.assertTrue(results[0]['thumbnail'].endswith('products/2.webp'))
+        self.assertNotIn('items', results[0])
+
+    def test_detail_loads_items_without_n_plus_one(self):
+        url = reverse('order-detail', kwargs={'pk': self.orders[2].pk})
+        # Validators, order, items with variants, attribute values.
+        with self.assertNumQueries(4):
+            response = self.client.get(url)
+        self.assertEqual(len(response.data['items']), 3)
+        self.assertEqual(
+            response.data['items'][0]['product_variant']['attributes'][0]['value'], "Gold")
+
+    def test_other_users_orders_are_hidden(self):
+        other = Order.objects.exclude(user=self.user).get()
+        response = self.client.get(reverse('order-detail', kwargs={'pk': other.pk}))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_malformed_pk_is_not_found(self):
+        response = self.client.get(reverse('order-detail', kwargs={'pk': 'abc'}))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class SalesRollupTests(APITestCase):
+    def setUp(self):
+        User = get_user_model()
+        self.user = User.objects.create_user(phone_number='09129999999')
+        rings = Collection.objects.create(title="Rings")
+        chains = Collection.objects.create(title="Chains")
+        self.ring = ProductVariant.objects.create(
+            product=Product.objects.create(title="Ring", collection=rings), price=100, stock=9)
+        self.chain = ProductVariant.objects.create(
+            product=Product.objects.create(title="Chain", collection=chains), price=300, stock=9)
+        self.order = self.make_order([(self.ring, 2), (self.chain, 1)])
+
+    def make_order(self, lines):
+        order = Order.objects.create(user=self.user)
+        for variant, quantity in lines:
+            OrderItem.objects.create(
+                order=order, product_variant=variant, quantity=quantity, price=variant.price)
+        return order
+
+    def set_status(self, order, status):
+        order.status = status
+        order.save()
+
+    def day(self):
+        return DailySales.objects.values_list('orders', 'items', 'revenue').get()
+
+    def test_rollups_follow_status_transitions(self):
+        self.assertFalse(DailySales.objects.exists())
+        self.set_status(self.order, 'processing')
+        self.assertEqual(self.day(), (1, 3, 500))
+        self.set_status(self.order, 'completed')
+        self.assertEqual(self.day(), (1, 3, 500))
+        self.assertEqual(
+            dict(DailyVariantSales.objects.values_list('product_variant_id', 'quantity')),
+            {self.ring.pk: 2, self.chain.pk: 1})
+
+        other = self.make_order([(self.ring, 1)])
+        self.set_status(other, 'processing')
+        self.assertEqual(self.day(), (2, 4, 600))
+        self.set_status(self.order, 'cancelled')
+        self.assertEqual(self.day(), (1, 1, 100))
+        other.delete()
+        self.assertEqual(self.day(), (0, 0, 0))
+
+    def test_rebuild_matches_incremental_rollups(self):
+        self.set_status(self.order, 'processing')
+        self.set_status(self.make_order([(self.chain, 2)]), 'completed')
+        snapshot = (
+            self.day(),
+            sorted(DailyCollectionSales.objects.values_list('collection_id', 'items', 'revenue')),
+        )
+        rebuild_sales_rollups()
+        self.assertEqual(snapshot, (
+            self.day(),
+            sorted(DailyCollectionSales.objects.values_list('collection_id', 'items', 'revenue')),
+        ))
+
+    def test_report_endpoints(self):
+        self.set_status(self.order, 'processing')
+        url = reverse('sales-report-list')
+        self.client.force_authenticate(self.user)
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_403_FORBIDDEN)
+
+        admin = get_user_model().objects.create_superuser(phone_number='09120001111', password='x')
+        self.client.force_authenticate(admin)
+        response = self.client.get(url)
+        self.assertEqual(response.data['results'][0]['revenue'], "500")
+        response = self.client.get(reverse('sales-report-collections'))
+        self.assertEqual([row['title'] for row in response.data], ["Chains", "Rings"])
+        response = self.client.get(reverse('sales-report-top-variants'), {'limit': 1})
+        self.assertEqual([row['product_variant_id'] for row in response.data], [self.ring.pk])
+
+
+def make_image(name='photo.jpg', size=(800, 600), fmt='JPEG'):
+    buffer = io.BytesIO()
+    Image.new('RGB', size, 'gold').save(buffer, fmt)
+    return SimpleUploadedFile(name, buffer.getvalue(), content_type=f'image/{fmt.lower()}')
+
+
+@override_settings(IMAGE_DERIVATIVES={'ASYNC': False, 'WIDTHS': (160, 320, 1280),
+                                      'FORMATS': ('webp', 'jpeg')})
+class ImageDerivativeTests(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.collection = Collection.objects.create(title="Rings")
+        self.product = Product.objects.create(title="Ring", collection=self.collection)
+
+    def test_derivatives_are_generated_on_upload(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            image = ProductImage.objects.create(product=self.product, image=make_image())
+        image.refresh_from_db()
+        manifest = image.image_derivatives
+        self.assertEqual(manifest['source'], image.image.name)
+        # Never wider than the original.
+        self.assertEqual(sorted(manifest['variants']['webp']), ['160', '320'])
+        stem = os.path.splitext(image.image.name)[0]
+        self.assertEqual(manifest['variants']['webp']['320'], f'derivatives/{stem}/320w.webp')
+        with Image.open(os.path.join(self.media_root, manifest['variants']['jpeg']['160'])) as copy:
+            self.assertEqual(copy.size, (160, 120))
+
+    def test_serializers_return_srcsets(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            image = ProductImage.objects.create(product=self.product, image=make_image())
+        response = self.client.get(reverse('product-detail', kwargs={'pk': self.product.pk}))
+        srcset = response.data['images'][0]['srcset']
+        self.assertEqual(list(srcset), ['webp', 'jpeg'])
+        self.assertRegex(srcset['webp'], r'^http://testserver/media/derivatives/.+/160w\.webp 160w, '
+                                         r'http://testserver/media/derivatives/.+/320w\.webp 320w$')
+        # The card copies the manifest of the product's first image.
+        card = self.client.get(reverse('product-card-list')).data['results'][0]
+        self.assertEqual(card['image_srcset'], srcset)
+
+        # A replaced file has no srcset until its own copies exist.
+        ProductImage.objects.filter(pk=image.pk).update(image='products/other.jpg')
+        cache.clear()
+        response = self.client.get(reverse('product-detail', kwargs={'pk': self.product.pk}))
+        self.assertEqual(response.data['images'][0]['srcset'], {})
+
+    def test_manifest_records_the_names_actually_stored(self):
+        class KeepingStorage(FileSystemStorage):
+            # Never overwrites, so a second render gets suffixed names.
+            def delete(self, name):
+                pass
+
+        storage = KeepingStorage(location=self.media_root)
+        source = storage.save('products/ring.jpg', make_image())
+        first = images.render_derivatives(source, storage=storage)
+        second = images.render_derivatives(source, storage=storage)
+        self.assertTrue(images.manifest_files(second).isdisjoint(images.manifest_files(first)))
+        for name in images.manifest_files(second):
+            self.assertTrue(storage.exists(name))
+
+    def test_stale_derivatives_are_deleted(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            image = ProductImage.objects.create(product=self.product, image=make_image())
+            shared = ProductImage.objects.create(product=self.product, image=make_image())
+        old_files = images.manifest_files(image.image_derivatives)
+        with self.captureOnCommitCallbacks(execute=True):
+            image.image = make_image('other.jpg')
+            image.save()
+        image.refresh_from_db()
+        self.assertEqual(image.image_derivatives['source'], image.image.name)
+        for name in old_files:
+            self.assertFalse(default_storage.exists(name))
+
+        # Another row using the same file keeps the copies alive.
+        twin = ProductImage.objects.create(product=self.product, image=shared.image.name,
+                                           image_derivatives=shared.image_derivatives)
+        with self.captureOnCommitCallbacks(execute=True):
+            shared.delete()
+        for name in images.manifest_files(twin.image_derivatives):
+            self.assertTrue(default_storage.exists(name))
+        with self.captureOnCommitCallbacks(execute=True):
+            twin.delete()
+        for name in images.manifest_files(twin.image_derivatives):
+            self.assertFalse(default_storage.exists(name))
+
+    def test_unreadable_upload_is_skipped(self):
+        upload = SimpleUploadedFile('broken.jpg', b'not an image', content_type='image/jpeg')
+        with self.assertLogs('backend.images', 'WARNING'):
+            with self.captureOnCommitCallbacks(execute=True):
+                image = ProductImage.objects.create(product=self.product, image=upload)
+        image.refresh_from_db()
+        self.assertEqual(image.image_derivatives, {})
+
+    def test_backfill_renders_existing_files(self):
+        upload = make_image()
+        # Stored without the signal, like files from before the pipeline.
+        first = ProductImage.objects.create(product=self.product, image=upload)
+        ProductImage.objects.create(product=self.product, image=first.image.name)
+        self.collection.image = make_image('cover.png', size=(200, 200), fmt='PNG')
+        self.collection.save()
+
+        call_command('generate_image_derivatives', 'store.ProductImage',
+                     '--processes', '1', stdout=io.StringIO())
+
+        manifests = list(ProductImage.objects.values_list('image_derivatives', flat=True))
+        self.assertEqual(len(manifests), 2)
+        self.assertEqual(manifests[0], manifests[1])
+        self.assertEqual(manifests[0]['source'], first.image.name)
+        self.collection.refresh_from_db()
+        self.assertEqual(self.collection.image_derivatives, {})
+
+        # Up-to-date rows are left alone.
+        self.assertEqual(images.backfill(models=[ProductImage], processes=1), 0)
+
+
+@override_settings(IMAGE_DERIVATIVES={'ASYNC': False, 'WIDTHS': (160,), 'FORMATS': ('webp',)})
+class ProductImageUploadTests(APITestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        settings_override = override_settings(MEDIA_ROOT=self.media_root)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.collection = Collection.objects.create(title="Rings")
+        self.product = Product.objects.create(title="Ring", collection=self.collection)
+
+    def stored_files(self):
+        return sorted(os.listdir(os.path.join(self.media_root, 'products')))
+
+    def test_images_are_inserted_in_one_statement(self):
+        uploads = [make_image(f'{i}.jpg') for i in range(3)] + [make_image('0.jpg')]
+        with CaptureQueriesContext(connection) as queries:
+            with self.captureOnCommitCallbacks(execute=True):
+                created = save_product_images(self.product, uploads)
+        inserts = [q for q in queries.captured_queries
+                   if q['sql'].startswith('INSERT INTO "store_productimage"')]
+        self.assertEqual(len(inserts), 1)
+        self.assertEqual(len(created), 4)
+        # Same upload names still get their own files.
+        self.assertEqual(len(set(self.stored_files())), 4)
+        # The card and the derivatives catch up after commit.
+        self.assertEqual(ProductCard.objects.get(product=self.product).image, created[0].image.name)
+        self.assertTrue(all(image.image_derivatives for image in ProductImage.objects.all()))
+
+    def test_invalid_file_rejects_the_whole_batch(self):
+        uploads = [make_image(), SimpleUploadedFile('notes.jpg', b'plain text')]
+        with self.assertRaises(InvalidImageError):
+            save_product_images(self.product, uploads)
+        self.assertFalse(ProductImage.objects.exists())
+        self.assertFalse(os.path.exists(os.path.join(self.media_root, 'products')))
+
+    def test_upload_endpoints(self):
+        response = self.client.post(reverse('product-image-list'), {
+            'product': self.product.pk, 'images': [make_image('a.jpg'), make_image('b.png', fmt='PNG')],
+        }, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(len(response.data), 2)
+
+        response = self.client.post(reverse('product-list'), {
+            'title': "Chain", 'description': "Gold", 'collection_id': self.collection.pk,
+            'images': [make_image('c.jpg'), SimpleUploadedFile('d.jpg', b'nope')],
+        }, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('d.jpg', response.data['error'])
+        self.assertFalse(Product.objects.filter(title="Chain").exists())
+
+    def test_product_images_are_stored_outside_the_transaction(self):
+        # Files are saved on worker threads; look at this thread's connection.
+        request_connection = connections['default']
+        depth = len(request_connection.atomic_blocks)
+        depths = []
+        real_save = FileSystemStorage._save
+
+        def save(storage, name, content):
+            depths.append(len(request_connection.atomic_blocks))
+            return real_save(storage, name, content)
+
+        data = {'title': "Chain", 'description': "Gold", 'collection_id': self.collection.pk,
+                'images': [make_image('c.jpg'), make_image('d.jpg')]}
+        with mock.patch.object(FileSystemStorage, '_save', save):
+            response = self.client.post(reverse('product-list'), data, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(depths, [depth, depth])
+
+        # A failed insert leaves no files behind.
+        data['images'] = [make_image('e.jpg')]
+        with mock.patch('store.uploads.ProductImage.objects.bulk_create',
+                        side_effect=OperationalError("database is locked")):
+            with self.assertRaises(OperationalError):
+                self.client.post(reverse('product-list'), data, format='multipart')
+        self.assertFalse([name for name in self.stored_files() if name.startswith('e')])
@@ -0,0 +1,115 @@
+"""
+Batched product image uploads.
+
+Every file's header is checked first: format and dimensions only, no
+pixels are decoded. Nothing is stored unless all the files are acceptable
+images. The files are then written to storage concurrently on a thread
+pool, and their rows are inserted with a single bulk_create. Storing and
+inserting are separate steps, so callers can write the files before they
+open a transaction and keep it short.
+
+bulk_create skips model signals. `products_bulk_changed` therefore
+refreshes the product's card and the catalog caches, and the resized
+copies (backend/images.py) are generated in the background after commit.
+"""
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import transaction
+from PIL import Image, UnidentifiedImageError
+
+from backend import images
+
+from .models import ProductImage
+from .signals import products_bulk_changed
+
+
+DEFAULTS = {
+    # Threads writing files to storage per request.
+    'WORKERS': 4,
+    # Formats accepted, as reported by Pillow.
+    'FORMATS': ('JPEG', 'PNG', 'WEBP', 'GIF'),
+    # Largest width * height accepted; guards against decompression bombs.
+    'MAX_PIXELS': 50_000_000,
+}
+
+
+class InvalidImageError(ValueError):
+    def __init__(self, name, reason):
+        self.name = name
+        super().__init__(f"{name}: {reason}")
+
+
+def upload_options():
+    return {**DEFAULTS, **getattr(settings, 'IMAGE_UPLOADS', {})}
+
+
+def validate_image(upload):
+    """Check an upload's image header; raises InvalidImageError."""
+    options = upload_options()
+    try:
+        upload.seek(0)
+        # Image.open only parses the header; the bitmap is never loaded.
+        with Image.open(upload) as image:
+            image_format, (width, height) = image.format, image.size
+    except (UnidentifiedImageError, Image.DecompressionBombError, OSError):
+        raise InvalidImageError(upload.name, "not a readable image")
+    finally:
+        upload.seek(0)
+    if image_format not in options['FORMATS']:
+        raise InvalidImageError(upload.name, f"{image_format} images are not accepted")
+    if width * height > options['MAX_PIXELS']:
+        raise InvalidImageError(upload.name, "the image is too large")
+
+
+def save_product_images(product, uploads):
+    """Validate, store and insert `uploads` as images of `product`."""
+    return insert_product_images(product, store_product_images(uploads))
+
+
+def store_product_images(uploads):
+    """
+    Validate `uploads` and write them to storage; returns the stored names.
+    No row is written, so this can run before any transaction is opened.
+    """
+    for upload in uploads:
+        validate_image(upload)
+
+    field = ProductImage._meta.get_field('image')
+    names = [field.generate_filename(ProductImage(), upload.name) for upload in uploads]
+
+    def store(name, upload):
+        return field.storage.save(name, upload, max_length=field.max_length)
+
+    workers = min(upload_options()['WORKERS'], len(uploads)) or 1
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='image-upload') as pool:
+        futures = [pool.submit(store, name, upload) for name, upload in zip(names, uploads)]
+    stored = [future.result() for future in futures if not future.exception()]
+    if len(stored) < len(uploads):
+        discard_product_images(stored)
+        # Re-raise the first failure.
+        next(future.result() for future in futures if future.exception())
+    return stored
+
+
+def insert_product_images(product, names):
+    """
+    Insert already stored files as images of `product`, with one
+    bulk_create. The files are deleted if the insert fails.
+    """
+    try:
+        with transaction.atomic():
+            created = ProductImage.objects.bulk_create(
+                [ProductImage(product=product, image=name) for name in names])
+            products_bulk_changed.send(sender=ProductImage, product_ids=[product.pk])
+            images.schedule(created, 'image')
+    except Exception:
+        discard_product_images(names)
+        raise
+    return created
+
+
+def discard_product_images(names):
+    storage = ProductImage._meta.get_field('image').storage
+    for name in names:
+        storage.delete(name)
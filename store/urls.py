@@ -1,13 +1,17 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import CollectionViewSet, ProductViewSet, ProductImageViewSet, ProductVariantViewSet, AttributeViewSet
+from .views import CollectionViewSet, ProductViewSet, ProductCardViewSet, ProductImageViewSet, ProductVariantViewSet, AttributeViewSet, CartViewSet, OrderViewSet, SalesReportViewSet
 
 router = DefaultRouter()
 router.register(r'collections', CollectionViewSet, basename='collection')
 router.register(r'products', ProductViewSet, basename='product')
+router.register(r'product-cards', ProductCardViewSet, basename='product-card')
 router.register(r'product-images', ProductImageViewSet, basename='product-image')
 router.register(r'variants', ProductVariantViewSet, basename='variant')
 router.register(r'attributes', AttributeViewSet, basename='attribute')
+router.register(r'cart', CartViewSet, basename='cart')
+router.register(r'orders', OrderViewSet, basename='order')
+router.register(r'reports/sales', SalesReportViewSet, basename='sales-report')
 
 
 urlpatterns = [
@@ -1,65 +1,183 @@
-from django.shortcuts import render
+from django.db import transaction
+from django.db.models import Count, OuterRef, Prefetch, Subquery, Sum
+from django.db.models.functions import Coalesce
+from django.shortcuts import get_object_or_404, render
+from django.utils.http import parse_etags
 from django.utils.translation import gettext_lazy as _
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
+from rest_framework.exceptions import NotFound
 from rest_framework.parsers import MultiPartParser, FormParser
 from rest_framework.response import Response
 from rest_framework import permissions
 from django_filters import rest_framework as filters
 
+from backend.caching import CachedResponseMixin, ConditionalGetMixin
+
 from .serializers import (
     CollectionSerializer,
+    CollectionTreeSerializer,
     ProductSerializer,
     ProductImageSerializer,
     ProductVariantSerializer,
+    ProductCardSerializer,
     AttributeSerializer,
-    AttributeValueSerializer
+    AttributeValueSerializer,
+    CartSerializer,
+    CartLineSerializer,
+    OrderSerializer,
+    OrderSummarySerializer,
+    SalesReportQuerySerializer,
+    DailySalesSerializer,
+    CollectionSalesSerializer,
+    VariantSalesSerializer
 )
 from .models import (
     Collection,
     Product,
     ProductImage,
     ProductVariant,
+    ProductCard,
     Attribute,
-    AttributeValue
+    AttributeValue,
+    Order,
+    OrderItem,
+    DailySales,
+    DailyCollectionSales,
+    DailyVariantSales
+)
+from .filters import ATTRIBUTE_PARAMS, ProductFilter, ProductCardFilter
+from .facets import (
+    facet_index,
+    get_collection_filter_summary,
+    parse_attribute_pairs,
+    parse_value_ids,
+)
+from .pagination import OrderCursorPagination, ProductCursorPagination
+from .cache import CATALOG_TAG
+from .importers import FORMATS, guess_format, import_products
+from . import carts
+from .checkout import CheckoutError, OutOfStockError, checkout
+from .reservations import reserve_cart
+from .uploads import (
+    InvalidImageError,
+    discard_product_images,
+    insert_product_images,
+    save_product_images,
+    store_product_images,
 )
-from .filters import ProductFilter
 
 
-class CollectionViewSet(viewsets.ModelViewSet):
+class CollectionViewSet(CachedResponseMixin, ConditionalGetMixin, viewsets.ModelViewSet):
     queryset = Collection.objects.prefetch_related('subcollections').all()
     serializer_class = CollectionSerializer
+    cache_tags = (CATALOG_TAG,)
+    validator_field = None
+    # `filters` keeps its own summary cache with ETags.
+    cache_actions = ('list', 'retrieve', 'tree', 'products', 'facets')
+
+    @action(detail=False, methods=['get'])
+    def tree(self, request):
+        """
+        The collection hierarchy as nested `children`, or the subtree of
+        `?root=<id>`. Loaded with a single query and assembled in memory.
+        """
+        collections = Collection.objects.all()
+        root = request.query_params.get('root')
+        if root is not None:
+            if not root.isdigit():
+                raise NotFound(_("Collection not found."))
+            root = get_object_or_404(Collection, pk=root)
+            collections = collections.filter(path__startswith=root.path)
+        # Parents come before their children, and siblings stay in id order.
+        nodes = {}
+        roots = []
+        for node in collections.order_by('depth', 'id'):
+            node.tree_children = []
+            nodes[node.pk] = node
+            parent = nodes.get(node.parent_id)
+            if parent is None:
+                roots.append(node)
+            else:
+                parent.tree_children.append(node)
+        serializer = CollectionTreeSerializer(
+            roots, many=True, context={'request': request})
+        return Response(serializer.data)
+
+    def _products_of(self, collection, request):
+        # `?include_descendants=1` widens the listing to the whole subtree.
+        if request.query_params.get('include_descendants') in ('1', 'true', 'True'):
+            return Product.objects.filter(collection__path__startswith=collection.path)
+        return Product.objects.filter(collection=collection)
 
     @action(methods=['get'], detail=True)
     def products(self, request, pk=None):
         collection = self.get_object()
         # Optimize the query by prefetching related data for each Product.
-        products = Product.objects.select_related('collection').prefetch_related(
-            'variants__attributes__attribute', 'images').filter(collection=collection)
+        products = self._products_of(collection, request).select_related(
+            'collection').prefetch_related('variants__attributes__attribute', 'images')
 
         # Apply filtering if filter params are passed in the request
         product_filter = ProductFilter(request.GET, queryset=products)
         if product_filter.is_valid():
             products = product_filter.qs
 
+        # Page through the products with the same keyset cursor as the product list.
+        paginator = ProductCursorPagination()
+        page = paginator.paginate_queryset(products, request, view=self)
         serializer = ProductSerializer(
-            products, many=True, context={'request': request})
-        return Response(serializer.data)
+            page, many=True, context={'request': request})
+        return paginator.get_paginated_response(serializer.data)
 
     @action(detail=True, methods=['get'])
-    def filters(self, request, pk=None):
-        """Retrieve the attributes (filters) for the given collection."""
+    def facets(self, request, pk=None):
+        """
+        Per-value product counts for the collection under the current filters.
+        Accepts the same query parameters as `products`.
+        """
         collection = self.get_object()
-        # Get attributes linked to this collection
-        attributes = collection.attributes.all()
-        serializer = AttributeSerializer(attributes, many=True)
-        return Response(serializer.data)
+        # Price and other filters narrow the base set in SQL; attribute
+        # selections are applied in memory by the facet index.
+        params = request.GET.copy()
+        for param in ATTRIBUTE_PARAMS:
+            params.pop(param, None)
+        products = self._products_of(collection, request)
+        product_filter = ProductFilter(params, queryset=products)
+        if product_filter.is_valid():
+            products = product_filter.qs
+        base_ids = set(products.values_list('pk', flat=True))
+
+        index = facet_index.refresh()
+        selection = index.resolve(
+            pairs=parse_attribute_pairs(request.GET.get('attribute')),
+            value_ids=parse_value_ids(request.GET.get('attribute_value')))
+        matched = index.matching(selection)
+        count = len(base_ids if matched is None else base_ids & matched)
+        return Response({
+            'count': count,
+            'facets': index.facet_counts(base_ids, selection),
+        })
+
+    @action(detail=True, methods=['get'])
+    def filters(self, request, pk=None):
+        """
+        Retrieve the attributes (filters) for the given collection, with the
+        in-stock product count and price range of every value.
+        Cached until the catalog changes; supports If-None-Match.
+        """
+        # The collection is only loaded (and 404s checked) on a cache miss.
+        etag, data = get_collection_filter_summary(pk, self.get_object)
+        if etag in parse_etags(request.headers.get('If-None-Match', '')):
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+        return Response(data, headers={'ETag': etag})
 
 
-class ProductViewSet(viewsets.ModelViewSet):
+class ProductViewSet(CachedResponseMixin, ConditionalGetMixin, viewsets.ModelViewSet):
     serializer_class = ProductSerializer
+    cache_tags = (CATALOG_TAG,)
     filter_backends = [filters.DjangoFilterBackend]
     filterset_class = ProductFilter
+    pagination_class = ProductCursorPagination
     parser_classes = [MultiPartParser, FormParser]
 
     def get_queryset(self):
@@ -72,25 +190,68 @@ class ProductViewSet(viewsets.ModelViewSet):
         serializer = ProductSerializer(
             data=request.data, context={'request': request})
         serializer.is_valid(raise_exception=True)
-        product = serializer.save()
         images = request.FILES.getlist('images')
-        if images:
-            for image in images:
-                # Create ProductImage instances and associate them with the product
-                ProductImage.objects.create(product=product, image=image)
+        try:
+            # Validated and written to storage before the product exists, so
+            # the write transaction below doesn't wait on file I/O.
+            names = store_product_images(images) if images else []
+        except InvalidImageError as exc:
+            return Response({"error": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            with transaction.atomic():
+                product = serializer.save()
+                if names:
+                    insert_product_images(product, names)
+        except Exception:
+            discard_product_images(names)
+            raise
         # Re-serialize the product so that the response includes the newly added images.
         product_serializer = ProductSerializer(
             product, context={'request': request})
         return Response(product_serializer.data, status=status.HTTP_201_CREATED)
 
+    @action(detail=False, methods=['post'], url_path='import',
+            permission_classes=[permissions.IsAdminUser])
+    def bulk_import(self, request):
+        """
+        Stream a CSV/JSONL catalog file (`file`) into products, variants and images.
+        The format comes from `format` or the file extension.
+        """
+        upload = request.FILES.get('file')
+        if upload is None:
+            return Response({"error": _("No file uploaded.")}, status=status.HTTP_400_BAD_REQUEST)
+        file_format = request.data.get('format') or guess_format(upload.name)
+        if file_format not in FORMATS:
+            return Response({"error": _("Unsupported format.")}, status=status.HTTP_400_BAD_REQUEST)
+        # Large uploads are spooled to a temporary file and read line by line.
+        report = import_products(upload.file, file_format)
+        return Response(report.as_dict(), status=status.HTTP_201_CREATED)
+
+
+class ProductCardViewSet(CachedResponseMixin, ConditionalGetMixin, viewsets.ReadOnlyModelViewSet):
+    """
+    Lightweight catalog listing served from the ProductCard projection.
+    Each page is a single indexed query; use `?collection=<id>` to narrow it.
+    """
+    queryset = ProductCard.objects.all()
+    serializer_class = ProductCardSerializer
+    cache_tags = (CATALOG_TAG,)
+    # Validate against the catalog version, keeping pages to one query.
+    validator_field = None
+    filter_backends = [filters.DjangoFilterBackend]
+    filterset_class = ProductCardFilter
+    pagination_class = ProductCursorPagination
+
 
-class ProductImageViewSet(viewsets.ModelViewSet):
+class ProductImageViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
     """
     ProductImageViewSet manages images related to a product.
     It makes sure to validate the product exists and that images are indeed provided.
     """
     serializer_class = ProductImageSerializer
     parser_classes = [MultiPartParser, FormParser]
+    cache_tags = (CATALOG_TAG,)
+    validator_field = None
 
     def get_queryset(self):
         # Optimize queries for product images by selecting the related product.
@@ -107,24 +268,25 @@ class ProductImageViewSet(viewsets.ModelViewSet):
         if not images:
             return Response({"error": "No images uploaded."}, status=status.HTTP_400_BAD_REQUEST)
 
-        created_images = []
-        for image in images:
-            img_instance = ProductImage.objects.create(
-                product=product, image=image)
-            created_images.append(img_instance)
+        try:
+            created_images = save_product_images(product, images)
+        except InvalidImageError as exc:
+            return Response({"error": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
 
         serializer = ProductImageSerializer(
             created_images, many=True, context={'request': request})
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
 
-class AttributeViewSet(viewsets.ModelViewSet):
+class AttributeViewSet(CachedResponseMixin, ConditionalGetMixin, viewsets.ModelViewSet):
     """
     AttributeViewSet allows listing and CRUD for global attributes.
     Optionally, you can filter by a related collection using the query parameter 'collection'.
     It also provides an action `add_value` for adding a new AttributeValue to an attribute.
     """
     serializer_class = AttributeSerializer
+    cache_tags = (CATALOG_TAG,)
+    validator_field = None
 
     def get_queryset(self):
         collection_id = self.request.query_params.get('collection', None)
@@ -146,13 +308,180 @@ class AttributeViewSet(viewsets.ModelViewSet):
         return Response(serializer.data, status=status.HTTP_201_CREATED)
 
 
-class ProductVariantViewSet(viewsets.ModelViewSet):
+class ProductVariantViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
     """
     ProductVariantViewSet manages the variants of a product.
     Adding query-optimization with select_related and prefetch_related for related attribute data.
     """
     serializer_class = ProductVariantSerializer
+    cache_tags = (CATALOG_TAG,)
+    validator_field = None
 
     def get_queryset(self):
         return ProductVariant.objects.select_related('product') \
             .prefetch_related('attributes__attribute').all()
+
+
+class CartViewSet(viewsets.ViewSet):
+    """
+    The current cart: the signed-in user's, or the anonymous session's.
+
+    GET  cart/                         the cart
+    POST cart/items/                   add `quantity` of `product_variant_id`
+    PATCH/DELETE cart/items/<variant>/ set the quantity / remove the line
+    POST cart/reserve/                 hold the cart's stock for a while
+    POST cart/checkout/                place the order (signed-in users)
+    """
+
+    def list(self, request):
+        cart = carts.get_cart(request)
+        if cart is None:
+            return Response({'id': None, 'items': [], 'total': '0'})
+        return Response(CartSerializer(cart, context={'request': request}).data)
+
+    @action(detail=False, methods=['post'], url_path='items')
+    def add_item(self, request):
+        line = CartLineSerializer(data=request.data, context={'adding': True})
+        line.is_valid(raise_exception=True)
+        cart = carts.get_cart(request, create=True)
+        return self._change(request, cart, carts.add_item,
+                            line.validated_data['product_variant_id'],
+                            line.validated_data['quantity'])
+
+    @action(detail=False, methods=['patch', 'delete'], url_path=r'items/(?P<variant_id>\d+)')
+    def item(self, request, variant_id=None):
+        cart = carts.get_cart(request, create=True)
+        if request.method == 'DELETE':
+            return self._change(request, cart, carts.remove_item, int(variant_id))
+        line = CartLineSerializer(data={
+            'product_variant_id': variant_id, 'quantity': request.data.get('quantity')})
+        line.is_valid(raise_exception=True)
+        return self._change(request, cart, carts.set_item,
+                            int(variant_id), line.validated_data['quantity'])
+
+    # Holds are for carts that can be checked out; anonymous ones would only
+    # tie up stock.
+    @action(detail=False, methods=['post'], permission_classes=[permissions.IsAuthenticated])
+    def reserve(self, request):
+        cart = carts.get_cart(request)
+        if cart is None:
+            return Response({"error": _("The cart is empty.")}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            expires_at = reserve_cart(cart)
+        except OutOfStockError as exc:
+            return self._out_of_stock(exc)
+        return Response({'expires_at': expires_at})
+
+    @action(detail=False, methods=['post'], permission_classes=[permissions.IsAuthenticated])
+    def checkout(self, request):
+        cart = carts.get_cart(request)
+        if cart is None:
+            return Response({"error": _("The cart is empty.")}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            order = checkout(cart, user=request.user)
+        except OutOfStockError as exc:
+            return self._out_of_stock(exc)
+        except CheckoutError as exc:
+            return Response({"error": str(exc)}, status=status.HTTP_400_BAD_REQUEST)
+        order = Order.objects.prefetch_related(
+            'items__product_variant__attributes').get(pk=order.pk)
+        return Response(OrderSerializer(order, context={'request': request}).data,
+                        status=status.HTTP_201_CREATED)
+
+    def _change(self, request, cart, change, *args):
+        try:
+            change(cart, *args)
+        except OutOfStockError as exc:
+            return self._out_of_stock(exc)
+        cart = carts.cart_queryset().get(pk=cart.pk)
+        return Response(CartSerializer(cart, context={'request': request}).data)
+
+    def _out_of_stock(self, exc):
+        return Response({
+            "error": _("Not enough stock."),
+            "available": {str(pk): available for pk, available in exc.shortages.items()},
+        }, status=status.HTTP_409_CONFLICT)
+
+
+class OrderViewSet(ConditionalGetMixin, viewsets.ReadOnlyModelViewSet):
+    """
+    The signed-in user's order history.
+
+    The list is a summary computed in SQL (item count and first thumbnail
+    as subqueries), paged with a keyset cursor over the user's
+    `(created_at, id)` index. Items are only loaded by `retrieve`.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    pagination_class = OrderCursorPagination
+
+    def get_queryset(self):
+        orders = Order.objects.filter(user=self.request.user)
+        if self.action == 'list':
+            items = OrderItem.objects.filter(order=OuterRef('pk'))
+            item_count = items.order_by().values('order').annotate(
+                count=Count('pk')).values('count')
+            thumbnail = ProductImage.objects.filter(
+                product__variants__order_items__order=OuterRef('pk'),
+            ).order_by('product__variants__order_items__id', 'id').values('image')[:1]
+            return orders.annotate(
+                item_count=Coalesce(Subquery(item_count), 0),
+                thumbnail=Subquery(thumbnail))
+        return orders.prefetch_related(Prefetch(
+            'items', queryset=OrderItem.objects.select_related(
+                'product_variant').prefetch_related('product_variant__attributes')))
+
+    def get_serializer_class(self):
+        if self.action == 'list':
+            return OrderSummarySerializer
+        return OrderSerializer
+
+
+class SalesReportViewSet(viewsets.ViewSet):
+    """
+    Sales reports for staff, read from the daily rollup tables (see
+    store.reporting), so their cost depends on the number of days asked
+    for rather than on the number of orders. All take `?start=&end=`
+    (dates, default the last 30 days).
+
+    reports/sales/               revenue, orders and items per day
+    reports/sales/collections/   totals per collection
+    reports/sales/top-variants/  best-selling variants (`?limit=`)
+    """
+    permission_classes = [permissions.IsAdminUser]
+
+    def _query(self, request):
+        query = SalesReportQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        return query.validated_data
+
+    def list(self, request):
+        query = self._query(request)
+        days = DailySales.objects.filter(
+            date__range=(query['start'], query['end'])).order_by('date')
+        return Response({
+            'start': query['start'],
+            'end': query['end'],
+            'results': DailySalesSerializer(days, many=True).data,
+        })
+
+    @action(detail=False, methods=['get'])
+    def collections(self, request):
+        query = self._query(request)
+        rows = DailyCollectionSales.objects.filter(
+            date__range=(query['start'], query['end']),
+        ).values('collection_id', 'collection__title').annotate(
+            items=Sum('items'), revenue=Sum('revenue')).order_by('-revenue', 'collection_id')
+        return Response(CollectionSalesSerializer(rows, many=True).data)
+
+    @action(detail=False, methods=['get'], url_path='top-variants')
+    def top_variants(self, request):
+        query = self._query(request)
+        rows = DailyVariantSales.objects.filter(
+            date__range=(query['start'], query['end']),
+        ).values(
+            'product_variant_id', 'product_variant__product_id',
+            'product_variant__product__title',
+        ).annotate(
+            quantity=Sum('quantity'), revenue=Sum('revenue'),
+        ).order_by('-quantity', '-revenue', 'product_variant_id')[:query['limit']]
+        return Response(VariantSalesSerializer(rows, many=True).data)
@@ -34,14 +34,15 @@ admin.site.register(User, UserAdmin)
 # Simple OTP Admin
 @admin.register(OTP)
 class OTPAdmin(admin.ModelAdmin):
-    list_display = ('phone_number', 'code', 'created_at', 'expires_at')
+    list_display = ('phone_number', 'attempts', 'created_at', 'expires_at')
     list_filter = ('created_at', 'expires_at')
-    search_fields = ('phone_number', 'code')
+    search_fields = ('phone_number',)
+    readonly_fields = ('code_hash',)
 
 # BlacklistedAccessToken Admin
 @admin.register(BlacklistedAccessToken)
 class BlacklistedAccessTokenAdmin(admin.ModelAdmin):
-    list_display = ('jti', 'blacklisted_at')
+    list_display = ('jti', 'blacklisted_at', 'expires_at')
     search_fields = ('jti',)
 
 
@@ -4,3 +4,17 @@ from django.apps import AppConfig
 class UsersConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'users'
+
+    def ready(self):
+        from django.conf import settings
+        # Keeps the in-memory leaderboard in step with new ScoreEvents.
+        from . import leaderboard  # noqa: F401
+
+        # Optional in-process sweeper; prefer running `prune_auth_tables`
+        # from cron when a scheduler is available.
+        interval = getattr(settings, 'AUTH_TABLES_SWEEP_INTERVAL', None)
+        if interval:
+            from backend.background import start_periodic_task
+            from .lifecycle import prune_auth_tables
+            start_periodic_task(prune_auth_tables, interval,
+                                name='prune-auth-tables')
@@ -1,6 +1,6 @@
 from rest_framework_simplejwt.authentication import JWTAuthentication
 from rest_framework_simplejwt.exceptions import AuthenticationFailed
-from .models import BlacklistedAccessToken
+from .revocation import revocation_cache
 
 
 class CustomJWTAuthentication(JWTAuthentication):
@@ -10,6 +10,7 @@ class CustomJWTAuthentication(JWTAuthentication):
             return None
         user, validated_token = authentication_result
         jti = validated_token.get('jti')
-        if jti and BlacklistedAccessToken.objects.filter(jti=jti).exists():
+        # Served from the in-process revocation cache; no query in the common case.
+        if jti and revocation_cache.is_revoked(jti):
             raise AuthenticationFailed('Token has been revoked.')
         return (user, validated_token)
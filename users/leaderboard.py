@@ -0,0 +1,183 @@
+import threading
+import time
+from bisect import bisect_left, insort
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, IntegerField, Sum, Value, When
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import SCORE_VALUES, ScoreEvent, User
+
+
+DEFAULTS = {
+    # Seconds before the all-time ranking is reloaded from the database, to
+    # pick up changes made by other processes.
+    'REFRESH_INTERVAL': 300,
+    # Seconds a daily/weekly ranking is reused before being recomputed.
+    'WINDOW_TTL': 60,
+    # First day of the weekly window (Monday is 0, Saturday is 5).
+    'WEEK_START': 5,
+}
+
+WINDOWS = ('all', 'daily', 'weekly')
+
+
+def leaderboard_options():
+    return {**DEFAULTS, **getattr(settings, 'LEADERBOARD', {})}
+
+
+class Ranking:
+    """
+    Users sorted by score, highest first, stored as `(-score, user_id)`
+    tuples so every lookup is a binary search.
+
+    Ranks use competition ranking: users with equal scores share a rank and
+    the next rank is skipped ("1224").
+    """
+
+    def __init__(self, rows=()):
+        self._entries = [(-score, user_id) for user_id, score in rows]
+        self._entries.sort()
+        self._scores = {user_id: score for user_id, score in rows}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, user_id):
+        return user_id in self._scores
+
+    def score_of(self, user_id):
+        return self._scores.get(user_id, 0)
+
+    def rank_of_score(self, score):
+        # Number of users with a strictly higher score, plus one.
+        return bisect_left(self._entries, (-score,)) + 1
+
+    def rank(self, user_id):
+        return self.rank_of_score(self.score_of(user_id))
+
+    def top(self, limit):
+        return [self._entry(user_id, -neg) for neg, user_id in self._entries[:limit]]
+
+    def around(self, user_id, radius):
+        """The user's entry with up to `radius` neighbours on each side."""
+        score = self.score_of(user_id)
+        position = bisect_left(self._entries, (-score, user_id))
+        if position == len(self._entries) or self._entries[position][1] != user_id:
+            # Users without points in this ranking sit just below everyone.
+            position = len(self._entries)
+            entries = self._entries[max(position - radius, 0):position]
+            return [self._entry(uid, -neg) for neg, uid in entries] + \
+                [self._entry(user_id, score)]
+        entries = self._entries[max(position - radius, 0):position + radius + 1]
+        return [self._entry(uid, -neg) for neg, uid in entries]
+
+    def set_score(self, user_id, score):
+        old = self._scores.get(user_id)
+        if old is not None:
+            del self._entries[bisect_left(self._entries, (-old, user_id))]
+        self._scores[user_id] = score
+        insort(self._entries, (-score, user_id))
+
+    def _entry(self, user_id, score):
+        return {'rank': self.rank_of_score(score), 'user_id': user_id, 'score': score}
+
+
+class Leaderboard:
+    """
+    All-time ranking over `User.total_score`, kept in memory.
+
+    It is loaded once (in `total_score` index order) and then updated
+    incrementally as ScoreEvents are recorded, so top-N, rank and neighbour
+    lookups are binary searches instead of scans of the user table. Daily and weekly rankings
+    are aggregated from `ScoreEvent.event_date` and reused for a short TTL.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._ranking = None
+            self._loaded_at = None
+            self._windows = {}
+
+    def ranking(self, window='all'):
+        if window == 'all':
+            return self._all_time()
+        return self._window(window)
+
+    def apply_deltas(self, deltas):
+        """Add `{user_id: points}` to the loaded all-time ranking."""
+        with self._lock:
+            if self._ranking is None:
+                return
+            for user_id, points in deltas.items():
+                if user_id in self._ranking:
+                    score = self._ranking.score_of(user_id) + points
+                else:
+                    # Joined after the ranking was loaded.
+                    score = User.objects.filter(pk=user_id).values_list(
+                        'total_score', flat=True).first()
+                    if score is None:
+                        continue
+                self._ranking.set_score(user_id, score)
+            # Window rankings are cheap to rebuild; drop them.
+            self._windows = {}
+
+    def _all_time(self):
+        with self._lock:
+            interval = leaderboard_options()['REFRESH_INTERVAL']
+            if self._ranking is None or time.monotonic() - self._loaded_at >= interval:
+                # Read in index order, so the in-memory sort is a single pass.
+                rows = User.objects.filter(is_active=True).order_by(
+                    '-total_score', 'id').values_list('id', 'total_score')
+                self._ranking = Ranking(list(rows))
+                self._loaded_at = time.monotonic()
+            return self._ranking
+
+    def _window(self, window):
+        start = window_start(window)
+        with self._lock:
+            cached = self._windows.get(window)
+            ttl = leaderboard_options()['WINDOW_TTL']
+            if cached and cached[0] == start and time.monotonic() - cached[1] < ttl:
+                return cached[2]
+            points = Case(
+                *[When(title=title, then=Value(value))
+                  for title, value in SCORE_VALUES.items()],
+                default=Value(0),
+                output_field=IntegerField(),
+            )
+            rows = ScoreEvent.objects.filter(
+                event_date__gte=start, user__is_active=True
+            ).values('user').annotate(score=Sum(points)).values_list('user', 'score')
+            ranking = Ranking(list(rows))
+            self._windows[window] = (start, time.monotonic(), ranking)
+            return ranking
+
+
+def window_start(window, today=None):
+    today = today or timezone.localdate()
+    if window == 'daily':
+        return today
+    if window == 'weekly':
+        week_start = leaderboard_options()['WEEK_START']
+        return today - timedelta(days=(today.weekday() - week_start) % 7)
+    raise ValueError(f"Unknown leaderboard window: {window}")
+
+
+leaderboard = Leaderboard()
+
+
+@receiver(post_save, sender=ScoreEvent)
+def track_score_event(sender, instance, created, **kwargs):
+    if created:
+        points = SCORE_VALUES.get(instance.title, 0)
+        transaction.on_commit(
+            lambda: leaderboard.apply_deltas({instance.user_id: points}))
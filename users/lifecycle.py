@@ -0,0 +1,48 @@
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import OTP, BlacklistedAccessToken
+
+
+DEFAULT_BATCH_SIZE = 1000
+
+
+def delete_in_batches(queryset, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Delete the rows of `queryset` a batch at a time and return the count.
+    Short statements keep lock times and transaction sizes bounded.
+    """
+    model = queryset.model
+    deleted = 0
+    while True:
+        pks = list(queryset.values_list('pk', flat=True)[:batch_size])
+        if not pks:
+            return deleted
+        deleted += model.objects.filter(pk__in=pks).delete()[0]
+
+
+def expired_otps(now=None):
+    now = now or timezone.now()
+    return OTP.objects.filter(expires_at__lt=now)
+
+
+def expired_blacklist_entries(now=None):
+    now = now or timezone.now()
+    lifetime = settings.SIMPLE_JWT['ACCESS_TOKEN_LIFETIME']
+    return BlacklistedAccessToken.objects.filter(
+        Q(expires_at__lt=now) |
+        # Legacy rows without an expiry: the token was at most one lifetime
+        # old when it was revoked.
+        Q(expires_at__isnull=True, blacklisted_at__lt=now - lifetime)
+    )
+
+
+def prune_auth_tables(batch_size=DEFAULT_BATCH_SIZE):
+    """Remove expired OTPs and blacklist entries of expired access tokens."""
+    now = timezone.now()
+    return {
+        'otps': delete_in_batches(expired_otps(now), batch_size),
+        'blacklisted_tokens': delete_in_batches(
+            expired_blacklist_entries(now), batch_size),
+    }
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from users.lifecycle import DEFAULT_BATCH_SIZE, prune_auth_tables
+
+
+class Command(BaseCommand):
+    help = "Delete expired OTP codes and blacklist entries of expired access tokens."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+            help="Number of rows deleted per statement.")
+
+    def handle(self, *args, **options):
+        deleted = prune_auth_tables(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Deleted {deleted['otps']} OTPs and "
+            f"{deleted['blacklisted_tokens']} blacklisted tokens."))
@@ -0,0 +1,26 @@
+# Generated by Django 5.1.6 on 2026-10-18 14:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0005_remove_scoreevent_unique_daily_login_per_user_per_day_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='blacklistedaccesstoken',
+            name='expires_at',
+            field=models.DateTimeField(blank=True, db_index=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='otp',
+            index=models.Index(fields=['phone_number', 'code', 'created_at'], name='users_otp_lookup_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='otp',
+            index=models.Index(fields=['expires_at'], name='users_otp_expires_idx'),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.1.6 on 2026-10-18 14:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0006_auth_table_expiry'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='user',
+            name='total_score',
+            field=models.PositiveIntegerField(db_index=True, default=0),
+        ),
+        migrations.AddIndex(
+            model_name='scoreevent',
+            index=models.Index(fields=['event_date', 'user'], name='users_score_date_user_idx'),
+        ),
+    ]
@@ -0,0 +1,50 @@
+from django.db import migrations, models
+from django.utils.crypto import salted_hmac
+
+
+def hash_active_codes(apps, schema_editor):
+    OTP = apps.get_model('users', 'OTP')
+    # Keep only the newest code of each phone number.
+    newest = set(OTP.objects.values('phone_number').annotate(
+        newest=models.Max('pk')).values_list('newest', flat=True))
+    OTP.objects.exclude(pk__in=newest).delete()
+    for otp in OTP.objects.all():
+        # Same hash as users.otp_store.hash_code.
+        otp.code_hash = salted_hmac(
+            'users.otp', f'{otp.phone_number}:{otp.code}', algorithm='sha256').hexdigest()
+        otp.save(update_fields=['code_hash'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0007_leaderboard_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='otp',
+            name='code_hash',
+            field=models.CharField(default='', max_length=64),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='otp',
+            name='attempts',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.RunPython(hash_active_codes, migrations.RunPython.noop),
+        migrations.RemoveIndex(
+            model_name='otp',
+            name='users_otp_lookup_idx',
+        ),
+        migrations.RemoveField(
+            model_name='otp',
+            name='code',
+        ),
+        migrations.AlterField(
+            model_name='otp',
+            name='phone_number',
+            field=models.CharField(max_length=15, unique=True),
+        ),
+    ]
@@ -2,11 +2,10 @@ from django.db.models.signals import post_save
 from django.dispatch import receiver
 from django.contrib.auth.models import User
 from django.db import models
-from django.db.models import Q
+from django.db.models import F, Q
 from django.contrib.auth.models import AbstractBaseUser, BaseUserManager
 from django.utils.translation import gettext_lazy as _
 from django.utils import timezone
-import random
 
 
 SCORE_VALUES = {
@@ -63,7 +62,7 @@ class User(AbstractBaseUser):
         },
     )
     date_joined = models.DateTimeField(auto_now_add=True, null=True)
-    total_score = models.PositiveIntegerField(default=0)
+    total_score = models.PositiveIntegerField(default=0, db_index=True)
 
     # Track user status
     is_active = models.BooleanField(default=True)
@@ -91,29 +90,36 @@ class User(AbstractBaseUser):
 
 
 class OTP(models.Model):
-    phone_number = models.CharField(max_length=15)
-    code = models.CharField(max_length=6)
+    """
+    The active code of a phone number; issuing a new one replaces it.
+    Only a hash of the code is stored (see users/otp_store.py).
+    """
+    phone_number = models.CharField(max_length=15, unique=True)
+    code_hash = models.CharField(max_length=64)
+    # Wrong codes tried against this one; it is locked at the limit.
+    attempts = models.PositiveSmallIntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
     expires_at = models.DateTimeField()
 
     def __str__(self):
         return f"OTP for {self.phone_number}"
 
-    @classmethod
-    def generate_otp(cls, phone_number):
-        code = ''.join(random.choices('0123456789', k=6))
-        expires_at = timezone.now() + timezone.timedelta(minutes=2)
-        otp = cls.objects.create(
-            phone_number=phone_number, code=code, expires_at=expires_at)
-        return otp
-
     def is_valid(self):
         return timezone.now() <= self.expires_at
 
+    class Meta:
+        indexes = [
+            # Lets the pruner find expired codes without a table scan.
+            models.Index(fields=['expires_at'], name='users_otp_expires_idx'),
+        ]
+
 
 class BlacklistedAccessToken(models.Model):
     jti = models.CharField(max_length=255, unique=True)
     blacklisted_at = models.DateTimeField(auto_now_add=True)
+    # When the revoked token would have expired anyway; after that the row
+    # is useless and gets pruned. Null for rows created before it was stored.
+    expires_at = models.DateTimeField(null=True, blank=True, db_index=True)
 
     def __str__(self):
         return self.jti
@@ -134,6 +140,11 @@ class ScoreEvent(models.Model):
         max_length=15, null=True, blank=True)
 
     class Meta:
+        indexes = [
+            # Daily/weekly leaderboards aggregate events by date range.
+            models.Index(fields=['event_date', 'user'],
+                         name='users_score_date_user_idx'),
+        ]
         constraints = [
             models.UniqueConstraint(
                 fields=['user', 'event_date'],
@@ -158,5 +169,7 @@ def update_user_total_score(sender, instance, created, **kwargs):
     if created:
         # Update the user's total score based on the event typeّ
         score_value = SCORE_VALUES.get(instance.title, 0)
-        instance.user.total_score += score_value
-        instance.user.save()
+        # Increment in SQL so concurrent events can't overwrite each other,
+        # and touch only the total_score column.
+        User.objects.filter(pk=instance.user_id).update(
+            total_score=F('total_score') + score_value)
@@ -0,0 +1,145 @@
+"""
+Outbound queue for OTP text messages.
+
+Requests only enqueue a message; a daemon thread, started on the first
+enqueue in each process, sends them through the configured SMS backend
+(users/sms.py). Messages that arrive together go out as one batch. A
+failed message is retried with exponential backoff until MAX_ATTEMPTS,
+then dropped and logged.
+
+The queue lives in memory, so messages still waiting when the process
+exits are lost. The OTP row is already saved, and the user can ask for
+another code.
+"""
+import heapq
+import itertools
+import logging
+import random
+import threading
+import time
+
+from django.conf import settings
+
+from .sms import SMSMessage, get_backend
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    # Dotted path of the SMS backend class.
+    'BACKEND': 'users.sms.ConsoleSMSBackend',
+    # Send from a background thread. False sends during the request, which
+    # is what tests usually want.
+    'ASYNC': True,
+    # Most messages handed to the backend in one call.
+    'BATCH_SIZE': 50,
+    # Seconds the worker waits for more messages to join a batch.
+    'BATCH_WAIT': 0.05,
+    'MAX_ATTEMPTS': 5,
+    # Seconds before the first retry; doubles after every failure.
+    'RETRY_DELAY': 2,
+    'MAX_RETRY_DELAY': 60,
+}
+
+
+def delivery_options():
+    return {**DEFAULTS, **getattr(settings, 'OTP_DELIVERY', {})}
+
+
+class OTPDeliveryQueue:
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._worker = None
+        self.reset()
+
+    def reset(self):
+        with self._condition:
+            # Heap of (due time, sequence, message).
+            self._pending = []
+            self._sequence = itertools.count()
+
+    def __len__(self):
+        return len(self._pending)
+
+    def enqueue(self, to, body):
+        options = delivery_options()
+        with self._condition:
+            self._push(SMSMessage(to=to, body=body), time.monotonic())
+            self._condition.notify()
+        if options['ASYNC']:
+            self._ensure_worker()
+        else:
+            self.deliver_due()
+
+    def deliver_due(self):
+        """Send one batch of the messages that are due; returns how many went out."""
+        options = delivery_options()
+        now = time.monotonic()
+        with self._condition:
+            batch = []
+            while (self._pending and len(batch) < options['BATCH_SIZE']
+                   and self._pending[0][0] <= now):
+                batch.append(heapq.heappop(self._pending)[2])
+        if not batch:
+            return 0
+
+        try:
+            failed = get_backend(options['BACKEND']).send_messages(batch)
+        except Exception:
+            logger.exception("Sending %d OTP messages failed", len(batch))
+            failed = batch
+        for message in failed:
+            self._retry(message, options)
+        return len(batch) - len(failed)
+
+    def drain(self):
+        """Send everything that is due, batch after batch."""
+        while self._has_due():
+            self.deliver_due()
+
+    def _has_due(self):
+        with self._condition:
+            return bool(self._pending) and self._pending[0][0] <= time.monotonic()
+
+    def _push(self, message, due):
+        heapq.heappush(self._pending, (due, next(self._sequence), message))
+
+    def _retry(self, message, options):
+        message.attempts += 1
+        if message.attempts >= options['MAX_ATTEMPTS']:
+            logger.error("Giving up on the OTP message to %s after %d attempts",
+                         message.to, message.attempts)
+            return
+        delay = min(options['RETRY_DELAY'] * 2 ** (message.attempts - 1),
+                    options['MAX_RETRY_DELAY'])
+        # Jitter keeps a gateway outage from turning into synchronized bursts.
+        delay *= random.uniform(0.5, 1)
+        with self._condition:
+            self._push(message, time.monotonic() + delay)
+            self._condition.notify()
+
+    def _ensure_worker(self):
+        with self._condition:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(
+                    target=self._run, name='otp-delivery', daemon=True)
+                self._worker.start()
+
+    def _run(self):
+        while True:
+            with self._condition:
+                if not self._pending:
+                    self._condition.wait()
+                    continue
+                delay = self._pending[0][0] - time.monotonic()
+                if delay > 0:
+                    self._condition.wait(delay)
+                    continue
+            time.sleep(delivery_options()['BATCH_WAIT'])
+            try:
+                self.drain()
+            except Exception:
+                logger.exception("OTP delivery worker failed")
+
+
+delivery_queue = OTPDeliveryQueue()
@@ -0,0 +1,137 @@
+"""
+One active OTP per phone number.
+
+Issuing a code upserts the phone's OTP row. That replaces any earlier code
+and resets the attempt counter. Only an HMAC of the code is stored. The row
+is mirrored in the cache, so checking a code is normally one cache read.
+The table stays the source of truth and is read when the cache misses or
+disagrees, e.g. when another worker issued a newer code.
+
+Wrong codes are counted on the row. A code is only accepted by a DELETE
+that checks the hash, the attempt count and the expiry again. Concurrent
+guesses on several workers therefore can't get past MAX_ATTEMPTS, and a
+code can't be used twice.
+"""
+import hashlib
+import secrets
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import F
+from django.utils import timezone
+from django.utils.crypto import constant_time_compare, salted_hmac
+
+from .models import OTP
+
+
+DEFAULTS = {
+    # Alias of the cache mirroring active codes, or None to use the DB only.
+    'CACHE_ALIAS': 'default',
+    # Seconds a code stays valid.
+    'TTL': 2 * 60,
+    # Wrong codes allowed before the active code is locked.
+    'MAX_ATTEMPTS': 5,
+}
+
+VALID = 'valid'
+INVALID = 'invalid'
+EXPIRED = 'expired'
+LOCKED = 'locked'
+
+
+def otp_options():
+    return {**DEFAULTS, **getattr(settings, 'OTP_STORE', {})}
+
+
+def hash_code(phone_number, code):
+    return salted_hmac('users.otp', f'{phone_number}:{code}',
+                       algorithm='sha256').hexdigest()
+
+
+def issue(phone_number):
+    """Replace the phone's active code with a new one and return the code."""
+    options = otp_options()
+    code = ''.join(secrets.choice('0123456789') for _ in range(6))
+    otp = OTP(phone_number=phone_number, code_hash=hash_code(phone_number, code),
+              attempts=0, expires_at=timezone.now() + timedelta(seconds=options['TTL']))
+    OTP.objects.bulk_create(
+        [otp],
+        update_conflicts=True,
+        unique_fields=['phone_number'],
+        update_fields=['code_hash', 'attempts', 'created_at', 'expires_at'],
+    )
+    _store(phone_number, _entry(otp))
+    return code
+
+
+def verify(phone_number, code):
+    """
+    Check `code` against the phone's active code; a valid code is consumed.
+    Returns VALID, INVALID, EXPIRED or LOCKED.
+    """
+    max_attempts = otp_options()['MAX_ATTEMPTS']
+    code_hash = hash_code(phone_number, code)
+    entry = _cached(phone_number)
+    if entry is None or not constant_time_compare(entry['code_hash'], code_hash):
+        entry = _load(phone_number)
+    if entry is None:
+        return INVALID
+    if entry['attempts'] >= max_attempts:
+        return LOCKED
+    now = timezone.now()
+    if entry['expires_at'] < now:
+        return EXPIRED
+
+    if constant_time_compare(entry['code_hash'], code_hash):
+        consumed = OTP.objects.filter(
+            phone_number=phone_number, code_hash=code_hash,
+            attempts__lt=max_attempts, expires_at__gte=now,
+        ).delete()[0]
+        _forget(phone_number)
+        return VALID if consumed else INVALID
+
+    OTP.objects.filter(phone_number=phone_number, code_hash=entry['code_hash']).update(
+        attempts=F('attempts') + 1)
+    # Only a shortcut for later lookups; the row's count is what's enforced.
+    _store(phone_number, {**entry, 'attempts': entry['attempts'] + 1})
+    return INVALID
+
+
+def _cache():
+    alias = otp_options()['CACHE_ALIAS']
+    return caches[alias] if alias else None
+
+
+def _key(phone_number):
+    # Hashed so raw phone numbers stay out of the cache.
+    return f'otp:{hashlib.sha256(phone_number.encode()).hexdigest()}'
+
+
+def _entry(otp):
+    return {'code_hash': otp.code_hash, 'attempts': otp.attempts,
+            'expires_at': otp.expires_at}
+
+
+def _cached(phone_number):
+    cache = _cache()
+    return cache.get(_key(phone_number)) if cache else None
+
+
+def _load(phone_number):
+    otp = OTP.objects.filter(phone_number=phone_number).only(
+        'code_hash', 'attempts', 'expires_at').first()
+    return _entry(otp) if otp else None
+
+
+def _store(phone_number, entry):
+    cache = _cache()
+    timeout = (entry['expires_at'] - timezone.now()).total_seconds()
+    if cache and timeout > 0:
+        cache.set(_key(phone_number), entry, timeout=timeout)
+
+
+def _forget(phone_number):
+    cache = _cache()
+    if cache:
+        cache.delete(_key(phone_number))
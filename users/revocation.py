@@ -0,0 +1,125 @@
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import BlacklistedAccessToken
+
+
+DEFAULTS = {
+    # Alias of the Django cache shared by all workers, or None to disable it.
+    'CACHE_ALIAS': 'default',
+    # Seconds between incremental syncs from the blacklist table.
+    'REFRESH_INTERVAL': 10,
+}
+
+VERSION_KEY = 'jwt-revocation:version'
+JTI_KEY_PREFIX = 'jwt-revocation:jti:'
+# Re-read rows slightly older than the last one seen, in case a transaction
+# committed a row with an earlier `blacklisted_at` after we synced.
+SYNC_OVERLAP = timedelta(seconds=60)
+
+
+class RevocationCache:
+    """
+    Answers "has this access token been revoked?" without a DB round trip.
+
+    Revoked JTIs are mirrored into an in-process map (JTI -> token expiry)
+    that is refreshed incrementally from `BlacklistedAccessToken.blacklisted_at`
+    and forgets tokens once they have expired anyway. When a shared cache
+    backend is configured, revocations are also published there (a per-JTI
+    key plus a version counter), so other workers notice a logout on their
+    next request instead of at their next periodic sync.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._revoked = {}
+            self._watermark = None
+            self._synced_at = None
+            self._shared_version = None
+
+    @property
+    def options(self):
+        return {**DEFAULTS, **getattr(settings, 'JWT_REVOCATION', {})}
+
+    @property
+    def shared_cache(self):
+        alias = self.options['CACHE_ALIAS']
+        return caches[alias] if alias else None
+
+    def is_revoked(self, jti):
+        if jti in self._revoked:
+            return True
+
+        shared_version = None
+        shared = self.shared_cache
+        if shared is not None:
+            found = shared.get_many([VERSION_KEY, JTI_KEY_PREFIX + jti])
+            if found.get(JTI_KEY_PREFIX + jti):
+                self._revoked.setdefault(jti, None)
+                return True
+            shared_version = found.get(VERSION_KEY)
+
+        if self._is_stale(shared_version):
+            self.sync(shared_version)
+        return jti in self._revoked
+
+    def revoke(self, jti, expires_at=None):
+        """Blacklist the JTI and make every worker see it right away."""
+        BlacklistedAccessToken.objects.get_or_create(
+            jti=jti, defaults={'expires_at': expires_at})
+        self._revoked[jti] = expires_at
+        shared = self.shared_cache
+        if shared is not None:
+            if expires_at is not None:
+                timeout = (expires_at - timezone.now()).total_seconds()
+            else:
+                timeout = settings.SIMPLE_JWT['ACCESS_TOKEN_LIFETIME'].total_seconds()
+            shared.set(JTI_KEY_PREFIX + jti, True, timeout=max(int(timeout), 1))
+            try:
+                shared.incr(VERSION_KEY)
+            except ValueError:
+                shared.add(VERSION_KEY, 1, timeout=None)
+
+    def sync(self, shared_version=None):
+        """Pull blacklist rows added since the last sync."""
+        with self._lock:
+            now = timezone.now()
+            rows = BlacklistedAccessToken.objects.filter(
+                Q(expires_at__isnull=True) | Q(expires_at__gt=now))
+            if self._watermark is not None:
+                rows = rows.filter(
+                    blacklisted_at__gte=self._watermark - SYNC_OVERLAP)
+            for jti, blacklisted_at, expires_at in rows.values_list(
+                    'jti', 'blacklisted_at', 'expires_at'):
+                self._revoked[jti] = expires_at
+                if self._watermark is None or blacklisted_at > self._watermark:
+                    self._watermark = blacklisted_at
+            # Expired tokens fail signature validation before reaching us.
+            self._revoked = {
+                jti: expires_at for jti, expires_at in self._revoked.items()
+                if expires_at is None or expires_at > now
+            }
+            self._synced_at = time.monotonic()
+            if shared_version is not None:
+                self._shared_version = shared_version
+
+    def _is_stale(self, shared_version):
+        if self._synced_at is None:
+            return True
+        if shared_version is not None and shared_version != self._shared_version:
+            return True
+        interval = self.options['REFRESH_INTERVAL']
+        return time.monotonic() - self._synced_at >= interval
+
+
+revocation_cache = RevocationCache()
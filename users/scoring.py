@@ -0,0 +1,117 @@
+from collections import Counter
+
+from django.db import IntegrityError, transaction
+from django.db.models import Case, F, PositiveIntegerField, Q, Value, When
+
+from .leaderboard import leaderboard
+from .models import SCORE_VALUES, ScoreEvent, User
+
+
+# Times a batch is retried after losing a race to a concurrent insert.
+RECORD_ATTEMPTS = 3
+
+
+def _conflict_key(event):
+    """
+    Mirror ScoreEvent's conditional unique constraints: two events with the
+    same key can't both exist. None means the event never conflicts.
+    """
+    if event.title == 'daily_login':
+        return (event.user_id, event.title, event.event_date)
+    if event.title == 'order' and event.order_id is not None:
+        return (event.user_id, event.title, event.order_id)
+    if event.title == 'referral' and event.referral_phone_number is not None:
+        return (event.user_id, event.title, event.referral_phone_number)
+    return None
+
+
+def _existing_keys(events):
+    user_ids = {event.user_id for event in events}
+    dates = {e.event_date for e in events if e.title == 'daily_login'}
+    order_ids = {e.order_id for e in events if e.title == 'order'}
+    phones = {e.referral_phone_number for e in events if e.title == 'referral'}
+    rows = ScoreEvent.objects.filter(user_id__in=user_ids).filter(
+        Q(title='daily_login', event_date__in=dates) |
+        Q(title='order', order_id__in=order_ids) |
+        Q(title='referral', referral_phone_number__in=phones)
+    )
+    return {
+        _conflict_key(event)
+        for event in rows.only('user_id', 'title', 'event_date', 'order_id',
+                               'referral_phone_number')
+    }
+
+
+def apply_score_deltas(deltas):
+    """
+    Add `{user_id: points}` to the users' total_score in a single UPDATE.
+    """
+    deltas = {user_id: points for user_id, points in deltas.items() if points}
+    if not deltas:
+        return
+    increment = Case(
+        *[When(pk=user_id, then=Value(points)) for user_id, points in deltas.items()],
+        default=Value(0),
+        output_field=PositiveIntegerField(),
+    )
+    User.objects.filter(pk__in=deltas).update(
+        total_score=F('total_score') + increment)
+    transaction.on_commit(lambda: leaderboard.apply_deltas(deltas))
+
+
+def record_score_events(events):
+    """
+    Record many unsaved ScoreEvents in one transaction and return the ones
+    that were actually inserted.
+
+    Events that collide with an existing row, or with an earlier event in
+    the same batch, are skipped instead of raising IntegrityError. The
+    per-user score totals are then applied in one grouped UPDATE; the
+    post_save receiver does not run for bulk inserts.
+    """
+    events = list(events)
+    if not events:
+        return []
+    event_date = ScoreEvent._meta.get_field('event_date')
+    for event in events:
+        # The field default is a datetime; compare dates like the DB does.
+        event.event_date = event_date.to_python(event.event_date)
+
+    for attempt in range(RECORD_ATTEMPTS):
+        try:
+            return _record_batch(events)
+        except IntegrityError:
+            # A single-event save (which doesn't take the user locks) got in
+            # between the duplicate check and the insert. The batch was
+            # rolled back, scores included; check again from scratch.
+            if attempt == RECORD_ATTEMPTS - 1:
+                raise
+
+
+def _record_batch(events):
+    with transaction.atomic():
+        # Lock the users in a fixed order so concurrent batches for the same
+        # users are serialized and the duplicate check below stays accurate.
+        user_ids = sorted({event.user_id for event in events})
+        list(User.objects.select_for_update().filter(
+            pk__in=user_ids).order_by('pk').values_list('pk', flat=True))
+
+        seen = _existing_keys(events)
+        fresh = []
+        for event in events:
+            key = _conflict_key(event)
+            if key is not None:
+                if key in seen:
+                    continue
+                seen.add(key)
+            fresh.append(event)
+
+        # No ignore_conflicts: a row dropped silently would still be
+        # credited below.
+        ScoreEvent.objects.bulk_create(fresh)
+
+        deltas = Counter()
+        for event in fresh:
+            deltas[event.user_id] += SCORE_VALUES.get(event.title, 0)
+        apply_score_deltas(deltas)
+    return fresh
@@ -1,9 +1,29 @@
 from rest_framework import serializers
 from .models import User, OTP
+from .leaderboard import WINDOWS
 
 class SendOTPSerializer(serializers.Serializer):
     phone_number = serializers.CharField(max_length=15)
         
 class VerifyOTPSerializer(serializers.Serializer):
     phone_number = serializers.CharField(max_length=15)
-    code = serializers.CharField(max_length=6)
\ No newline at end of file
+    code = serializers.CharField(max_length=6)
+
+class LeaderboardQuerySerializer(serializers.Serializer):
+    window = serializers.ChoiceField(choices=WINDOWS, default='all')
+    limit = serializers.IntegerField(min_value=1, max_value=100, default=10)
+    radius = serializers.IntegerField(min_value=0, max_value=25, default=2)
+
+
+class LeaderboardEntrySerializer(serializers.Serializer):
+    rank = serializers.IntegerField()
+    user_id = serializers.IntegerField()
+    phone_number = serializers.SerializerMethodField()
+    score = serializers.IntegerField()
+
+    def get_phone_number(self, entry):
+        # Only show enough of the number for users to recognise themselves.
+        phone_number = self.context['phone_numbers'].get(entry['user_id'], '')
+        if len(phone_number) <= 7:
+            return phone_number
+        return f"{phone_number[:4]}***{phone_number[-3:]}"
@@ -0,0 +1,53 @@
+"""
+Pluggable SMS backends, in the spirit of django.core.mail's.
+
+`OTP_DELIVERY['BACKEND']` names the class used by the delivery queue (see
+users/otp_delivery.py). A backend sends a batch of messages in one call and
+returns the messages it could not deliver, so the queue can retry just
+those; raising an exception fails the whole batch.
+"""
+import threading
+from dataclasses import dataclass
+
+from django.utils.module_loading import import_string
+
+
+@dataclass
+class SMSMessage:
+    to: str
+    body: str
+    # Delivery attempts made so far, kept by the queue.
+    attempts: int = 0
+
+
+class BaseSMSBackend:
+    def send_messages(self, messages):
+        """Send `messages` and return the ones that failed."""
+        raise NotImplementedError
+
+
+class ConsoleSMSBackend(BaseSMSBackend):
+    """Prints messages instead of sending them; for local development."""
+
+    def send_messages(self, messages):
+        for message in messages:
+            print(f"SMS to {message.to}: {message.body}")
+        return []
+
+
+# Messages "sent" by LocmemSMSBackend, for tests to inspect.
+outbox = []
+_outbox_lock = threading.Lock()
+
+
+class LocmemSMSBackend(BaseSMSBackend):
+    """Appends messages to `users.sms.outbox`; for tests."""
+
+    def send_messages(self, messages):
+        with _outbox_lock:
+            outbox.extend(messages)
+        return []
+
+
+def get_backend(path):
+    return import_string(path)()
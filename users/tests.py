@@ -1,8 +1,24 @@
+import time
+from unittest import mock
 from django.test import TestCase
 from django.db import IntegrityError, transaction
 from django.utils import timezone
 from django.contrib.auth import get_user_model
-from .models import ScoreEvent  # Adjust the import path if needed
+from django.core.cache import cache
+from django.test import override_settings
+from django.urls import reverse
+from rest_framework.test import APIRequestFactory, APITestCase
+from rest_framework_simplejwt.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.tokens import RefreshToken
+from .authentication import CustomJWTAuthentication
+from . import otp_store, scoring, sms
+from .leaderboard import Ranking, leaderboard
+from .lifecycle import prune_auth_tables
+from .models import OTP, BlacklistedAccessToken, ScoreEvent  # Adjust the import path if needed
+from .otp_delivery import OTPDeliveryQueue, delivery_queue
+from .revocation import revocation_cache
+from .scoring import record_score_events
+from .throttling import take_token
 
 User = get_user_model()
 
@@ -21,8 +37,7 @@ class ScoreEventUniqueConstraintTests(TestCase):
         # Create a daily login event for today.
         event1 = ScoreEvent.objects.create(
             user=self.user,
-            score_title="daily_login",
-            value=daily_value,
+            title="daily_login",
             # You can rely on auto_now_add but here we set it explicitly.
             event_date=self.today
         )
@@ -33,19 +48,19 @@ class ScoreEventUniqueConstraintTests(TestCase):
             with transaction.atomic():
                 ScoreEvent.objects.create(
                     user=self.user,
-                    score_title="daily_login",
-                    value=daily_value,
+                    title="daily_login",
                     event_date=self.today  # Same date as event1.
                 )
 
         # Creating a daily login for a different day should succeed.
         event2 = ScoreEvent.objects.create(
             user=self.user,
-            score_title="daily_login",
-            value=daily_value,
+            title="daily_login",
             event_date=self.yesterday
         )
         self.assertIsNotNone(event2)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.total_score, 2 * daily_value)
 
     def test_unique_order_constraint(self):
         order_value = 30
@@ -53,8 +68,7 @@ class ScoreEventUniqueConstraintTests(TestCase):
         # Create an order event.
         order_event1 = ScoreEvent.objects.create(
             user=self.user,
-            score_title="order",
-            value=order_value,
+            title="order",
             order_id=order_id
         )
         self.assertIsNotNone(order_event1)
@@ -64,19 +78,19 @@ class ScoreEventUniqueConstraintTests(TestCase):
             with transaction.atomic():
                 ScoreEvent.objects.create(
                     user=self.user,
-                    score_title="order",
-                    value=order_value,
+                    title="order",
                     order_id=order_id
                 )
 
         # An order event with a different order_id should succeed.
         order_event2 = ScoreEvent.objects.create(
             user=self.user,
-            score_title="order",
-            value=order_value,
+            title="order",
             order_id="order456"
         )
         self.assertIsNotNone(order_event2)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.total_score, 2 * order_value)
 
     def test_unique_referral_constraint(self):
         referral_value = 20
@@ -84,8 +98,7 @@ class ScoreEventUniqueConstraintTests(TestCase):
         # Create a referral event.
         referral_event1 = ScoreEvent.objects.create(
             user=self.user,
-            score_title="referral",
-            value=referral_value,
+            title="referral",
             referral_phone_number=referral_phone
         )
         self.assertIsNotNone(referral_event1)
@@ -95,16 +108,388 @@ class ScoreEventUniqueConstraintTests(TestCase):
             with transaction.atomic():
                 ScoreEvent.objects.create(
                     user=self.user,
-                    score_title="referral",
-                    value=referral_value,
+                    title="referral",
                     referral_phone_number=referral_phone
                 )
 
         # Creating a referral event with a different referral phone number should work.
         referral_event2 = ScoreEvent.objects.create(
             user=self.user,
-            score_title="referral",
-            value=referral_value,
+            title="referral",
             referral_phone_number="5559876543"
         )
         self.assertIsNotNone(referral_event2)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.total_score, 2 * referral_value)
+
+
+class RevocationCacheTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        revocation_cache.reset()
+        self.user = User.objects.create_user(
+            phone_number="09120000000", password="password")
+        self.access = str(RefreshToken.for_user(self.user).access_token)
+        self.factory = APIRequestFactory()
+
+    def _authenticate(self):
+        request = self.factory.get(
+            '/', HTTP_AUTHORIZATION=f'Bearer {self.access}')
+        return CustomJWTAuthentication().authenticate(request)
+
+    def test_valid_token_needs_no_blacklist_query(self):
+        self._authenticate()  # Warm up the cache.
+        # The only remaining query is loading the user itself.
+        with self.assertNumQueries(1):
+            user, _ = self._authenticate()
+        self.assertEqual(user, self.user)
+
+    def test_logout_revokes_token_immediately(self):
+        self._authenticate()
+        response = self.client.post(
+            reverse('logout'), HTTP_AUTHORIZATION=f'Bearer {self.access}')
+        self.assertEqual(response.status_code, 200)
+        with self.assertRaises(AuthenticationFailed):
+            self._authenticate()
+
+    def test_other_worker_sees_shared_revocation(self):
+        self._authenticate()
+        jti = RefreshToken.for_user(self.user).access_token['jti']
+        # Simulate a logout handled by another process sharing the cache.
+        revocation_cache.revoke(jti)
+        revocation_cache._revoked.pop(jti)
+        self.assertTrue(revocation_cache.is_revoked(jti))
+
+    @override_settings(JWT_REVOCATION={'CACHE_ALIAS': None, 'REFRESH_INTERVAL': 0})
+    def test_rows_added_directly_are_picked_up_on_sync(self):
+        self._authenticate()
+        token = RefreshToken.for_user(self.user).access_token
+        BlacklistedAccessToken.objects.create(jti=token['jti'])
+        self.assertTrue(revocation_cache.is_revoked(token['jti']))
+
+
+class PruneAuthTablesTests(TestCase):
+    def test_prunes_only_expired_rows(self):
+        now = timezone.now()
+        OTP.objects.create(phone_number="0911", code_hash="a",
+                           expires_at=now - timezone.timedelta(minutes=1))
+        live_otp = OTP.objects.create(phone_number="0912", code_hash="b",
+                                      expires_at=now + timezone.timedelta(minutes=1))
+        BlacklistedAccessToken.objects.create(
+            jti="expired", expires_at=now - timezone.timedelta(seconds=1))
+        BlacklistedAccessToken.objects.create(
+            jti="live", expires_at=now + timezone.timedelta(hours=1))
+        legacy = BlacklistedAccessToken.objects.create(jti="legacy")
+        BlacklistedAccessToken.objects.filter(pk=legacy.pk).update(
+            blacklisted_at=now - timezone.timedelta(days=2))
+
+        deleted = prune_auth_tables(batch_size=1)
+
+        self.assertEqual(deleted, {'otps': 1, 'blacklisted_tokens': 2})
+        self.assertEqual(list(OTP.objects.all()), [live_otp])
+        self.assertEqual(
+            list(BlacklistedAccessToken.objects.values_list('jti', flat=True)),
+            ["live"])
+
+    def test_logout_stores_token_expiry(self):
+        user = User.objects.create_user(phone_number="09121111111")
+        access = RefreshToken.for_user(user).access_token
+        self.client.post(reverse('logout'),
+                         HTTP_AUTHORIZATION=f'Bearer {access}')
+        entry = BlacklistedAccessToken.objects.get(jti=access['jti'])
+        self.assertEqual(int(entry.expires_at.timestamp()), access['exp'])
+
+
+class RecordScoreEventsTests(TestCase):
+    def setUp(self):
+        self.alice = User.objects.create_user(phone_number="09122222222")
+        self.bob = User.objects.create_user(phone_number="09123333333")
+        self.today = timezone.now().date()
+
+    def test_score_update_touches_only_total_score(self):
+        stale = User.objects.get(pk=self.alice.pk)
+        ScoreEvent.objects.create(user=self.alice, title="daily_login")
+        # A stale in-memory copy saving later must not be clobbered, and the
+        # receiver must not have saved the other columns either.
+        ScoreEvent.objects.create(user=stale, title="order", order_id="o-1")
+        self.alice.refresh_from_db()
+        self.assertEqual(self.alice.total_score, 40)
+
+    def test_bulk_record_skips_duplicates_and_groups_deltas(self):
+        ScoreEvent.objects.create(user=self.alice, title="order", order_id="o-1")
+        events = [
+            ScoreEvent(user=self.alice, title="order", order_id="o-1"),  # exists
+            ScoreEvent(user=self.alice, title="order", order_id="o-2"),
+            ScoreEvent(user=self.alice, title="daily_login"),
+            ScoreEvent(user=self.alice, title="daily_login"),  # same day twice
+            ScoreEvent(user=self.bob, title="referral",
+                       referral_phone_number="0935"),
+        ]
+        with self.assertNumQueries(6):
+            inserted = record_score_events(events)
+        self.assertEqual(len(inserted), 3)
+        self.alice.refresh_from_db()
+        self.bob.refresh_from_db()
+        self.assertEqual(self.alice.total_score, 30 + 30 + 10)
+        self.assertEqual(self.bob.total_score, 20)
+        self.assertEqual(ScoreEvent.objects.count(), 4)
+
+    def test_event_inserted_during_the_batch_is_not_credited_twice(self):
+        ScoreEvent.objects.create(user=self.alice, title="daily_login")
+        real_existing_keys = scoring._existing_keys
+        checks = []
+
+        def stale_then_real(events):
+            # The first check ran just before the post_save path above
+            # recorded today's login.
+            checks.append(events)
+            return set() if len(checks) == 1 else real_existing_keys(events)
+
+        with mock.patch.object(scoring, '_existing_keys', stale_then_real):
+            inserted = record_score_events([
+                ScoreEvent(user=self.alice, title="daily_login"),
+                ScoreEvent(user=self.alice, title="order", order_id="o-1"),
+            ])
+        self.assertEqual(len(checks), 2)
+        self.assertEqual([event.title for event in inserted], ["order"])
+        self.alice.refresh_from_db()
+        self.assertEqual(self.alice.total_score, 10 + 30)
+        self.assertEqual(ScoreEvent.objects.filter(title="daily_login").count(), 1)
+
+
+class RankingTests(TestCase):
+    def test_ranks_ties_and_neighbours(self):
+        ranking = Ranking([(1, 50), (2, 80), (3, 50), (4, 10)])
+        self.assertEqual([e['user_id'] for e in ranking.top(2)], [2, 1])
+        self.assertEqual([ranking.rank(uid) for uid in (2, 1, 3, 4)], [1, 2, 2, 4])
+        self.assertEqual([e['user_id'] for e in ranking.around(3, 1)], [1, 3, 4])
+        ranking.set_score(4, 90)
+        self.assertEqual(ranking.rank(4), 1)
+        self.assertEqual(ranking.rank(2), 2)
+
+
+class LeaderboardApiTests(APITestCase):
+    def setUp(self):
+        leaderboard.reset()
+        self.users = [
+            User.objects.create_user(phone_number=f"0912000000{index}")
+            for index in range(4)
+        ]
+
+    def test_incremental_updates_and_rank_endpoint(self):
+        leaderboard.ranking()  # Load before the events arrive.
+        with self.captureOnCommitCallbacks(execute=True):
+            ScoreEvent.objects.create(user=self.users[2], title="order", order_id="1")
+        with self.captureOnCommitCallbacks(execute=True):
+            record_score_events([
+                ScoreEvent(user=self.users[1], title="referral",
+                           referral_phone_number="0935"),
+                ScoreEvent(user=self.users[3], title="daily_login"),
+            ])
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('leaderboard') + '?limit=3')
+        self.assertEqual(
+            [(e['user_id'], e['score']) for e in response.data['results']],
+            [(self.users[2].pk, 30), (self.users[1].pk, 20), (self.users[3].pk, 10)])
+        self.assertEqual(response.data['results'][0]['phone_number'], "0912***002")
+
+        self.client.force_authenticate(self.users[1])
+        response = self.client.get(reverse('leaderboard-me') + '?radius=1')
+        self.assertEqual(response.data['rank'], 2)
+        self.assertEqual(
+            [e['user_id'] for e in response.data['neighbours']],
+            [self.users[2].pk, self.users[1].pk, self.users[3].pk])
+
+    def test_daily_window_only_counts_todays_events(self):
+        today = timezone.localdate()
+        ScoreEvent.objects.create(user=self.users[0], title="daily_login",
+                                  event_date=today - timezone.timedelta(days=1))
+        ScoreEvent.objects.create(user=self.users[1], title="daily_login",
+                                  event_date=today)
+        response = self.client.get(reverse('leaderboard') + '?window=daily')
+        self.assertEqual(
+            [e['user_id'] for e in response.data['results']], [self.users[1].pk])
+        response = self.client.get(reverse('leaderboard') + '?window=monthly')
+        self.assertEqual(response.status_code, 400)
+
+
+class FlakySMSBackend(sms.BaseSMSBackend):
+    """Fails every message `failures` times before delivering it."""
+    failures = 0
+    calls = []
+
+    def send_messages(self, messages):
+        FlakySMSBackend.calls.append([message.to for message in messages])
+        failed = [message for message in messages
+                  if message.attempts < FlakySMSBackend.failures]
+        sms.outbox.extend(message for message in messages if message not in failed)
+        return failed
+
+
+LOCMEM_DELIVERY = {
+    'BACKEND': 'users.sms.LocmemSMSBackend',
+    'ASYNC': False,
+    'RETRY_DELAY': 0,
+}
+FLAKY_DELIVERY = {**LOCMEM_DELIVERY, 'BACKEND': 'users.tests.FlakySMSBackend'}
+
+
+@override_settings(OTP_DELIVERY=LOCMEM_DELIVERY)
+class OTPDeliveryTests(TestCase):
+    def setUp(self):
+        sms.outbox.clear()
+        FlakySMSBackend.calls = []
+        FlakySMSBackend.failures = 0
+        self.queue = OTPDeliveryQueue()
+
+    def test_send_otp_enqueues_the_code(self):
+        cache.clear()
+        delivery_queue.reset()
+        response = self.client.post(reverse('send-otp'), {'phone_number': '09123333333'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([message.to for message in sms.outbox], ['09123333333'])
+        code = sms.outbox[0].body[-6:]
+        self.assertEqual(otp_store.verify('09123333333', code), otp_store.VALID)
+
+    @override_settings(OTP_DELIVERY={**FLAKY_DELIVERY, 'BATCH_SIZE': 2})
+    def test_messages_are_sent_in_batches(self):
+        # Queue up without a worker running, then deliver.
+        self.queue._ensure_worker = lambda: None
+        with override_settings(OTP_DELIVERY={**FLAKY_DELIVERY, 'ASYNC': True}):
+            for phone_number in ['0911', '0912', '0913']:
+                self.queue.enqueue(phone_number, 'code')
+        self.queue.drain()
+        self.assertEqual(FlakySMSBackend.calls, [['0911', '0912'], ['0913']])
+        self.assertEqual(len(self.queue), 0)
+
+    @override_settings(OTP_DELIVERY=FLAKY_DELIVERY)
+    def test_failed_messages_are_retried(self):
+        FlakySMSBackend.failures = 2
+        self.queue.enqueue('0911', 'code')
+        self.queue.drain()
+        self.assertEqual(len(FlakySMSBackend.calls), 3)
+        self.assertEqual([message.to for message in sms.outbox], ['0911'])
+
+    @override_settings(OTP_DELIVERY={**FLAKY_DELIVERY, 'MAX_ATTEMPTS': 3})
+    def test_gives_up_after_max_attempts(self):
+        FlakySMSBackend.failures = 10
+        with self.assertLogs('users.otp_delivery', 'ERROR'):
+            self.queue.enqueue('0911', 'code')
+            self.queue.drain()
+        self.assertEqual(len(FlakySMSBackend.calls), 3)
+        self.assertEqual(sms.outbox, [])
+        self.assertEqual(len(self.queue), 0)
+
+    @override_settings(OTP_DELIVERY={**LOCMEM_DELIVERY, 'ASYNC': True, 'BATCH_WAIT': 0})
+    def test_worker_delivers_in_background(self):
+        self.queue.enqueue('0911', 'code')
+        for _ in range(100):
+            if sms.outbox:
+                break
+            time.sleep(0.01)
+        self.assertEqual([message.to for message in sms.outbox], ['0911'])
+
+
+@override_settings(OTP_DELIVERY=LOCMEM_DELIVERY)
+class OTPThrottleTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        delivery_queue.reset()
+        sms.outbox.clear()
+
+    def _send(self, phone_number, ip='10.0.0.1'):
+        return self.client.post(reverse('send-otp'), {'phone_number': phone_number},
+                                REMOTE_ADDR=ip)
+
+    def test_bucket_refills_over_time(self):
+        for _ in range(2):
+            self.assertEqual(take_token(cache, 'bucket', 2, 60, now=0), 0)
+        self.assertEqual(take_token(cache, 'bucket', 2, 60, now=0), 30)
+        self.assertEqual(take_token(cache, 'bucket', 2, 60, now=30), 0)
+
+    @override_settings(OTP_THROTTLES={'PHONE_RATE': '2/hour', 'IP_RATE': None})
+    def test_phone_number_is_throttled_without_writing_rows(self):
+        for ip in ['10.0.0.1', '10.0.0.2']:
+            self.assertEqual(self._send('09124444444', ip).status_code, 200)
+        response = self._send('09124444444', '10.0.0.3')
+        self.assertEqual(response.status_code, 429)
+        self.assertIn('Retry-After', response)
+        self.assertEqual(OTP.objects.filter(phone_number='09124444444').count(), 1)
+        self.assertEqual(len(sms.outbox), 2)
+        # Other numbers are unaffected.
+        self.assertEqual(self._send('09125555555').status_code, 200)
+
+    @override_settings(OTP_THROTTLES={'PHONE_RATE': None, 'IP_RATE': '3/hour'})
+    def test_ip_address_is_throttled_across_numbers(self):
+        for i in range(3):
+            self.assertEqual(self._send(f'0912666666{i}').status_code, 200)
+        self.assertEqual(self._send('09126666669').status_code, 429)
+        self.assertEqual(self._send('09126666669', '10.0.0.9').status_code, 200)
+
+    @override_settings(OTP_THROTTLES={'PHONE_RATE': None, 'IP_RATE': '2/hour'})
+    def test_spoofed_forwarded_for_is_ignored(self):
+        statuses = [
+            self.client.post(reverse('send-otp'), {'phone_number': f'0912666666{i}'},
+                             REMOTE_ADDR='10.0.0.1', HTTP_X_FORWARDED_FOR=f'203.0.113.{i}').status_code
+            for i in range(3)
+        ]
+        self.assertEqual(statuses, [200, 200, 429])
+
+
+class OTPStoreTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+
+    def _verify(self, code, phone_number='09127777777'):
+        return self.client.post(reverse('verify-otp'),
+                                {'phone_number': phone_number, 'code': code})
+
+    def test_code_is_stored_hashed_and_used_once(self):
+        code = otp_store.issue('09127777777')
+        otp = OTP.objects.get()
+        self.assertNotIn(code, otp.code_hash)
+        self.assertEqual(self._verify(code).status_code, 200)
+        self.assertFalse(OTP.objects.exists())
+        self.assertEqual(self._verify(code).status_code, 400)
+
+    def test_new_code_replaces_the_old_one(self):
+        old = otp_store.issue('09127777777')
+        new = otp_store.issue('09127777777')
+        self.assertEqual(OTP.objects.count(), 1)
+        if old != new:
+            self.assertEqual(otp_store.verify('09127777777', old), otp_store.INVALID)
+        self.assertEqual(otp_store.verify('09127777777', new), otp_store.VALID)
+
+    def test_right_code_is_looked_up_in_the_cache(self):
+        code = otp_store.issue('09127777777')
+        wrong = '000000' if code != '000000' else '111111'
+        # A wrong code is checked against the table before it is counted.
+        with self.assertNumQueries(2):
+            otp_store.verify('09127777777', wrong)
+        # The right one only needs the DELETE that consumes it.
+        with self.assertNumQueries(1):
+            self.assertEqual(otp_store.verify('09127777777', code), otp_store.VALID)
+
+    def test_falls_back_to_the_database(self):
+        code = otp_store.issue('09127777777')
+        cache.clear()
+        self.assertEqual(otp_store.verify('09127777777', code), otp_store.VALID)
+
+    @override_settings(OTP_STORE={'MAX_ATTEMPTS': 3})
+    def test_code_is_locked_after_too_many_attempts(self):
+        code = otp_store.issue('09127777777')
+        wrong = '000000' if code != '000000' else '111111'
+        for _ in range(3):
+            self.assertEqual(self._verify(wrong).data['message'], "Invalid OTP.")
+        # The count lives in the table, not just in the cache.
+        cache.clear()
+        self.assertEqual(OTP.objects.get().attempts, 3)
+        response = self._verify(code)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.data['message'], "Too many attempts. Request a new code.")
+
+    def test_expired_code_is_rejected(self):
+        code = otp_store.issue('09127777777')
+        OTP.objects.update(expires_at=timezone.now() - timezone.timedelta(seconds=1))
+        cache.clear()
+        self.assertEqual(self._verify(code).data['message'], "OTP has expired.")
@@ -0,0 +1,104 @@
+"""
+Token-bucket throttles for sending OTPs, kept in the Django cache.
+
+Each bucket holds up to N tokens and refills at N per period, so a rate of
+'5/hour' allows a burst of five codes, then one every twelve minutes. The
+bucket is stored as `(tokens, updated at)` under one cache key. A key that
+has expired means a full bucket, so idle phones and addresses cost nothing.
+Read and write are not atomic: concurrent requests may both take the last
+token, which is close enough for abuse control.
+"""
+import hashlib
+import math
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.settings import api_settings
+from rest_framework.throttling import BaseThrottle
+
+
+DEFAULTS = {
+    'CACHE_ALIAS': 'default',
+    # 'N/period' with a period of second, minute, hour or day; None disables.
+    'PHONE_RATE': '5/hour',
+    'IP_RATE': '30/hour',
+}
+
+PERIODS = {'s': 1, 'm': 60, 'h': 60 * 60, 'd': 24 * 60 * 60}
+
+
+def throttle_options():
+    return {**DEFAULTS, **getattr(settings, 'OTP_THROTTLES', {})}
+
+
+def parse_rate(rate):
+    """'5/hour' -> (5, 3600)"""
+    count, period = rate.split('/')
+    return int(count), PERIODS[period[0]]
+
+
+def take_token(cache, key, capacity, period, now=None):
+    """
+    Take a token from the bucket at `key`. Returns 0 on success, otherwise
+    the seconds until a token is available.
+    """
+    now = time.time() if now is None else now
+    refill_rate = capacity / period
+    tokens, updated_at = cache.get(key, (capacity, now))
+    tokens = min(capacity, tokens + (now - updated_at) * refill_rate)
+    if tokens < 1:
+        return (1 - tokens) / refill_rate
+    cache.set(key, (tokens - 1, now), timeout=math.ceil(period))
+    return 0
+
+
+class TokenBucketThrottle(BaseThrottle):
+    # Key of the rate in OTP_THROTTLES.
+    rate_setting = None
+
+    def get_bucket_id(self, request):
+        """The string the bucket is keyed on, or None to skip throttling."""
+        raise NotImplementedError
+
+    def allow_request(self, request, view):
+        options = throttle_options()
+        rate = options[self.rate_setting]
+        bucket_id = self.get_bucket_id(request)
+        if not rate or not bucket_id:
+            return True
+        capacity, period = parse_rate(rate)
+        # Hashed so raw phone numbers stay out of the cache and keys stay
+        # valid for memcached.
+        digest = hashlib.sha256(bucket_id.encode()).hexdigest()
+        key = f'otp-throttle:{self.rate_setting.lower()}:{digest}'
+        self._wait = take_token(caches[options['CACHE_ALIAS']], key, capacity, period)
+        return not self._wait
+
+    def wait(self):
+        return self._wait
+
+
+class PhoneNumberOTPThrottle(TokenBucketThrottle):
+    """Limits the codes sent to one phone number, whoever asks for them."""
+    rate_setting = 'PHONE_RATE'
+
+    def get_bucket_id(self, request):
+        phone_number = request.data.get('phone_number')
+        if not isinstance(phone_number, str):
+            # Left for the serializer to reject.
+            return None
+        return phone_number.strip()
+
+
+class IPAddressOTPThrottle(TokenBucketThrottle):
+    """Limits the codes one client address can ask for, across phone numbers."""
+    rate_setting = 'IP_RATE'
+
+    def get_bucket_id(self, request):
+        # Without NUM_PROXIES, DRF's get_ident believes X-Forwarded-For, so
+        # each request could claim a fresh address. Only trust the header
+        # when the proxies in front of the app are declared.
+        if api_settings.NUM_PROXIES is None:
+            return request.META.get('REMOTE_ADDR')
+        return self.get_ident(request)
@@ -1,8 +1,10 @@
 from django.urls import path
-from .views import SendOTPView, VerifyOTPView, LogoutView
+from .views import SendOTPView, VerifyOTPView, LogoutView, LeaderboardView, LeaderboardRankView
 
 urlpatterns = [
     path('send-otp/', SendOTPView.as_view(), name='send-otp'),
     path('verify-otp/', VerifyOTPView.as_view(), name='verify-otp'),
     path('logout/', LogoutView.as_view(), name='logout'),
+    path('leaderboard/', LeaderboardView.as_view(), name='leaderboard'),
+    path('leaderboard/me/', LeaderboardRankView.as_view(), name='leaderboard-me'),
 ]
@@ -1,13 +1,9 @@
-import random
-from django.utils import timezone
-from .models import OTP
+from .otp_delivery import delivery_queue
+from .otp_store import issue
 
 def send_otp(phone_number):
-    code = ''.join(random.choices('0123456789', k=6))
-    expires_at = timezone.now() + timezone.timedelta(minutes=2)
-    
-    otp = OTP.objects.create(phone_number=phone_number, code=code, expires_at=expires_at)
-    
-    print(f"OTP for {phone_number}: {code}")
+    # Replaces any earlier code of the phone number.
+    code = issue(phone_number)
 
-    return otp
\ No newline at end of file
+    # Sent by the delivery worker; the request doesn't wait for the gateway.
+    delivery_queue.enqueue(phone_number, f"Your verification code: {code}")
@@ -1,3 +1,5 @@
+from datetime import datetime, timezone as dt_timezone
+from django.contrib.auth.signals import user_logged_in
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework_simplejwt.tokens import RefreshToken
@@ -5,18 +7,30 @@ from rest_framework.permissions import IsAuthenticated
 from rest_framework_simplejwt.backends import TokenBackend
 from rest_framework_simplejwt.settings import api_settings
 from rest_framework import status
-from .serializers import SendOTPSerializer, VerifyOTPSerializer
-from .models import User, OTP, BlacklistedAccessToken
+from .serializers import (
+    SendOTPSerializer,
+    VerifyOTPSerializer,
+    LeaderboardQuerySerializer,
+    LeaderboardEntrySerializer,
+)
+from . import otp_store
+from .models import User
 from .utils import send_otp
+from .revocation import revocation_cache
+from .leaderboard import leaderboard
+from .throttling import IPAddressOTPThrottle, PhoneNumberOTPThrottle
 
 
 class SendOTPView(APIView):
+    # Checked before a row is written, so floods never reach the OTP table.
+    throttle_classes = [IPAddressOTPThrottle, PhoneNumberOTPThrottle]
+
     def post(self, request):
         serializer = SendOTPSerializer(data=request.data)
         if serializer.is_valid():
             phone_number = serializer.validated_data['phone_number']
 
-            # Generate and send OTP
+            # Save the code and queue the text message
             send_otp(phone_number)
 
             return Response({"message": "OTP sent successfully."})
@@ -30,16 +44,19 @@ class VerifyOTPView(APIView):
             phone_number = serializer.validated_data['phone_number']
             code = serializer.validated_data['code']
 
-            try:
-                otp_obj = OTP.objects.filter(
-                    phone_number=phone_number, code=code).latest('created_at')
-                if not otp_obj.is_valid():
-                    return Response({"message": "OTP has expired."}, status=400)
-            except OTP.DoesNotExist:
+            result = otp_store.verify(phone_number, code)
+            if result == otp_store.EXPIRED:
+                return Response({"message": "OTP has expired."}, status=400)
+            if result == otp_store.LOCKED:
+                return Response(
+                    {"message": "Too many attempts. Request a new code."}, status=400)
+            if result != otp_store.VALID:
                 return Response({"message": "Invalid OTP."}, status=400)
 
             user, created = User.objects.get_or_create(
                 phone_number=phone_number)
+            # Lets other apps react to the login, e.g. merge the session cart.
+            user_logged_in.send(sender=user.__class__, request=request, user=user)
 
             refresh = RefreshToken.for_user(user)
             access = refresh.access_token
@@ -78,8 +95,13 @@ class LogoutView(APIView):
             jti = payload.get("jti")
             print("JTI", jti)
             if jti:
-                # Add the token’s jti to the blacklist.
-                BlacklistedAccessToken.objects.get_or_create(jti=jti)
+                # Keep the token's expiry so the entry can be pruned afterwards.
+                expires_at = None
+                if payload.get("exp"):
+                    expires_at = datetime.fromtimestamp(
+                        payload["exp"], tz=dt_timezone.utc)
+                # Add the token’s jti to the blacklist and the revocation cache.
+                revocation_cache.revoke(jti, expires_at=expires_at)
             return Response(
                 {"detail": "Logout successful. This device’s token has now been revoked."},
                 status=status.HTTP_200_OK
@@ -89,3 +111,44 @@ class LogoutView(APIView):
                 {"detail": "Invalid token."},
                 status=status.HTTP_401_UNAUTHORIZED
             )
+
+
+def _serialize_entries(entries):
+    # One small query for the phone numbers of the users being shown.
+    phone_numbers = dict(User.objects.filter(
+        pk__in=[entry['user_id'] for entry in entries]
+    ).values_list('id', 'phone_number'))
+    return LeaderboardEntrySerializer(
+        entries, many=True, context={'phone_numbers': phone_numbers}).data
+
+
+class LeaderboardView(APIView):
+    """Top users by score: `?window=all|daily|weekly&limit=10`."""
+
+    def get(self, request):
+        query = LeaderboardQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        ranking = leaderboard.ranking(query.validated_data['window'])
+        entries = ranking.top(query.validated_data['limit'])
+        return Response({
+            'window': query.validated_data['window'],
+            'results': _serialize_entries(entries),
+        })
+
+
+class LeaderboardRankView(APIView):
+    """The current user's rank and the users just above and below them."""
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        query = LeaderboardQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        ranking = leaderboard.ranking(query.validated_data['window'])
+        user_id = request.user.pk
+        return Response({
+            'window': query.validated_data['window'],
+            'rank': ranking.rank(user_id),
+            'score': ranking.score_of(user_id),
+            'neighbours': _serialize_entries(
+                ranking.around(user_id, query.validated_data['radius'])),
+        })